@@ -0,0 +1,68 @@
+#--------------------------------------------------------------
+#               Analysis Cache Module
+#
+#--------------------------------------------------------------
+
+# Remembers the results of the analyses (date/format analysis, rankings, the data previews...)
+# so asking for the same thing twice doesn't redo the work. The keys hold the analysis, its
+# parameters and the data version of whatever it was computed from (an Employee or the registry),
+# and that version goes up whenever the shifts change, so a stale result is simply never asked for
+# again and falls off the end of the LRU. The cache is shared by every employee and holds at most
+# max_entries results.
+
+from collections import OrderedDict
+from instrumentation import instruments
+
+
+class AnalysisCache(object):
+    '''bounded LRU cache of analysis results shared by every employee'''
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() #{key : result} with the least recently used first
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def __str__(self):
+        '''one line summary of the cache for printing'''
+        return 'Analysis cache: {} hits | {} misses | {} results'.format(self.hits, self.misses, len(self.entries))
+
+
+    def get(self, key, compute):
+        '''returns the result stored under key, calling compute() and storing what it returns on a miss
+        dataframes come back as copies so changing one can't change what is cached'''
+        if key in self.entries:
+            self.hits += 1
+            instruments.count('analysis_cache_hits')
+            self.entries.move_to_end(key)
+            result = self.entries[key]
+        else:
+            self.misses += 1
+            instruments.count('analysis_cache_misses')
+            result = compute()
+            self.entries[key] = result
+            self.evict()
+        return result.copy() if hasattr(result, 'copy') else result
+
+
+    def evict(self):
+        '''removes the least recently used results until there are at most max_entries'''
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+    def clear(self):
+        '''removes every result and resets the hit/miss counters'''
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+    def stats(self):
+        '''returns the hit/miss counters and size of the cache as a dictionary'''
+        return {'hits': self.hits, 'misses': self.misses, 'results': len(self.entries), 'max_entries': self.max_entries}
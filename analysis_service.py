@@ -0,0 +1,326 @@
+#--------------------------------------------------------------
+#               Analysis Service Module
+#
+#--------------------------------------------------------------
+
+# A local HTTP service that keeps the employees loaded (and their analyses in Employee.results)
+# between requests, so a dashboard only pays for pandas and reading the excels once.
+# Everything is answered from memory as JSON, or as a generated xlsx for the .xlsx routes:
+#
+#   GET  /employees                         every employee with their shifts, efficiency and excel
+#   GET  /rank?k=&bottom=&min_hours=&format= the efficiency ranking (same options as Employee.rank)
+#   GET  /format_rank                       the team wide efficiency of every format
+#   GET  /date_analysis[.xlsx]?employee=&window=
+#   GET  /format_analysis[.xlsx]?employee=  one employee's analysis, or everyone's without employee
+#   POST /reload?employee=                  re-reads the excels changed on disk (or just that employee's)
+#   GET  /stats                             p50/p99 latency of every route
+#
+# Requests are handled one at a time - the employees, the registry and the analysis cache are shared
+# state, and once warm the answers take milliseconds. The service only listens on this machine by
+# default and never needs the network otherwise.
+
+import io
+import json
+import math
+import time
+import numbers
+import collections
+import tools
+from urllib.parse import urlsplit, parse_qs
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+pd = tools.lazy_import('pandas')
+
+XLSX_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class RequestError(Exception):
+    '''a request that can't be answered - status is the HTTP status sent back with the message'''
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+
+class LatencyRecorder(object):
+    '''the latencies of the last `keep` requests of every route, for the p50/p99'''
+
+    def __init__(self, keep=10000):
+        self.keep = keep
+        self.latencies = {} #{route : deque of seconds}
+        self.requests = collections.Counter() #{route : every request ever answered}
+
+
+    def record(self, route, seconds):
+        if route not in self.latencies:
+            self.latencies[route] = collections.deque(maxlen=self.keep)
+        self.latencies[route].append(seconds)
+        self.requests[route] += 1
+
+
+    def report(self):
+        '''returns {route : {'requests', 'p50_ms', 'p99_ms', 'max_ms'}} with an 'all' route over every request kept'''
+        routes = dict(self.latencies)
+        routes['all'] = [seconds for latencies in self.latencies.values() for seconds in latencies]
+        report = {}
+        for route, latencies in routes.items():
+            if not latencies:
+                continue
+            ordered = sorted(latencies)
+            report[route] = {'requests': sum(self.requests.values()) if route == 'all' else self.requests[route],
+                             'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+                             'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+                             'max_ms': round(ordered[-1] * 1000, 3)}
+        return report
+
+
+    def print_summary(self):
+        print('Request latency:')
+        tools.table_print(('Route', 'Requests', 'p50 ms', 'p99 ms', 'max ms'),
+                          [(route, stats['requests'], stats['p50_ms'], stats['p99_ms'], stats['max_ms']) for route, stats in self.report().items()], 18)
+
+
+
+class AnalysisService(object):
+    '''answers the service's routes from the employees already loaded in employee (the Employee class - passed in so the service
+    works on whichever copy of excel_data_analysis is running, including the one started as __main__)'''
+
+    def __init__(self, employee, window=30):
+        self.employee = employee
+        self.window = window
+        self.latency = LatencyRecorder()
+        self.routes = {('GET', '/employees'): self.employees,
+                       ('GET', '/rank'): self.rank,
+                       ('GET', '/format_rank'): self.format_rank,
+                       ('GET', '/date_analysis'): self.date_analysis,
+                       ('GET', '/date_analysis.xlsx'): self.date_analysis,
+                       ('GET', '/format_analysis'): self.format_analysis,
+                       ('GET', '/format_analysis.xlsx'): self.format_analysis,
+                       ('POST', '/reload'): self.reload,
+                       ('GET', '/stats'): self.stats}
+
+
+    def handle(self, method, url):
+        '''returns (status, content type, body bytes) for a request and records how long it took'''
+        start = time.perf_counter()
+        parts = urlsplit(url)
+        route = parts.path.rstrip('/') or '/'
+        try:
+            if (method, route) not in self.routes:
+                if any(path == route for _, path in self.routes):
+                    raise RequestError(405, method + ' is not allowed on ' + route)
+                raise RequestError(404, 'no route ' + route + ' - try ' + ', '.join(sorted(set(path for _, path in self.routes))))
+            # only the last value of a repeated parameter counts
+            parameters = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+            answer = self.routes[(method, route)](parameters, route.endswith('.xlsx'))
+            if isinstance(answer, bytes):
+                response = (200, XLSX_TYPE, answer)
+            else:
+                # NaN isn't JSON (ex: the efficiency of an employee without any valid shifts), so it's sent as null
+                response = (200, 'application/json', json.dumps(json_ready(answer), default=str, allow_nan=False).encode())
+        except RequestError as error:
+            response = (error.status, 'application/json', json.dumps({'error': str(error)}).encode())
+        except ValueError as error:
+            response = (400, 'application/json', json.dumps({'error': str(error)}).encode())
+        except Exception as error:
+            response = (500, 'application/json', json.dumps({'error': repr(error)}).encode())
+        self.latency.record(route if (method, route) in self.routes else 'unknown', time.perf_counter() - start)
+        return response
+
+
+    def employees(self, parameters, xlsx):
+        return [{'name': employee.name,
+                 'shifts': int(employee.summary.shifts),
+                 'efficiency': employee.overall_efficiency,
+                 'excel': None if employee.source is None else 'buffer' if isinstance(employee.source, bytes) else str(employee.source),
+                 'changed': employee.changed()}
+                for employee in self.employee.employee_list]
+
+
+    def rank(self, parameters, xlsx):
+        k = integer(parameters, 'k')
+        ranking = self.employee.rank(k=k, bottom=boolean(parameters, 'bottom'), min_hours=float(parameters.get('min_hours', 0)),
+                                     format=parameters.get('format'))
+        return records(ranking)
+
+
+    def format_rank(self, parameters, xlsx):
+        registry = self.employee.registry
+        return self.employee.results.get(('service_format_rank', registry.version), lambda: records(registry.format_ranking()))
+
+
+    def date_analysis(self, parameters, xlsx):
+        window = integer(parameters, 'window', self.window)
+        if window < 1:
+            raise ValueError('window has to be at least 1')
+        registry = self.employee.registry
+        if 'employee' in parameters:
+            employee = self.find(parameters['employee'])
+            analyses = lambda: {employee.name: employee.date_analysis(window)}
+            key = ('service_date', employee.serial, employee.version, window, xlsx)
+        else:
+            analyses = lambda: ordered(self.employee, registry.date_analyses(window))
+            key = ('service_date', 'registry', registry.version, window, xlsx)
+        # the answer (json records or the workbook) is only put together again once the shifts change
+        if xlsx:
+            return self.employee.results.get(key, lambda: workbook_bytes(tools.dfs_tabs_date, analyses(), window))
+        return self.employee.results.get(key, lambda: {name: records(analysis) for name, analysis in analyses().items()})
+
+
+    def format_analysis(self, parameters, xlsx):
+        registry = self.employee.registry
+        if 'employee' in parameters:
+            employee = self.find(parameters['employee'])
+            analyses = lambda: {employee.name: employee.format_analysis()}
+            key = ('service_format', employee.serial, employee.version, xlsx)
+        else:
+            analyses = lambda: ordered(self.employee, registry.format_analyses())
+            key = ('service_format', 'registry', registry.version, xlsx)
+        if xlsx:
+            return self.employee.results.get(key, lambda: workbook_bytes(tools.dfs_tabs_format, analyses()))
+        return self.employee.results.get(key, lambda: {name: records(analysis) for name, analysis in analyses().items()})
+
+
+    def reload(self, parameters, xlsx):
+        errors = {}
+        if 'employee' in parameters:
+            # a named employee is re-read even if the file looks the same
+            employee = self.find(parameters['employee'])
+            try:
+                employee.reload()
+                reloaded = [employee.name]
+            except Exception as error:
+                errors[employee.name] = error
+                reloaded = []
+        else:
+            reloaded = self.employee.reload_changed(errors)
+        return {'reloaded': reloaded, 'failed': {name: str(error) for name, error in errors.items()}}
+
+
+    def stats(self, parameters, xlsx):
+        return self.latency.report()
+
+
+    def find(self, name):
+        '''returns the employee called name (spaces are underscores in employee names)'''
+        name = name.replace(' ', '_')
+        for employee in self.employee.employee_list:
+            if employee.name == name:
+                return employee
+        raise RequestError(404, 'no employee called ' + name)
+
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    '''hands every request to the server's AnalysisService'''
+
+    def do_GET(self):
+        self.answer('GET')
+
+
+    def do_POST(self):
+        self.answer('POST')
+
+
+    def answer(self, method):
+        status, content_type, body = self.server.service.handle(method, self.path)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        # the latencies are kept by the service instead of a line per request
+        pass
+
+
+
+def records(dataframe):
+    '''turns an analysis dataframe into a list of {column : value} (dates are sent as YYYY-MM-DD text)'''
+    return dataframe.to_dict(orient='records')
+
+
+def json_ready(value):
+    '''returns value with every NaN or infinite number (and missing date) in it turned into None, which json sends as null'''
+    if isinstance(value, dict):
+        return {key: json_ready(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_ready(item) for item in value]
+    if isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral) and not math.isfinite(value):
+        return None
+    if value is pd.NaT:
+        return None
+    return value
+
+
+def ordered(employee, analyses):
+    '''returns {employee name : analysis} in the order the employees were loaded (the order of the excel's sheets)'''
+    return {loaded.name: analyses[loaded.name] for loaded in employee.employee_list}
+
+
+def workbook_bytes(export, analyses, *args):
+    '''writes analyses {sheet name : dataframe} with one of the tools.dfs_tabs_* exports into memory and returns the xlsx bytes'''
+    output = io.BytesIO()
+    export(list(analyses.values()), list(analyses), output, *args)
+    return output.getvalue()
+
+
+def integer(parameters, name, default=None):
+    if name not in parameters:
+        return default
+    try:
+        return int(parameters[name])
+    except ValueError:
+        raise ValueError(name + ' has to be a whole number')
+
+
+def boolean(parameters, name):
+    return parameters.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def percentile(ordered, percent):
+    '''nearest rank percentile of an already sorted list'''
+    return ordered[max(0, -(-len(ordered) * percent // 100) - 1)]
+
+
+def serve(employee, host='127.0.0.1', port=8050, window=30):
+    '''answers requests about the employees already loaded in employee (the Employee class) until interrupted, then prints the request latencies'''
+    server = HTTPServer((host, port), ServiceHandler)
+    server.service = AnalysisService(employee, window)
+    print('\nServing ' + str(len(employee.employee_list)) + ' employees on http://' + host + ':' + str(server.server_address[1]) + ' (Ctrl+C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.latency.print_summary()
+    return server.service
+
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import contextlib
+    import excel_data_analysis
+
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    shifts = pd.read_excel(os.path.join(data, 'Humanity_Shift_Employee001.xlsx'))
+    with tempfile.TemporaryDirectory() as directory:
+        # every shift is zero length, so the employee has no valid shifts and a NaN efficiency
+        every_row_bad = os.path.join(directory, 'every_row_bad.xlsx')
+        shifts.assign(clock_out=shifts['clock_in']).to_excel(every_row_bad, index=False)
+        Employee = excel_data_analysis.Employee
+        with contextlib.redirect_stdout(io.StringIO()):
+            Employee('every_row_bad', every_row_bad)
+            Employee('Joe', os.path.join(data, 'Humanity_Shift_Employee002.xlsx'))
+        service = AnalysisService(Employee)
+        status, content_type, body = service.handle('GET', '/employees')
+        constants = [] #any NaN or Infinity json.loads comes across (a strict parser refuses them)
+        answer = json.loads(body, parse_constant=constants.append)
+        print('Testing NaN sent as null:', status == 200 and not constants and answer[0]['efficiency'] is None and answer[1]['efficiency'] == Employee.employee_efficiency['Joe']
+              and json_ready({'a': [float('inf'), 1.5, pd.NaT, (2, float('nan'))]}) == {'a': [None, 1.5, None, [2, None]]})
@@ -0,0 +1 @@
+# Benchmarks of the analysis pipeline - see run.py (every stage) and export_benchmark.py (the excel exports).
@@ -0,0 +1,79 @@
+# Benchmark of the excel exports in tools.py: export time and peak memory against the number of employees.
+# Run it from the project folder with:  python -m benchmarks.export_benchmark [employee counts...]
+# Each count writes a date analysis and a format analysis workbook with one sheet per employee,
+# once in constant memory mode (the default) and once with the whole workbook held in memory.
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tools
+
+
+FORMATS = ['8-track', '16mm_film', '35mm_film', '8mm_film', 'betacam', 'betamax',
+           'cassette', 'dvtape', 'minidisc', 'minidv', 'quadruplex', 'vhs']
+
+
+def analysis_frames(employees, seed=0):
+    '''returns fake date analysis and format analysis dataframes (same columns as Employee's) for this many employees'''
+    rng = np.random.default_rng(seed)
+    date_dfs = []
+    format_dfs = []
+    for _ in range(employees):
+        worked = np.round(rng.uniform(4, 13, 30), 1)
+        digitized = np.round(rng.uniform(1, 10, 30), 1)
+        start = datetime.date(2018, 1, 1)
+        date_dfs.append(pd.DataFrame({'date_worked': [start + datetime.timedelta(days=int(day)) for day in np.sort(rng.choice(365, 30, replace=False))],
+                                      'hours_digitized': digitized,
+                                      'hours_worked': worked,
+                                      'efficiency': np.round(digitized / worked, 3)}))
+        format_dfs.append(pd.DataFrame({'Format': FORMATS,
+                                        'Format Efficiency': np.round(rng.uniform(0.3, 1.2, len(FORMATS)), 3),
+                                        'Sample Size': rng.integers(1, 20, len(FORMATS))}, index=FORMATS))
+    return date_dfs, format_dfs
+
+
+def measure(write, *args):
+    '''runs write(*args) and returns (seconds, peak MB of python memory)'''
+    tracemalloc.start()
+    start = time.perf_counter()
+    write(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 1024 / 1024
+
+
+def write_reports(date_dfs, format_dfs, sheets, directory, constant_memory):
+    with tools.ReportWriter(os.path.join(directory, 'date.xlsx'), constant_memory=constant_memory) as report:
+        for dataframe, sheet in zip(date_dfs, sheets):
+            report.date_sheet(dataframe, sheet)
+    with tools.ReportWriter(os.path.join(directory, 'format.xlsx'), constant_memory=constant_memory) as report:
+        for dataframe, sheet in zip(format_dfs, sheets):
+            report.format_sheet(dataframe, sheet)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Times the excel exports and their peak memory, in constant memory mode and not.')
+    parser.add_argument('counts', type=int, nargs='*', default=[10, 100, 500, 1000], help='employees (sheets) per workbook')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for employees in args.counts:
+            date_dfs, format_dfs = analysis_frames(employees)
+            sheets = ['Employee{:05d}'.format(number) for number in range(employees)]
+            constant_seconds, constant_peak = measure(write_reports, date_dfs, format_dfs, sheets, directory, True)
+            memory_seconds, memory_peak = measure(write_reports, date_dfs, format_dfs, sheets, directory, False)
+            results.append((employees, round(constant_seconds, 2), round(constant_peak, 1), round(memory_seconds, 2), round(memory_peak, 1)))
+
+    print('Export of date + format analysis workbooks (peak memory in MB, traced by tracemalloc):')
+    tools.table_print(('Employees', 'Const secs', 'Const MB', 'Buffer secs', 'Buffer MB'), results, 12)
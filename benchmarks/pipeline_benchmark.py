@@ -0,0 +1,57 @@
+# Benchmark of a whole run (read every excel, analyze, write both analysis excels) done in phases vs pipelined.
+# Run it from the project folder with:  python -m benchmarks.pipeline_benchmark [employee counts...]
+# Every employee gets a synthetic workbook of --rows shifts (see synthetic.py). The phased run is
+# Employee.from_files then analyze_all_date and analyze_all_format, the pipelined run is Employee.run_pipeline.
+
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tools
+from excel_data_analysis import Employee
+from benchmarks import synthetic
+
+
+def phased(namepaths, directory, workers):
+    Employee.from_files(namepaths, workers)
+    Employee.analyze_all_date(directory=directory)
+    Employee.analyze_all_format(directory=directory)
+
+
+def pipelined(namepaths, directory, workers):
+    Employee.run_pipeline(namepaths, directory, workers=workers)
+
+
+def measure(run, namepaths, directory, workers):
+    '''returns how many seconds run took end to end, starting from an empty registry'''
+    Employee.registry.clear()
+    Employee.results.clear()
+    start = time.perf_counter()
+    # the employees print a line each when they are created, which would just be timing the terminal
+    with contextlib.redirect_stdout(io.StringIO()):
+        run(namepaths, directory, workers)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Times a phased run against a pipelined run on synthetic shift workbooks.')
+    parser.add_argument('employees', type=int, nargs='*', default=[20, 100])
+    parser.add_argument('--rows', type=int, default=1000, help='shifts per employee')
+    parser.add_argument('--workers', type=int, help='processes reading the excels (default: one per core)')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for employees in args.employees:
+            namepaths = synthetic.generate(os.path.join(directory, str(employees)), employees * args.rows, employees)
+            phased_seconds = measure(phased, namepaths, directory, args.workers)
+            pipelined_seconds = measure(pipelined, namepaths, directory, args.workers)
+            results.append((employees, args.rows, round(phased_seconds, 2), round(pipelined_seconds, 2)))
+
+    print('Whole run in seconds (read + analyze + both excels):')
+    tools.table_print(('Employees', 'Rows each', 'Phased', 'Pipelined'), results, 12)
@@ -0,0 +1,99 @@
+# Benchmark of the indexed shift queries (shift_query.ShiftQuery) against filtering the registry's table with boolean masks.
+# Run it from the project folder with:  python -m benchmarks.query_benchmark [total rows...]
+# The shifts are synthetic (see synthetic.py) and built straight into dataframes, no excels are written.
+# Every query is run both ways, the results are checked to be the same and the best of --repeat runs is kept.
+
+import io
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tools
+import excel_data_analysis
+from excel_data_analysis import Employee
+from benchmarks import synthetic
+
+
+def load(rows, employees, seed=0):
+    '''registers employees synthetic employees holding rows shifts in total'''
+    rng = np.random.default_rng(seed)
+    Employee.registry.clear()
+    # the employees print a line each when they are created
+    with contextlib.redirect_stdout(io.StringIO()):
+        for employee in range(employees):
+            employee_rows = rows // employees + (1 if employee < rows % employees else 0)
+            dataframe = excel_data_analysis.shift_chunk(synthetic.shift_columns(employee_rows, employee + 1, rng), 0)
+            Employee('Employee{:05d}'.format(employee + 1), None, dataframe=dataframe)
+
+
+def naive_mask(table, employee_id=None, format=None, start=None, end=None):
+    '''the boolean mask a query would be without any index'''
+    mask = np.ones(len(table), dtype=bool)
+    if employee_id is not None:
+        mask &= (table['employee_id'] == employee_id).to_numpy()
+    if format is not None:
+        mask &= (table['format'] == format).to_numpy()
+    if start is not None:
+        mask &= (table['date_worked'] >= start).to_numpy()
+    if end is not None:
+        mask &= (table['date_worked'] <= end).to_numpy()
+    return mask
+
+
+def naive_aggregate(table, by, **filters):
+    return table[naive_mask(table, **filters)].groupby(by, observed=True)[['hours_digitized', 'hours_worked']].sum()
+
+
+def best(function, repeat):
+    '''returns the result of function() and the fewest milliseconds it took over repeat runs'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, min(times) * 1000
+
+
+# (name, filters) of the queries timed - employee 1 and vhs are always in the synthetic data
+QUERIES = [('employee', {'employee_id': 1}),
+           ('format', {'format': 'vhs'}),
+           ('month', {'start': '2010-03-01', 'end': '2010-03-31'}),
+           ('employee+format+month', {'employee_id': 1, 'format': 'vhs', 'start': '2010-03-01', 'end': '2010-03-31'})]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Times indexed shift queries against boolean mask filtering.')
+    parser.add_argument('rows', type=int, nargs='*', default=[10000, 100000, 1000000])
+    parser.add_argument('--employees', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5, help='runs of every query (the fastest is kept)')
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        load(rows, min(args.employees, rows))
+        table = Employee.registry.table
+        start = time.perf_counter()
+        query = Employee.query()
+        results.append((rows, 'build indexes', '', round((time.perf_counter() - start) * 1000, 3), '', ''))
+
+        for name, filters in QUERIES:
+            positions, indexed = best(lambda: query.rows(**filters), args.repeat)
+            mask, naive = best(lambda: naive_mask(table, **filters), args.repeat)
+            assert np.array_equal(positions, np.flatnonzero(mask)), name
+            results.append((rows, name, len(positions), round(indexed, 3), round(naive, 3), round(naive / indexed, 1)))
+
+        # the "efficiency per employee and format in a month" question
+        filters = QUERIES[2][1]
+        grouped, indexed = best(lambda: query.aggregate(by=['employee_id', 'format'], **filters), args.repeat)
+        expected, naive = best(lambda: naive_aggregate(table, ['employee_id', 'format'], **filters), args.repeat)
+        assert np.allclose(grouped['hours_worked'].sum(), expected['hours_worked'].sum())
+        results.append((rows, 'aggregate month by employee+format', len(grouped), round(indexed, 3), round(naive, 3), round(naive / indexed, 1)))
+    Employee.registry.clear()
+
+    print('Milliseconds per query (best of {}):'.format(args.repeat))
+    tools.table_print(('Rows', 'Query', 'Matches', 'Indexed', 'Naive', 'Speedup'), results, 14)
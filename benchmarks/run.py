@@ -0,0 +1,130 @@
+# Benchmark of every stage of an analysis run on synthetic shift workbooks (see synthetic.py).
+# Run it from the project folder with:
+#   python -m benchmarks.run --rows 1000 100000 --employees 1 100 --output results.json
+# Every (rows, employees) pair is its own run. The stages timed are:
+#   read            pd.read_excel of every workbook
+#   validate        shift_validation.ShiftValidator.check of every workbook (the rows it refuses are left out, like a real run)
+#   date_parse      parse_shift_dates on every date_worked column
+#   efficiency      add_shift_columns (tools.time_dif_series for hours_worked + efficiency)
+#   register        creating the Employee instances (running totals + registry)
+#   ranking         Employee.rank over everyone
+#   date_analysis   the registry's date analysis of everyone
+#   format_analysis the registry's format analysis of everyone
+#   export_date     tools.dfs_tabs_date of the date analyses
+#   export_format   tools.dfs_tabs_format of the format analyses
+# The results are written as json (along with the git commit) so two commits can be compared.
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tools
+import excel_data_analysis
+from excel_data_analysis import Employee
+from shift_validation import ShiftValidator
+from benchmarks import synthetic
+
+pd = tools.lazy_import('pandas')
+
+STAGES = ['read', 'validate', 'date_parse', 'efficiency', 'register', 'ranking',
+          'date_analysis', 'format_analysis', 'export_date', 'export_format']
+
+
+def run(rows, employees, directory, seed=0):
+    '''generates the workbooks for one configuration and returns {stage : seconds} for a full analysis of them'''
+    data_directory = os.path.join(directory, 'data_{}_{}'.format(rows, employees))
+    namepaths = synthetic.generate(data_directory, rows, employees, seed)
+    seconds = dict.fromkeys(STAGES, 0.0)
+
+    def timed(stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        seconds[stage] += time.perf_counter() - start
+        return result
+
+    Employee.registry.clear()
+    # the employees print a line each when they are created, which would just be timing the terminal
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, fullpath in namepaths:
+            dataframe = timed('read', pd.read_excel, fullpath)
+            dataframe = timed('validate', ShiftValidator().check, dataframe)
+            dataframe['date_worked'] = timed('date_parse', excel_data_analysis.parse_shift_dates, dataframe['date_worked'])
+            dataframe = timed('efficiency', excel_data_analysis.add_shift_columns, dataframe)
+            timed('register', Employee, name, fullpath, dataframe)
+
+        timed('ranking', Employee.rank)
+        date_analyses = timed('date_analysis', Employee.registry.date_analyses, 30)
+        format_analyses = timed('format_analysis', Employee.registry.format_analyses)
+
+        names = [employee.name for employee in Employee.employee_list]
+        timed('export_date', tools.dfs_tabs_date, [date_analyses[name] for name in names], names, os.path.join(directory, 'date_analysis.xlsx'))
+        timed('export_format', tools.dfs_tabs_format, [format_analyses[name] for name in names], names, os.path.join(directory, 'format_analysis.xlsx'))
+    Employee.registry.clear()
+
+    return {stage: round(seconds[stage], 4) for stage in STAGES}
+
+
+def git_commit():
+    '''returns the commit the benchmark ran on (or None outside of a git checkout)'''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Times every stage of the analysis on synthetic shift workbooks.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 1000, 100000],
+                        help='total shifts over all employees (10 to 1000000)')
+    parser.add_argument('--employees', type=int, nargs='+', default=[1, 10, 100],
+                        help='number of employees/workbooks (1 to 10000)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--output', help='json file to write the results to (printed as a table either way)')
+    args = parser.parse_args(argv)
+    for rows in args.rows:
+        if not 10 <= rows <= 10 ** 6:
+            parser.error('--rows must be between 10 and 1000000')
+    for employees in args.employees:
+        if not 1 <= employees <= 10 ** 4:
+            parser.error('--employees must be between 1 and 10000')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            for employees in args.employees:
+                # every employee needs at least one shift to have an efficiency
+                if employees > rows:
+                    continue
+                seconds = run(rows, employees, directory, args.seed)
+                results.append({'rows': rows, 'employees': employees, 'seconds': seconds,
+                                'total': round(sum(seconds.values()), 4)})
+
+    tools.table_print(['Rows', 'Employees'] + STAGES + ['total'],
+                      [[result['rows'], result['employees']] + [result['seconds'][stage] for stage in STAGES] + [result['total']] for result in results], 16)
+
+    if args.output:
+        report = {'commit': git_commit(),
+                  'python': platform.python_version(),
+                  'pandas': pd.__version__,
+                  'seed': args.seed,
+                  'results': results}
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print('Results written to ' + args.output)
+
+
+if __name__ == "__main__":
+    main()
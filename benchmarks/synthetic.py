@@ -0,0 +1,61 @@
+# Synthetic shift data shaped like data/Humanity_Shift_Employee*.xlsx for the benchmarks.
+# Every employee gets one workbook with a 'data' sheet and the same 7 columns as the real ones:
+#   shift_id | date_worked (YYYY/MM/DD) | clock_in (H:MM:SS) | clock_out (H:MM:SS) | hours_digitized | format | employee_id
+# The rows are spread as evenly as possible over the employees, and the same seed always writes the same data.
+
+import os
+import datetime
+
+import numpy as np
+import xlsxwriter
+
+
+FORMATS = ['8-track', '16mm_film', '35mm_film', '8mm_film', 'betacam', 'betamax',
+           'cassette', 'dvtape', 'minidisc', 'minidv', 'quadruplex', 'vhs']
+
+COLUMNS = ['shift_id', 'date_worked', 'clock_in', 'clock_out', 'hours_digitized', 'format', 'employee_id']
+
+
+def shift_columns(rows, employee_id, rng):
+    '''returns {column : list of values} for rows random shifts of one employee, with the same value ranges as the sample data'''
+    first_day = datetime.date(2000, 1, 1).toordinal()
+    days = rng.integers(0, 365 * 19, rows) + first_day
+    # clock in sometime in the morning and work 4 to 13 hours (the sample data never crosses midnight)
+    clock_in = rng.integers(7 * 3600, 11 * 3600, rows)
+    clock_out = clock_in + rng.integers(4 * 3600, 13 * 3600, rows)
+    return {'shift_id': np.arange(1, rows + 1).tolist(),
+            'date_worked': [datetime.date.fromordinal(int(day)).strftime('%Y/%m/%d') for day in days],
+            'clock_in': [clock_text(seconds) for seconds in clock_in.tolist()],
+            'clock_out': [clock_text(seconds) for seconds in clock_out.tolist()],
+            'hours_digitized': np.round(rng.uniform(1, 10, rows), 1).tolist(),
+            'format': [FORMATS[index] for index in rng.integers(0, len(FORMATS), rows).tolist()],
+            'employee_id': [employee_id] * rows}
+
+
+def clock_text(seconds):
+    '''turns seconds since midnight into H:MM:SS text like the clock columns of the sample data'''
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def write_workbook(file_name, columns):
+    '''writes the shift columns to file_name in a sheet called data, one row at a time (constant memory)'''
+    workbook = xlsxwriter.Workbook(file_name, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('data')
+    worksheet.write_row(0, 0, COLUMNS)
+    for row, values in enumerate(zip(*[columns[column] for column in COLUMNS]), start=1):
+        worksheet.write_row(row, 0, values)
+    workbook.close()
+
+
+def generate(directory, rows, employees, seed=0):
+    '''writes employees workbooks holding rows shifts in total to directory and returns [(employee name, fullpath)]'''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    namepaths = []
+    for employee in range(employees):
+        # the first rows % employees employees get one extra shift
+        employee_rows = rows // employees + (1 if employee < rows % employees else 0)
+        fullpath = os.path.join(directory, 'Humanity_Shift_Employee{:05d}.xlsx'.format(employee + 1))
+        write_workbook(fullpath, shift_columns(employee_rows, employee + 1, rng))
+        namepaths.append(('Employee{:05d}'.format(employee + 1), fullpath))
+    return namepaths
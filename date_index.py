@@ -0,0 +1,69 @@
+#--------------------------------------------------------------
+#               Date Index Module
+#
+#--------------------------------------------------------------
+
+# The row positions of an employee's shifts in date order, kept alongside the dates themselves
+# already sorted. Built once (one stable sort) and then every date question - the last N shifts,
+# a date range, a calendar month - is a binary search into the sorted dates and a slice of the
+# positions, so the dataframe never has to be sorted again. New shifts are merged in with extend.
+
+import datetime
+import tools
+
+np = tools.lazy_import('numpy')
+
+
+class DateIndex(object):
+    '''row positions of a shift dataframe sorted by date_worked (stable, so shifts on the same day keep excel order) and the sorted dates'''
+
+    def __init__(self, dates):
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.order = np.argsort(dates, kind='mergesort')
+        self.dates = dates[self.order]
+
+
+    def __len__(self):
+        return len(self.order)
+
+
+    def extend(self, dates):
+        '''adds the dates of rows appended after the ones already indexed - the index stays sorted and older rows stay first on equal dates'''
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        positions = np.concatenate([self.order, np.arange(len(self.order), len(self.order) + len(dates))])
+        merged = np.concatenate([self.dates, dates])
+        # the old part is already sorted so the stable sort only really has to place the new rows
+        order = np.argsort(merged, kind='mergesort')
+        self.order = positions[order]
+        self.dates = merged[order]
+
+
+    def last(self, shifts):
+        '''returns the row positions of the last `shifts` shifts worked, oldest first'''
+        return self.order[max(len(self.order) - shifts, 0):]
+
+
+    def between(self, start=None, end=None):
+        '''returns the row positions of the shifts from start to end (both included, either can be left open), oldest first'''
+        low = 0 if start is None else np.searchsorted(self.dates, np.datetime64(start, 'ns'), side='left')
+        high = len(self.dates) if end is None else np.searchsorted(self.dates, np.datetime64(end, 'ns'), side='right')
+        return self.order[low:high]
+
+
+    def last_days(self, days):
+        '''returns the row positions of the shifts in the `days` calendar days up to (and including) the latest day worked'''
+        if not len(self.dates):
+            return self.order
+        end = self.dates[-1]
+        return self.between(end - np.timedelta64(days - 1, 'D'), end)
+
+
+    def calendar(self, year, month=None):
+        '''returns the row positions of the shifts in a calendar year, or in one month of it'''
+        if month is None:
+            start, stop = datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+        else:
+            start = datetime.date(year, month, 1)
+            stop = datetime.date(year + month // 12, month % 12 + 1, 1)
+        # the window ends the day before the next year/month starts
+        return self.between(start, stop - datetime.timedelta(days=1))
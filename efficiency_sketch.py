@@ -0,0 +1,211 @@
+#--------------------------------------------------------------
+#               Efficiency Sketch Module
+#
+#--------------------------------------------------------------
+
+# The distribution of shift efficiencies (not just hours digitized / hours worked over all of them)
+# kept in a fixed amount of memory no matter how many shifts go through it:
+#   - count, mean and the sum of squared differences from the mean (standard deviation), merged
+#     chunk by chunk with the parallel formula of Chan et al. - the mean itself comes from an exact
+#     sum (math.fsum, like ShiftSummary's hours) so it doesn't depend on how the shifts were chunked
+#   - min, max and how many shifts are outliers (efficiency above OUTLIER)
+#   - quantiles (median, p10, p90...) from log spaced buckets like DDSketch: every efficiency goes in
+#     the bucket i with gamma^(i-1) < efficiency <= gamma^i, so any quantile comes back within
+#     `accuracy` (1%) of the true value, and there are only a few hundred buckets for the whole range.
+# Two sketches are merged by adding their bucket counts and moments, so sketches of chunks, files,
+# employees or worker processes combine into the sketch of all their shifts without the rows.
+
+import math
+import tools
+
+np = tools.lazy_import('numpy')
+
+# efficiencies above this are outliers (the date analysis chart stops at 2.2)
+OUTLIER = 2
+
+# efficiencies closer to 0 than this share one bucket so a stray tiny value can't spread the buckets out
+SMALLEST = 1e-6
+
+
+class EfficiencySketch(object):
+    '''mergeable one pass summary of efficiencies: moments, min/max, outlier count and quantiles to within accuracy (relative)'''
+
+    def __init__(self, accuracy=0.01, max_buckets=2048):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.max_buckets = max_buckets
+        self.positive = {} #{bucket : count} of the efficiencies above 0
+        self.negative = {} #{bucket : count} of minus the efficiencies below 0 (clocked out before clocking in)
+        self.zeros = 0
+        self.count = 0 #finite efficiencies
+        self.mean = 0.0
+        self.total = (0.0, 0.0) #exact sum of the finite efficiencies as (sum, remainder) so the mean is the same however they came in
+        self.m2 = 0.0 #sum of squared differences from the mean
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.outliers = 0
+        self.invalid = 0 #NaN or infinite efficiencies (0 hours worked) - counted, but kept out of the statistics
+
+
+    def __len__(self):
+        return self.count + self.invalid
+
+
+    def __setstate__(self, state):
+        # sketches pickled (in a saved ShiftSummary) before the exact total was kept start it from their mean
+        state.setdefault('total', (state['mean'] * state['count'], 0.0))
+        self.__dict__.update(state)
+
+
+    def update(self, values):
+        '''adds efficiencies (an array, list or series) to the sketch'''
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return self
+        finite = np.isfinite(values)
+        # an infinite efficiency is still an outlier, a NaN one isn't anything
+        self.outliers += int(np.count_nonzero(values > OUTLIER))
+        self.invalid += len(values) - int(np.count_nonzero(finite))
+        values = values[finite]
+        if not len(values):
+            return self
+
+        mean = float(values.mean())
+        self._add_moments(len(values), tuple(values.tolist()), mean, float(np.square(values - mean).sum()), float(values.min()), float(values.max()))
+        self.zeros += int(np.count_nonzero(values == 0))
+        self._add_values(self.positive, values[values > 0])
+        self._add_values(self.negative, -values[values < 0])
+        return self
+
+
+    def merge(self, other):
+        '''adds everything in another sketch (with the same accuracy) to this one and returns it'''
+        if other.gamma != self.gamma:
+            raise ValueError('can only merge sketches with the same accuracy')
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for bucket, count in other_store.items():
+                store[bucket] = store.get(bucket, 0) + count
+            self._collapse(store)
+        self.zeros += other.zeros
+        self.outliers += other.outliers
+        self.invalid += other.invalid
+        if other.count:
+            self._add_moments(other.count, other.total, other.mean, other.m2, other.minimum, other.maximum)
+        return self
+
+
+    def quantile(self, q):
+        '''returns the efficiency at quantile q (0 to 1) to within the sketch's accuracy - NaN if the sketch is empty'''
+        if not 0 <= q <= 1:
+            raise ValueError('q has to be between 0 and 1')
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        # going up from the most negative efficiency
+        for bucket in sorted(self.negative, reverse=True):
+            seen += self.negative[bucket]
+            if seen > rank:
+                return self._clamp(-self._value(bucket))
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for bucket in sorted(self.positive):
+            seen += self.positive[bucket]
+            if seen > rank:
+                return self._clamp(self._value(bucket))
+        return self.maximum
+
+
+    def std(self):
+        '''sample standard deviation of the efficiencies (NaN with fewer than 2)'''
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+
+    def statistics(self):
+        '''returns {'Shifts', 'Mean', 'Std', 'P10', 'Median', 'P90', 'Outliers'} - everything rounded to 3 places like the efficiencies'''
+        return {'Shifts': len(self),
+                'Mean': round(self.mean, 3) if self.count else math.nan,
+                'Std': round(self.std(), 3),
+                'P10': round(self.quantile(0.1), 3),
+                'Median': round(self.quantile(0.5), 3),
+                'P90': round(self.quantile(0.9), 3),
+                'Outliers': self.outliers}
+
+
+    def _add_moments(self, count, total, mean, m2, minimum, maximum):
+        # total is any tuple of floats that adds up exactly to the group's sum (its values, or another sketch's total)
+        # Chan et al. - the squared differences of two groups combined without going back to the values
+        combined = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta * delta * self.count * count / combined
+        self.count = combined
+        # fsum rounds the exact sum correctly, and the remainder carries what got rounded off into the next merge
+        exact = math.fsum(self.total + total)
+        self.total = (exact, math.fsum(self.total + total + (-exact,)))
+        self.mean = exact / combined
+        self.minimum = min(self.minimum, minimum)
+        self.maximum = max(self.maximum, maximum)
+
+
+    def _add_values(self, store, values):
+        if not len(values):
+            return
+        buckets = np.ceil(np.log(np.maximum(values, SMALLEST)) / math.log(self.gamma)).astype(np.int64)
+        # the buckets of a chunk are a small range of integers, so counting them is one bincount
+        lowest = int(buckets.min())
+        counts = np.bincount(buckets - lowest)
+        for offset in np.flatnonzero(counts).tolist():
+            bucket = lowest + offset
+            store[bucket] = store.get(bucket, 0) + int(counts[offset])
+        self._collapse(store)
+
+
+    def _collapse(self, store):
+        # past max_buckets the lowest buckets are folded into one (only the smallest quantiles lose accuracy)
+        if len(store) > self.max_buckets:
+            lowest = sorted(store)[:len(store) - self.max_buckets + 1]
+            store[lowest[-1]] = sum(store.pop(bucket) for bucket in lowest)
+
+
+    def _value(self, bucket):
+        # the middle of the bucket in relative terms, so anything in it is within accuracy of this
+        return 2 * self.gamma ** bucket / (self.gamma + 1)
+
+
+    def _clamp(self, value):
+        return min(max(value, self.minimum), self.maximum)
+
+
+
+def merged(sketches):
+    '''returns one new sketch of everything in sketches (they are left as they are)'''
+    result = None
+    for sketch in sketches:
+        if result is None:
+            result = EfficiencySketch(sketch.accuracy, sketch.max_buckets)
+        result.merge(sketch)
+    return EfficiencySketch() if result is None else result
+
+
+
+if __name__ == "__main__":
+    random = np.random.default_rng(0)
+    # efficiencies like the real ones, plus the odd ones: clocked out before clocking in, zeros, NaN/infinite (0 hours worked)
+    values = np.concatenate([random.lognormal(-0.5, 0.6, 10000), -random.lognormal(-1, 0.5, 50), np.zeros(20), [np.nan, np.inf]])
+    random.shuffle(values)
+
+    # sketches of uneven chunks merged together are the sketch of one pass over everything
+    single = EfficiencySketch().update(values)
+    chunks = merged([EfficiencySketch().update(values[start:start + 777]) for start in range(0, len(values), 777)])
+    print('Testing merge vs single pass:', single.statistics() == chunks.statistics() and single.positive == chunks.positive
+          and single.negative == chunks.negative and (single.count, single.zeros, single.invalid, single.minimum, single.maximum)
+          == (chunks.count, chunks.zeros, chunks.invalid, chunks.minimum, chunks.maximum) and single.mean == chunks.mean)
+
+    # the moments are the exact ones and every quantile is within accuracy of the efficiency at that rank
+    finite = np.sort(values[np.isfinite(values)])
+    quantiles = [0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1]
+    print('Testing sketch statistics:', single.mean == math.fsum(finite.tolist()) / len(finite) and math.isclose(single.std(), finite.std(ddof=1))
+          and single.outliers == int(np.count_nonzero(values > OUTLIER)) and len(single) == len(values)
+          and all(abs(single.quantile(q) - finite[int(q * (len(finite) - 1))]) <= single.accuracy * abs(finite[int(q * (len(finite) - 1))])
+                  for q in quantiles))
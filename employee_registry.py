@@ -0,0 +1,382 @@
+#--------------------------------------------------------------
+#               Employee Registry Module
+#
+#--------------------------------------------------------------
+
+# Keeps every employee's shifts in ONE table (with a categorical 'employee' column) instead of
+# a list of small dataframes, so the cross-employee work (previews, ranking, date analysis...)
+# is done as grouped operations over that table rather than a python loop over every frame.
+# The table is only concatenated when it's needed and rebuilt after employees are added.
+# Hours are summed per group with math.fsum, which gives the same totals no matter how
+# the rows are ordered or chunked, so grouped results match each Employee's own summary.
+
+import math
+import heapq
+import tools
+
+pd = tools.lazy_import('pandas')
+np = tools.lazy_import('numpy')
+
+
+class EmployeeRegistry(object):
+    '''the employees entered along with one combined shift table and the row range each employee has in it'''
+
+    def __init__(self):
+        self.employees = [] #every Employee instance, in the order they were added
+        self.frames = [] #each employee's dataframe (None for streamed employees) waiting to go in the table
+        self._stale = set() #positions in frames of employees with appended shifts that aren't in their frame yet
+        self.efficiency = {} #{employee name : overall efficiency}
+        self.ranges = {} #{employee name : (first row, last row + 1)} in the table
+        self.version = 0 #goes up every time an employee is added or their shifts change (cached analyses of everyone use it)
+        self._table = None
+        self._format_table = None
+        self._query = None
+        self._rollups = None
+
+
+    def __len__(self):
+        return len(self.employees)
+
+
+    def add(self, employee):
+        '''registers an employee - its shifts go in the table the next time it is built'''
+        self.employees.append(employee)
+        self.frames.append(employee.dataframe)
+        self.efficiency[employee.name] = employee.overall_efficiency
+        self.version += 1
+        self._table = None
+        self._format_table = None
+        self._query = None
+        # rollups that are already built only get the new employee's shifts added
+        if self._rollups is not None and employee.dataframe is not None:
+            self._rollups.update(employee.dataframe, employee.name)
+
+
+    def update(self, employee, new_shifts=None):
+        '''refreshes an employee's dataframe and efficiency after their shifts changed - new_shifts are the rows that were appended
+        (if that's all that changed) so the rollups only have to add those'''
+        position = self.employees.index(employee)
+        if new_shifts is None:
+            self.frames[position] = employee.dataframe
+            self._stale.discard(position)
+        else:
+            # the employee only puts the appended rows on its dataframe when it's read, so that waits for the next table too
+            self._stale.add(position)
+        self.efficiency[employee.name] = employee.overall_efficiency
+        self.version += 1
+        self._table = None
+        self._format_table = None
+        self._query = None
+        if self._rollups is not None and self.frames[position] is not None:
+            if new_shifts is None:
+                # the whole excel was read again so the employee's old sums can't be kept
+                self._rollups.remove(employee.name)
+                self._rollups.update(employee.dataframe, employee.name)
+            else:
+                self._rollups.update(new_shifts, employee.name)
+
+
+    def clear(self):
+        '''forgets every employee'''
+        del self.employees[:]
+        del self.frames[:]
+        self._stale.clear()
+        self.efficiency.clear()
+        self.ranges.clear()
+        self.version += 1
+        self._table = None
+        self._format_table = None
+        self._query = None
+        self._rollups = None
+
+
+    @property
+    def table(self):
+        '''every loaded employee's shifts in one dataframe with an 'employee' column - each frame keeps its own index'''
+        if self._table is None:
+            for position in self._stale:
+                self.frames[position] = self.employees[position].dataframe
+            self._stale.clear()
+            names = []
+            frames = []
+            self.ranges.clear()
+            start = 0
+            for employee, dataframe in zip(self.employees, self.frames):
+                # streamed employees never had their shifts in memory so they aren't in the table
+                if dataframe is None:
+                    continue
+                names.append(employee.name)
+                frames.append(dataframe)
+                self.ranges[employee.name] = (start, start + len(dataframe))
+                start += len(dataframe)
+
+            if frames:
+                table = concat_shifts(frames)
+            else:
+                table = pd.DataFrame()
+            # the categories are in the order the employees were added so grouping keeps that order
+            lengths = [self.ranges[name][1] - self.ranges[name][0] for name in names]
+            table['employee'] = pd.Categorical.from_codes(np.repeat(np.arange(len(names)), lengths), categories=names)
+            self._table = table
+        return self._table
+
+
+    def query(self):
+        '''returns a shift_query.ShiftQuery over the table - its indexes are built the first time and kept until the shifts change'''
+        if self._query is None:
+            # imported here because shift_query uses fsum_groups from this module
+            from shift_query import ShiftQuery
+            self._query = ShiftQuery(self.table)
+        return self._query
+
+
+    def rollups(self):
+        '''returns the shift_rollups.ShiftRollups of everyone in the table - built the first time, then kept up to date as employees are added or change'''
+        if self._rollups is None:
+            # imported here because shift_rollups uses fsum_groups from this module
+            from shift_rollups import ShiftRollups
+            self._rollups = ShiftRollups()
+            self._rollups.update(self.table)
+        return self._rollups
+
+
+    def shifts(self, name):
+        '''returns one employee's rows of the table (without the employee column)'''
+        start, stop = self.ranges[name]
+        return self.table.iloc[start:stop].drop(columns='employee')
+
+
+    def previews(self, rows=7):
+        '''returns {employee name : first rows of their shifts} for every employee'''
+        table = self.table
+        previews = {}
+        if len(table):
+            heads = table.groupby('employee', sort=False, observed=True).head(n=rows)
+            for name, head in heads.groupby('employee', sort=False, observed=True):
+                previews[name] = head.drop(columns='employee')
+        # streamed employees bring their own preview (and employees without any shifts have an empty one)
+        for employee, dataframe in zip(self.employees, self.frames):
+            if dataframe is None:
+                previews[employee.name] = employee.summary.preview.head(n=rows)
+            elif employee.name not in previews:
+                previews[employee.name] = dataframe.head(n=rows)
+        return previews
+
+
+    def rank(self, k=None, bottom=False, min_hours=0, format=None):
+        '''returns a dataframe of Rank, Employee, Efficiency, Hours Worked and Shifts - most efficient first
+        k only keeps the top k (or bottom k with bottom=True) without sorting everyone, min_hours leaves out employees
+        with fewer hours worked, and format ranks by the efficiency of just that format. Ties are broken by name.'''
+        candidates = []
+        for employee in self.employees:
+            summary = employee.summary
+            if format is None:
+                efficiency, hours, shifts = self.efficiency[employee.name], summary.hours_worked, summary.shifts
+            elif format in summary.formats:
+                digitized, worked, shifts = summary.formats[format]
+                efficiency, hours = float(np.round(digitized[0] / worked[0], 3)), worked[0]
+            else:
+                continue
+            # employees without enough hours (or without an efficiency at all) aren't ranked
+            if hours < min_hours or hours == 0 or math.isnan(efficiency):
+                continue
+            candidates.append((-efficiency, employee.name, hours, shifts))
+
+        # a heap picks the k best (or worst) in O(n log k) - sorted() is only used when everyone is wanted
+        if k is None:
+            chosen = sorted(candidates)
+        elif bottom:
+            # the k largest are the tail of the full ranking, ties included (the last names alphabetically)
+            chosen = sorted(heapq.nlargest(k, candidates))
+        else:
+            chosen = heapq.nsmallest(k, candidates)
+
+        # bottom picks are numbered from the end of the full ranking
+        first = len(candidates) - len(chosen) + 1 if bottom and k is not None else 1
+        return pd.DataFrame({'Rank': np.arange(first, first + len(chosen), dtype=np.int64),
+                             'Employee': [candidate[1] for candidate in chosen],
+                             'Efficiency': [-candidate[0] for candidate in chosen],
+                             'Hours Worked': [candidate[2] for candidate in chosen],
+                             'Shifts': np.array([candidate[3] for candidate in chosen], dtype=np.int64)})
+
+
+    def date_analyses(self, window=30):
+        '''returns {employee name : date analysis} for every employee, done with one sort over the whole table'''
+        table = self.table
+        analyses = {}
+        if len(table):
+            # sorting by employee then date (stable, so shifts on the same day stay in excel order) and keeping each employee's last days
+            datesorted = table.sort_values(by=['employee', 'date_worked'], kind='mergesort')
+            latest = datesorted.groupby('employee', sort=False, observed=True).tail(n=window)
+            # the analyses show plain dates like they always have (only these few rows get turned back)
+            latest = latest.assign(date_worked=latest['date_worked'].dt.date)
+            for name, dates in latest.groupby('employee', sort=False, observed=True):
+                analyses[name] = dates.loc[:, ('date_worked', 'hours_digitized', 'hours_worked', 'efficiency')]
+        for employee, dataframe in zip(self.employees, self.frames):
+            if dataframe is None:
+                analyses[employee.name] = employee.summary.date_analysis(window)
+            elif employee.name not in analyses:
+                # no shifts at all (ex: every row was quarantined)
+                analyses[employee.name] = dataframe.loc[:, ('date_worked', 'hours_digitized', 'hours_worked', 'efficiency')]
+        return analyses
+
+
+    def format_table(self):
+        '''returns one row per (employee, format) with the hours sums, Format Efficiency and Sample Size - all computed in one grouped pass over the table'''
+        if self._format_table is None:
+            table = self.table
+            rows = []
+            if len(table):
+                employee_codes = table['employee'].cat.codes.to_numpy()
+                format_codes, formats = pd.factorize(table['format'], sort=True)
+                formats = np.asarray(formats)
+                names = table['employee'].cat.categories
+                digitized, worked, counts, firsts = fsum_groups(employee_codes.astype(np.int64) * len(formats) + format_codes, table['hours_digitized'], table['hours_worked'])
+                rows.append(pd.DataFrame({'employee': names[employee_codes[firsts]],
+                                          'Format': formats[format_codes[firsts]],
+                                          'hours_digitized': digitized,
+                                          'hours_worked': worked,
+                                          'Sample Size': counts}))
+            # streamed employees already have their per format sums in their summary
+            for employee, dataframe in zip(self.employees, self.frames):
+                if dataframe is None:
+                    formats = sorted(employee.summary.formats)
+                    totals = [employee.summary.formats[format] for format in formats]
+                    rows.append(pd.DataFrame({'employee': employee.name,
+                                              'Format': formats,
+                                              'hours_digitized': [total[0][0] for total in totals],
+                                              'hours_worked': [total[1][0] for total in totals],
+                                              'Sample Size': np.array([total[2] for total in totals], dtype=np.int64)}))
+            if rows:
+                format_table = pd.concat(rows, ignore_index=True)
+            else:
+                format_table = pd.DataFrame(columns=['employee', 'Format', 'hours_digitized', 'hours_worked', 'Sample Size'])
+            format_table['employee'] = format_table['employee'].astype(str)
+            format_table['Format Efficiency'] = (format_table['hours_digitized'] / format_table['hours_worked']).round(3)
+            self._format_table = format_table
+        return self._format_table
+
+
+    def format_analyses(self):
+        '''returns {employee name : format analysis} for every employee, sliced out of format_table without recomputing anything'''
+        format_table = self.format_table()
+        # one sort puts every employee's formats together, most efficient first (ties alphabetical like Employee.format_analysis)
+        order = np.lexsort((format_table['Format'].to_numpy(), -format_table['Format Efficiency'].to_numpy(), format_table['employee'].to_numpy()))
+        names = format_table['employee'].to_numpy()[order]
+        ordered = format_table.loc[:, ('Format', 'Format Efficiency', 'Sample Size')].iloc[order]
+        ordered.index = ordered['Format'].to_numpy()
+        # each employee is then just a slice of the sorted rows
+        starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]]) if len(names) else np.array([], dtype=np.int64)
+        stops = np.r_[starts[1:], len(names)]
+        analyses = {names[start]: ordered.iloc[start:stop] for start, stop in zip(starts, stops)}
+        # employees without any shifts (ex: every row was quarantined) get an empty analysis
+        for employee in self.employees:
+            if employee.name not in analyses:
+                analyses[employee.name] = ordered.iloc[:0]
+        return analyses
+
+
+    def format_ranking(self):
+        '''returns the team wide efficiency of every format (hours digitized / hours worked over all employees), most efficient first'''
+        format_table = self.format_table()
+        format_codes, formats = pd.factorize(format_table['Format'], sort=True)
+        digitized, worked, counts, firsts = fsum_groups(format_codes, format_table['hours_digitized'], format_table['hours_worked'])
+        ranking = pd.DataFrame({'Format': formats[format_codes[firsts]],
+                                'Format Efficiency': (pd.Series(digitized) / pd.Series(worked)).round(3).to_numpy(),
+                                'Sample Size': format_table.groupby('Format')['Sample Size'].sum().to_numpy(),
+                                'Employees': counts})
+        ranking.index = ranking['Format'].to_numpy()
+        return ranking.sort_values(by='Format Efficiency', ascending=False, kind='mergesort')
+
+
+    def distributions(self, by='employee'):
+        '''returns the spread of the shift efficiencies (Shifts, Mean, Std, P10, Median, P90, Outliers) of every employee, or every format
+        with by='format', plus a 'Team' row over everyone - merged from the efficiency sketches in the summaries, so no shift is read again
+        employees whose summary was saved before the sketches were kept are left out'''
+        if by not in ('employee', 'format'):
+            raise ValueError("can only give distributions by employee or format - not " + str(by))
+        # imported here like the query and the rollups
+        from efficiency_sketch import merged
+        summaries = [employee.summary for employee in self.employees if employee.summary.sketch is not None]
+        if by == 'employee':
+            sketches = {employee.name: employee.summary.sketch for employee in self.employees if employee.summary.sketch is not None}
+        else:
+            sketches = {}
+            for summary in summaries:
+                for format, sketch in summary.format_sketches.items():
+                    sketches.setdefault(format, []).append(sketch)
+            sketches = {format: merged(sketches[format]) for format in sorted(sketches)}
+        sketches['Team'] = merged(summary.sketch for summary in summaries)
+        result_df = pd.DataFrame([sketch.statistics() for sketch in sketches.values()], index=list(sketches))
+        result_df.insert(0, by.capitalize(), result_df.index)
+        return result_df
+
+
+
+def concat_shifts(frames):
+    '''concatenates shift dataframes keeping the categorical columns categorical (pd.concat turns them into objects when the categories differ)'''
+    categorical = [column for column in frames[0].columns
+                   if all(column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames)]
+    combined = pd.concat(frames)
+    # empty frames (ex: every row quarantined) add no categories, and theirs can be of another dtype
+    filled = [frame for frame in frames if len(frame)] or frames[:1]
+    for column in categorical:
+        combined[column] = pd.api.types.union_categoricals([frame[column] for frame in filled], sort_categories=True)
+    return combined
+
+
+def fsum_groups(codes, *columns):
+    '''sums every column over each group of integer codes with math.fsum - returns the sums (arrays), the group sizes and the position of each group's first row'''
+    codes = np.asarray(codes)
+    if not len(codes):
+        return tuple(np.array([], dtype=float) for _ in columns) + (np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+    # one stable sort brings each group's rows together, then each group is a slice of that order
+    order = np.argsort(codes, kind='mergesort')
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    stops = np.r_[starts[1:], len(codes)]
+    # a group of one row is its own sum and two rows added once are already correctly rounded (what fsum would give),
+    # so only the bigger groups go through fsum one at a time
+    sizes = stops - starts
+    pairs = np.flatnonzero(sizes == 2)
+    bigger = np.flatnonzero(sizes > 2).tolist()
+    sums = []
+    for column in columns:
+        values = np.asarray(column, dtype=float)[order]
+        column_sums = values[starts]
+        column_sums[pairs] += values[starts[pairs] + 1]
+        if bigger:
+            values = values.tolist()
+            column_sums[bigger] = [math.fsum(values[starts[group]:stops[group]]) for group in bigger]
+        sums.append(column_sums)
+    return tuple(sums) + (sizes.astype(np.int64), order[starts])
+
+
+
+if __name__ == "__main__":
+    from types import SimpleNamespace
+
+    def employee(name, efficiency=0.5, dataframe=None, preview=None):
+        # only what the registry reads off an Employee
+        return SimpleNamespace(name=name, overall_efficiency=efficiency, dataframe=dataframe,
+                               summary=SimpleNamespace(hours_worked=10.0, shifts=1, formats={}, preview=preview))
+
+    # the top/bottom k of the ranking are exactly the head/tail of the full ranking, ties (broken by name) included
+    registry = EmployeeRegistry()
+    for name, efficiency in (('A', 0.5), ('B', 0.5), ('C', 0.9), ('D', 0.5)):
+        registry.add(employee(name, efficiency))
+    full = registry.rank()
+    print('Testing rank with ties:', list(full['Employee']) == ['C', 'A', 'B', 'D']
+          and all(registry.rank(k=k).equals(full.head(k)) and registry.rank(k=k, bottom=True).reset_index(drop=True).equals(full.tail(k).reset_index(drop=True))
+                  for k in range(1, 5)))
+
+    # the previews cut out of the table are each employee's first rows - streamed employees bring theirs and one without shifts gets an empty one
+    def shifts(count):
+        return pd.DataFrame({'shift_id': np.arange(count, dtype=np.int64), 'hours_worked': np.arange(count) / 2})
+    registry = EmployeeRegistry()
+    for loaded in (employee('Long', dataframe=shifts(10)), employee('Streamed', preview=shifts(9)),
+                   employee('Short', dataframe=shifts(3)), employee('Empty', dataframe=shifts(0))):
+        registry.add(loaded)
+    previews = registry.previews(rows=7)
+    print('Testing previews:', sorted(previews) == ['Empty', 'Long', 'Short', 'Streamed'] and previews['Long'].equals(shifts(7))
+          and previews['Short'].equals(shifts(3)) and previews['Streamed'].equals(shifts(7)) and previews['Empty'].equals(shifts(0)))
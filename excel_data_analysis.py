@@ -1,20 +1,45 @@
 # This OOP application takes an employees shift data from excel cells and analyzes their performance (can compare different shifts/excels and export to a final excel if needed)
 
 import os
-import pandas as pd
-import numpy as np
+import sys
+import glob
+import json
+import argparse
+import itertools
+import threading
+import queue
+import zipfile
+import collections
 import datetime as dt
 import tools
 import time
-# import openpyxl
+import shift_cache
+import shift_sources
+import instrumentation
+from instrumentation import instruments
+from employee_registry import EmployeeRegistry, concat_shifts
+from shift_summary import ShiftSummary
+from shift_validation import ShiftValidator, ShiftIds, empty_quarantine
+from date_index import DateIndex
+from analysis_cache import AnalysisCache
+from concurrent.futures import ProcessPoolExecutor
+
+# the heavy modules are only really imported once they're used, so --help and argument checks are instant
+pd = tools.lazy_import('pandas')
+np = tools.lazy_import('numpy')
+openpyxl = tools.lazy_import('openpyxl')
 
 
 class Employee(object):
     '''takes an employee name and formatted excel file representing that employee's shift with columns as follows: 1:shift_id 2:date_worked 3:clock_in time (24hour) 4:clock_out time (24 hour) 5:hours digitized 6:tape format 7: employeeID'''
 
-    employee_list = [] #class attribute that is a list of the entire instance of the employees created
-    employee_DFS = [] #class attribute that is a list of all the DFs of employees created
-    employee_efficiency = {} #class attribute dictionary: {employeeID : %time_digitized}
+    registry = EmployeeRegistry() #class attribute holding every employee created and all their shifts in one table
+    employee_list = registry.employees #class attribute that is a list of the entire instance of the employees created
+    employee_DFS = registry.frames #class attribute that is a list of all the DFs of employees created
+    employee_efficiency = registry.efficiency #class attribute dictionary: {employeeID : %time_digitized}
+    cache = None #class attribute that can hold a shift_cache.ShiftCache so excels don't get re-parsed when they haven't changed
+    results = AnalysisCache() #class attribute holding the analysis results already worked out, shared by every employee
+    _serials = itertools.count() #numbers every instance so cached results of different employees never mix
 
 
     @staticmethod
@@ -22,59 +47,181 @@ class Employee(object):
         '''this static method prints all employees being compared'''
         if Employee.employee_list:
             print('\nThere are ' + str(len(Employee.employee_list)) + ' employees entered.\n')
-            for employee, employeeDF in zip(Employee.employee_list, Employee.employee_DFS):
-                print(employee.name, 'Data Preview:')
-                print(employeeDF.head(n=7).to_string(index=False))
+            # the previews are only put together again when someone's shifts changed since the last time
+            print(Employee.results.get(('print_all', 'registry', Employee.registry.version), Employee.preview_text))
         else:
             print('There are 0 employees entered.\n')
 
 
     @staticmethod
-    def employee_rank():
-        '''this static method returns the efficiency ranking of all employees'''
+    def preview_text():
+        '''this static method returns the data preview of every employee as the text print_all shows'''
+        # the first rows of every employee come out of the registry's table in one go
+        previews = Employee.registry.previews(rows=7)
+        lines = []
+        for employee in Employee.employee_list:
+            lines.append(employee.name + ' Data Preview:')
+            lines.append(readable_shifts(previews[employee.name]).to_string(index=False))
+        return '\n'.join(lines)
+
+
+    @staticmethod
+    def memory_report():
+        '''this static method prints how much memory every employee's shifts take up and the total'''
+        if Employee.employee_list:
+            usage = [(employee.name, employee.summary.shifts, round(employee.memory_usage() / 1024, 1)) for employee in Employee.employee_list]
+            print('\nMemory used by the shifts of each employee:')
+            tools.table_print(('Employee', 'Shifts', 'KB'), usage + [('Total', sum(row[1] for row in usage), round(sum(row[2] for row in usage), 1))], 26)
+        else:
+            print('There are 0 employees entered.\n')
+
+
+    @staticmethod
+    def employee_rank(k=None, bottom=False, min_hours=0, format=None):
+        '''this static method prints the efficiency ranking of all employees (takes the same options as Employee.rank)'''
         if Employee.employee_efficiency:
-            sortedlist = [(employee, Employee.employee_efficiency[employee]) for employee in sorted(Employee.employee_efficiency, key=Employee.employee_efficiency.get, reverse=True)]
+            ranking = Employee.rank(k=k, bottom=bottom, min_hours=min_hours, format=format)
             print('\nEmployee & Efficiency - ranked from most efficient to least efficient:')
             print('(Efficiency is measured as hours digitized / hours worked)')
-            for employee, efficiency in sortedlist:
+            for employee, efficiency in zip(ranking['Employee'], ranking['Efficiency']):
                 print(employee + ': ' + str(efficiency))
         else:
             print('There are 0 employees entered.\n')
 
 
     @staticmethod
-    def analyze_all_date():
-        '''this static method does a DATE analysis on all employees and sends to excel with each person being a sheet'''
+    def rank(k=None, bottom=False, min_hours=0, format=None):
+        '''this static method returns the efficiency ranking of all employees as a dataframe (Rank, Employee, Efficiency, Hours Worked, Shifts)
+        k keeps only the top k (or bottom k with bottom=True), min_hours leaves out employees with fewer hours worked
+        and format ranks by the efficiency of that one format instead of overall'''
+        with instruments.timer('ranking'):
+            return Employee.results.get(('rank', 'registry', Employee.registry.version, k, bottom, min_hours, format),
+                                        lambda: Employee.registry.rank(k=k, bottom=bottom, min_hours=min_hours, format=format))
+
+
+    @staticmethod
+    def format_rank():
+        '''this static method prints the team wide efficiency ranking of every format'''
+        if Employee.employee_list:
+            with instruments.timer('format_ranking'):
+                ranking = Employee.results.get(('format_rank', 'registry', Employee.registry.version), Employee.registry.format_ranking)
+            print('\nFormat & Efficiency of the whole team - ranked from most efficient to least efficient:')
+            tools.table_print(('Format', 'Efficiency', 'Sample Size', 'Employees'), ranking.itertuples(index=False), 12)
+        else:
+            print('There are 0 employees entered.\n')
+
+
+    @staticmethod
+    def distributions(by='employee'):
+        '''this static method returns the spread of the shift efficiencies (Shifts, Mean, Std, P10, Median, P90, Outliers) of every employee
+        (or every format with by='format') and the whole team - merged out of the summaries' efficiency sketches (see efficiency_sketch.py)'''
+        with instruments.timer('distributions'):
+            return Employee.results.get(('distributions', 'registry', Employee.registry.version, by), lambda: Employee.registry.distributions(by))
+
+
+    @staticmethod
+    def distribution_report():
+        '''this static method prints the spread of the shift efficiencies of every employee and every format'''
+        if Employee.employee_list:
+            columns = ('Shifts', 'Mean', 'Std', 'P10', 'Median', 'P90', 'Outliers')
+            print('\nSpread of the shift efficiencies (Outliers have an efficiency above 2):')
+            tools.table_print(('Employee',) + columns, Employee.distributions('employee').loc[:, ('Employee',) + columns].itertuples(index=False), 12)
+            print()
+            tools.table_print(('Format',) + columns, Employee.distributions('format').loc[:, ('Format',) + columns].itertuples(index=False), 12)
+        else:
+            print('There are 0 employees entered.\n')
+
+
+    @staticmethod
+    def quarantine_report():
+        '''this static method returns the shift rows every employee had left out because they failed validation (see shift_validation.py)
+        as one dataframe: employee, row (1 is the first row under the excel's header), reason and the row as it was read'''
+        reports = [employee.quarantine.assign(employee=employee.name) for employee in Employee.employee_list if len(employee.quarantine)]
+        report = pd.concat(reports, ignore_index=True) if reports else empty_quarantine().assign(employee=[])
+        return report.loc[:, ['employee'] + [column for column in report.columns if column != 'employee']]
+
+
+    @staticmethod
+    def query():
+        '''this static method returns the indexed query engine over every loaded employee's shifts (see shift_query.ShiftQuery) - ex:
+        Employee.query().aggregate(by=['employee_id', 'format'], format='vhs', start='2015-03-01', end='2015-03-31')
+        streamed employees never have their shifts in memory so they can't be queried'''
+        return Employee.registry.query()
+
+
+    @staticmethod
+    def rollup(period='week', by=('employee', 'format')):
+        '''this static method returns the day/week/month sums and efficiency of every employee x format (or by just employee, just format, or () for the team)
+        out of the precomputed rollups (see shift_rollups.ShiftRollups) - they are built the first time and then kept up to date as shifts arrive'''
+        with instruments.timer('rollup_table'):
+            return Employee.registry.rollups().table(period, by)
+
+
+    @staticmethod
+    def rollup_sheets(periods=('week', 'month')):
+        '''this static method returns {sheet name : rollup table} of the team, every employee, every format and every employee x format for each period'''
+        sheets = {}
+        for period in periods:
+            for by, label in (((), 'Team'), (('employee',), 'by Employee'), (('format',), 'by Format'), (('employee', 'format'), 'by Employee x Format')):
+                table = Employee.rollup(period, by)
+                # the sheets show the first day of each period as a plain date like the date analyses
+                table['period'] = table['period'].dt.date
+                sheets[period.capitalize() + ' ' + label] = table
+        return sheets
+
+
+    @staticmethod
+    def analyze_all_date(shard_size=None, workers=None, merge=False, directory='.', window=30, backend='xlsx', rollups=()):
+        '''this static method does a DATE analysis of the last `window` days worked on all employees and sends to excel (in directory) with each person being a sheet
+        shard_size splits the sheets into excels of that many employees written in parallel (see tools.dfs_tabs_sharded)
+        backend picks another output than the styled excel (see tools.write_analyses: xlsx-summary, parquet, csv, ndjson)
+        rollups adds the day/week/month trend sheets of those periods after the employees (see Employee.rollup_sheets - not with shard_size)'''
 
         if Employee.employee_list:
             sheet_list = []
             dfs = []
+            #the DATE analysis of everyone is done with one sort over the registry's table
+            with instruments.timer('date_analysis'):
+                analyses = Employee.registry.date_analyses(window=window)
             for employee in Employee.employee_list:
                 #appending the name of the employee to sheet_list of titles for xcel sheets
                 sheet_list.append(employee.name)
                 #appending the DF of the DATE analysis
-                dfs.append(Employee.date_analysis(employee))
-            #sending these employee's analysis to 1 excel over seperate tabs/sheets
-            tools.dfs_tabs_date(dfs, sheet_list, str(dt.date.today())+'_date_analysis.xlsx')
+                dfs.append(analyses[employee.name])
+            #sending these employee's analysis to 1 excel over seperate tabs/sheets (or to a folder of shard excels)
+            file_name = os.path.join(directory, str(dt.date.today())+'_date_analysis.xlsx')
+            if shard_size:
+                tools.dfs_tabs_sharded(dfs, sheet_list, file_name, 'date', shard_size, workers, merge, window)
+            else:
+                tools.write_analyses(dfs, sheet_list, file_name, 'date', backend, window, Employee.rollup_sheets(rollups) if rollups else None)
             print("\nOverall Date Analysis Excel Created!")
 
         else:
             print('There are 0 employees entered.\n')
     
     @staticmethod
-    def analyze_all_format():
-        '''this static method does a FORMAT analysis on all employees and sends to excel with each person being a sheet'''
+    def analyze_all_format(shard_size=None, workers=None, merge=False, directory='.', backend='xlsx'):
+        '''this static method does a FORMAT analysis on all employees and sends to excel (in directory) with each person being a sheet
+        shard_size splits the sheets into excels of that many employees written in parallel (see tools.dfs_tabs_sharded)
+        backend picks another output than the styled excel (see tools.write_analyses: xlsx-summary, parquet, csv, ndjson)'''
 
         if Employee.employee_list:
             sheet_list = []
             dfs = []
+            #the FORMAT analysis of everyone comes from one grouped pass over the registry's table
+            with instruments.timer('format_analysis'):
+                analyses = Employee.registry.format_analyses()
             for employee in Employee.employee_list:
                 #appending the name of the employee to sheet_list of titles for xcel sheets
                 sheet_list.append(employee.name)
                 #appending the DF of the FORMAT analysis
-                dfs.append(Employee.format_analysis(employee))
-            #sending these employee's analysis to 1 excel over seperate tabs/sheets
-            tools.dfs_tabs_format(dfs, sheet_list, str(dt.date.today())+'_format_analysis.xlsx')
+                dfs.append(analyses[employee.name])
+            #sending these employee's analysis to 1 excel over seperate tabs/sheets (or to a folder of shard excels)
+            file_name = os.path.join(directory, str(dt.date.today())+'_format_analysis.xlsx')
+            if shard_size:
+                tools.dfs_tabs_sharded(dfs, sheet_list, file_name, 'format', shard_size, workers, merge)
+            else:
+                tools.write_analyses(dfs, sheet_list, file_name, 'format', backend)
             print("\nOverall Format Analysis Excel Created!")
 
         else:
@@ -82,160 +229,873 @@ class Employee(object):
 
 
 
-    def __init__(self, name, fullpath):
-        self.name = name.replace(' ', '_') # Excel doesn't like spaces in sheet names:
-        
-        # extracting the directory and asking python to look there for the file
-        path = os.path.dirname(fullpath)
-        os.chdir(path)
+    @staticmethod
+    def from_directory(path, pattern='Humanity_Shift_Employee*.xlsx', workers=None):
+        '''this static method loads every workbook in path matching pattern in a process pool and returns the per-file load times in seconds'''
 
-        # getting the filename
-        base = os.path.basename(fullpath)
+        # sorting the files so the employees always get registered in the same order
+        fullpaths = sorted(glob.glob(os.path.join(os.path.abspath(path), pattern)))
+        if not fullpaths:
+            print('No files matching ' + pattern + ' in ' + path + '\n')
+            return {}
 
-        # setting the parser to know what the incoming date format looks like to correct it
-        parser = lambda date: pd.datetime.strptime(date, '%Y/%m/%d')
+        # the employees are named after their file
+        return Employee.from_files([(shift_sources.source_name(fullpath), fullpath) for fullpath in fullpaths], workers)
 
-        # this creates the dataframe from the excel and parses the date into a datetime object
-        self.dataframe = pd.read_excel(base, parse_dates=['date_worked'], date_parser=parser)
-        #removing the time section of the datetime
-        self.dataframe['date_worked'] = pd.to_datetime(self.dataframe['date_worked']).dt.date
 
-        # appending another column called hours_worked after the clock_in and clock_out column
-        self.dataframe.insert(loc=4, column='hours_worked', value = np.nan)
+    @staticmethod
+    def from_zip(archive, pattern='*.xlsx', workers=None, errors=None):
+        '''this static method loads every workbook in a zip archive matching pattern in a process pool and returns the per-file load times in seconds
+        each worker reads its excel straight out of the archive into memory - nothing is extracted to disk'''
+        members = shift_sources.zip_members(archive, pattern)
+        if not members:
+            print('No files matching ' + pattern + ' in ' + archive + '\n')
+            return {}
 
-        # inserting in the time differences into that column using a tools.py project that needs to be in same directory
-        for i in range(len(self.dataframe)):
-            self.dataframe.loc[i, 'hours_worked'] = tools.time_dif(self.dataframe.loc[i, 'clock_in'], self.dataframe.loc[i, 'clock_out'])
+        # the employees are named after their file inside the archive
+        return Employee.from_files([(shift_sources.source_name(member), member) for member in members], workers, errors)
 
-        # appending another column called efficiency after the hours_digitized column
-        self.dataframe.insert(loc=6, column='efficiency', value = np.nan)
 
-        #inserting in the efficiency of that day (defined as hours_digitized / hours_worked)
-        for i in range(len(self.dataframe)):
-            self.dataframe.loc[i, 'efficiency'] = round(self.dataframe.loc[i, 'hours_digitized'] / self.dataframe.loc[i, 'hours_worked'], 3)
+    @staticmethod
+    def from_files(namepaths, workers=None, errors=None):
+        '''this static method loads a list of (name, source) workbooks in a process pool, registering them in that order, and returns the per-file load times in seconds
+        a source is a path, the bytes of an excel (or a file-like object holding them) or a shift_sources.ZipMember
+        if an errors dictionary is passed, files that fail to load are recorded there as {name : error} instead of stopping everything'''
+        # file-like objects can't be sent to the pool so they are read into bytes here
+        namepaths = [(name, shift_sources.portable_source(source)) for name, source in namepaths]
+
+        # pulling whatever is already parsed out of the cache first (the cache is only ever touched from this process and only holds files on disk)
+        results = {} #{source key : (dataframe, seconds) or the error reading it}
+        measured = {} #{source key : what the worker's instruments measured while reading it}
+        if Employee.cache is not None:
+            for name, source in namepaths:
+                if not shift_sources.is_path(source):
+                    continue
+                start = time.perf_counter()
+                try:
+                    dataframe = Employee.cache.get(source)
+                except OSError:
+                    # the file itself can't be read - leaving it to the pool to report
+                    continue
+                if dataframe is not None:
+                    results[source] = (dataframe, time.perf_counter() - start)
+                    instruments.add_time('cache_read', results[source][1], name)
+
+        # parsing the rest of the workbooks in parallel (each source only once even if several employees use it)
+        to_read = collections.OrderedDict() #{source key : source}
+        for name, source in namepaths:
+            key = shift_sources.source_key(source)
+            if key not in results:
+                to_read[key] = source
+        if to_read:
+            with ProcessPoolExecutor(max_workers=workers, initializer=instrumentation.start_worker, initargs=instrumentation.worker_settings()) as pool:
+                futures = [pool.submit(timed_read_shifts, source) for source in to_read.values()]
+                for (key, source), future in zip(to_read.items(), futures):
+                    try:
+                        dataframe, seconds, measured[key] = future.result()
+                        results[key] = (dataframe, seconds)
+                    except Exception as error:
+                        if errors is None:
+                            raise
+                        results[key] = error
+                        continue
+                    if Employee.cache is not None and shift_sources.is_path(source):
+                        Employee.cache.put(source, results[key][0])
+
+        # registering the employees back in this process in the order they were given
+        timings = {}
+        for name, source in namepaths:
+            key = shift_sources.source_key(source)
+            if isinstance(results[key], Exception):
+                errors[name] = results[key]
+                print(name + ' could not be loaded: ' + str(results[key]))
+                continue
+            dataframe, seconds = results[key]
+            if key in measured:
+                # crediting the read to the (first) employee using this file
+                instruments.merge(measured.pop(key), name)
+            try:
+                Employee(name, source, dataframe=dataframe)
+            except Exception as error:
+                if errors is None:
+                    raise
+                errors[name] = error
+                print(name + ' could not be loaded: ' + str(error))
+                continue
+            timings[name] = seconds
+
+        print('\nLoad time per file:')
+        tools.table_print(('File', 'Seconds'), [(name, round(seconds, 3)) for name, seconds in timings.items()], 26)
+        if Employee.cache is not None:
+            # the hits only touched the index in memory - it's written once for the whole batch
+            Employee.cache.flush()
+            print(Employee.cache)
+        return timings
+
+
+    @staticmethod
+    def run_pipeline(namepaths, directory='.', window=30, workers=None, queue_size=8, errors=None, date=True, format=True, charts=True):
+        '''this static method reads, analyzes and writes a list of (name, source) workbooks (sources as in from_files) as overlapping stages instead of one phase after another:
+        a reader thread feeds the excels to a process pool, this thread registers and analyzes each employee as soon as their excel is read,
+        and one writer thread per analysis excel adds each sheet as soon as it is ready. The stages are joined by queues of queue_size so a slow
+        stage holds the others back instead of piling up dataframes. Employees are registered and written in the order given, so the excels
+        come out the same as from_files + analyze_all_date/analyze_all_format would make them (charts=False writes them without charts)
+        if an errors dictionary is passed, employees that fail are recorded there as {name : error} and left out instead of stopping everything'''
+        namepaths = [(name, shift_sources.portable_source(source)) for name, source in namepaths]
+        failures = collections.OrderedDict() #{name : error} from every stage
+        stop = threading.Event()
+
+        # the lazily imported modules have to be loaded before the threads start - two threads loading one at once can see it half done
+        pd.DataFrame, np.ndarray, tools.xlsxwriter.Workbook
+
+        read_queue = queue.Queue(maxsize=queue_size)
+        reader = threading.Thread(target=read_stage, args=(namepaths, workers, queue_size, read_queue, stop), daemon=True)
+        reader.start()
+
+        writers = []
+        today = str(dt.date.today())
+        for kind, wanted in (('date', date), ('format', format)):
+            if wanted:
+                sheets = queue.Queue(maxsize=queue_size)
+                file_name = os.path.join(directory, today + '_' + kind + '_analysis.xlsx')
+                writer = threading.Thread(target=write_stage, args=(kind, file_name, window, sheets, failures, charts), daemon=True)
+                writer.start()
+                writers.append((kind, sheets, writer))
+
+        try:
+            while True:
+                item = read_queue.get()
+                if item is None:
+                    break
+                name, source, dataframe, error = item
+                if error is None:
+                    try:
+                        employee = Employee(name, source, dataframe=dataframe)
+                        analyses = {'date': employee.date_analysis(window), 'format': employee.format_analysis()}
+                    except Exception as analysis_error:
+                        error = analysis_error
+                if error is not None:
+                    if errors is None:
+                        raise error
+                    failures[name] = error
+                    print(name + ' could not be loaded: ' + str(error))
+                    continue
+                for kind, sheets, writer in writers:
+                    sheets.put((employee.name, analyses[kind]))
+        finally:
+            # letting the reader wind down (it stops reading ahead once stop is set) and the writers finish what they were given
+            stop.set()
+            while item is not None:
+                item = read_queue.get()
+            for kind, sheets, writer in writers:
+                sheets.put(None)
+            for kind, sheets, writer in writers:
+                writer.join()
+            reader.join()
+
+        if errors is not None:
+            errors.update(failures)
+        elif failures:
+            raise next(iter(failures.values()))
+        for kind, sheets, writer in writers:
+            print('\nOverall ' + kind.capitalize() + ' Analysis Excel Created!')
+        if Employee.cache is not None:
+            Employee.cache.flush()
+            print(Employee.cache)
+
+
+
+    @staticmethod
+    def reload_changed(errors=None):
+        '''this static method reloads every employee whose excel changed on disk since it was read and returns their names
+        if an errors dictionary is passed, excels that fail to reload are recorded there as {name : error} instead of stopping everything'''
+        reloaded = []
+        for employee in list(Employee.employee_list):
+            if not employee.changed():
+                continue
+            try:
+                employee.reload()
+            except Exception as error:
+                if errors is None:
+                    raise
+                errors[employee.name] = error
+                continue
+            reloaded.append(employee.name)
+        return reloaded
+
 
-        #adding this employee's instance & final dataframe to the class attributes
-        Employee.employee_list.append(self)
-        Employee.employee_DFS.append(self.dataframe)
 
-        #adding overall efficiency to the class dictionary
-        self.overall_efficiency = round(sum(self.dataframe.loc[:, 'hours_digitized']) / sum(self.dataframe.loc[:, 'hours_worked']), 3)
-        Employee.employee_efficiency[self.name] = self.overall_efficiency
+    @staticmethod
+    def from_summary(name, summary_path):
+        '''this static method creates an employee from a summary saved with save_summary - the history isn't re-read, new days can be added with append_shifts'''
+        return Employee(name, None, summary=ShiftSummary.load(summary_path))
+
+
+
+    def __init__(self, name, source, dataframe=None, stream=False, chunk_size=10000, summary=None, window=30):
+        '''source is the path of the excel, its bytes (or a file-like object holding them) or a shift_sources.ZipMember
+        dataframe can be passed in if the excel has already been read with read_shifts (ex: by from_directory)
+        stream=True reads the excel chunk_size rows at a time and only keeps the running totals the analyses need (for very large excels) -
+        window is the most days worked its date_analysis can give then (only that many of the latest shifts are kept)
+        summary can be passed in (ex: by from_summary) to skip reading an excel at all'''
+        self.name = name.replace(' ', '_') # Excel doesn't like spaces in sheet names:
+        # file-like objects are read into bytes so the excel can still be reloaded once they are closed
+        self.source = None if source is None else shift_sources.portable_source(source)
+        self.fullpath = self.source if shift_sources.is_path(self.source) else None
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.window = window
+        self.serial = next(Employee._serials)
+        self.version = 0 #goes up whenever the shifts change so cached analyses of the old shifts aren't used
+        self._dataframe = None #the shifts (see the dataframe property)
+        self._appended = [] #shifts appended since the dataframe was last read, only concatenated when it is
+        self._appender = None #the ShiftValidator every append_shifts goes through (it holds the shift_ids already taken)
+
+        self._load(dataframe, summary)
+
+        #adding overall efficiency, then this employee's instance & final dataframe to the class registry
+        self.overall_efficiency = self.summary.overall_efficiency()
+        Employee.registry.add(self)
 
         # initialization done!
         print(self.name + "'s data successfully inputted and ready for analysis!")
+        if len(self.quarantine):
+            print(str(len(self.quarantine)) + ' bad rows of ' + self.name + ' were quarantined (see Employee.quarantine_report)')
+
+
+    def _load(self, dataframe=None, summary=None):
+        '''reads this employee's shifts (or takes the dataframe/summary given) into the dataframe and running totals'''
+        # the running totals used by the overall efficiency and the analyses
+        self.summary = ShiftSummary(self.window) if summary is None else summary
+        # the rows of the excel that were left out because they failed validation, with the reasons
+        self.quarantine = empty_quarantine()
+        # how the file looked when it was read, so changed() can tell when it has been edited since
+        self.stamp = shift_sources.source_stamp(self.source)
+
+        if summary is not None:
+            # a saved summary already holds everything the analyses need
+            dataframe = None
+        elif self.stream:
+            # never holding the whole excel - each chunk is added to the totals and then let go
+            validator = ShiftValidator()
+            with instruments.timer('stream_read', self.name):
+                for chunk in stream_shifts(self.source, self.chunk_size, validator):
+                    self.summary.update(chunk)
+                    instruments.count('rows_parsed', len(chunk), self.name)
+            instruments.count('files_read', employee=self.name)
+            self.quarantine = validator.quarantine()
+            dataframe = None
+        else:
+            if dataframe is None:
+                # this creates the dataframe from the excel with the hours_worked and efficiency columns added (or gets it from the cache if the file hasn't changed)
+                # buffers and zip members are read straight from memory - only files on disk are cached
+                if Employee.cache is not None and shift_sources.is_path(self.source):
+                    dataframe = Employee.cache.load(self.source, lambda path: read_shifts(path, self.name))
+                else:
+                    dataframe = read_shifts(self.source, self.name)
+            # taken off so the quarantine isn't copied along with every operation on the dataframe
+            self.quarantine = dataframe.attrs.pop('quarantine', self.quarantine)
+            with instruments.timer('summary', self.name):
+                self.summary.update(dataframe)
+        self.dataframe = dataframe
+        # the date order of the shifts, only built the first time a date analysis needs it
+        self._date_index = None
+        self._appender = None
+
+
+    def reload(self):
+        '''reads this employee's excel again (ex: after it was edited) - cached analyses of the old shifts are dropped with the version'''
+        if self.source is None:
+            raise ValueError(self.name + ' was loaded from a summary and has no excel to reload')
+        self._load()
+        self.version += 1
+        self.overall_efficiency = self.summary.overall_efficiency()
+        Employee.registry.update(self)
+
+
+
+    def changed(self):
+        '''returns whether this employee's excel (or the zip archive holding it) has changed on disk since it was read'''
+        stamp = shift_sources.source_stamp(self.source)
+        return stamp is not None and stamp != self.stamp
+
+
+    @property
+    def dataframe(self):
+        '''this employee's shifts (None for streamed employees) - shifts appended since it was last read are concatenated on now'''
+        if self._appended:
+            appended, self._appended = self._appended, []
+            if self._date_index is not None:
+                self._date_index.extend(np.concatenate([shifts['date_worked'].to_numpy() for shifts in appended]))
+            self._dataframe = concat_shifts([self._dataframe] + appended)
+        return self._dataframe
+
+
+    @dataframe.setter
+    def dataframe(self, dataframe):
+        self._dataframe = dataframe
+        self._appended = []
+
+
+    def append_shifts(self, rows):
+        '''adds new shifts (a dataframe or list of dicts with the same columns as the excel) to this employee - the totals, efficiency and ranking are updated from the new rows only'''
+
+        # one validator checks every append against the shift_ids the summary already has (shared, not copied), so nothing here goes through the history
+        # (rows that fail validation are left out and added to the quarantine instead - shifts already seen count as duplicates)
+        if self._appender is None:
+            known_ids = self.summary.shift_ids
+            if known_ids is None:
+                # summaries saved before the shift_ids were kept only know the ids of the rows in memory (if any)
+                known_ids = self.summary.shift_ids = ShiftIds(() if self._dataframe is None else self.dataframe['shift_id'].to_numpy())
+            self._appender = ShiftValidator(shift_ids=known_ids)
+        validator = self._appender
+        # the new rows are numbered after the ones already seen so they sort after them on equal dates
+        validator.rows = self.summary.shifts
+        new_shifts = shift_chunk(rows, self.summary.shifts, validator=validator)
+        if validator.quarantined:
+            self.quarantine = pd.concat([self.quarantine, validator.quarantine()], ignore_index=True)
+            validator.quarantined = []
+        self.summary.update(new_shifts)
+
+        # employees that were loaded whole keep their dataframe complete too (the new rows are only put on when it's read)
+        if self._dataframe is not None:
+            self._appended.append(new_shifts)
+
+        self.version += 1
+        self.overall_efficiency = self.summary.overall_efficiency()
+        Employee.registry.update(self, new_shifts)
+        return new_shifts
+
+
+    def memory_usage(self):
+        '''returns how many bytes this employee's shifts take up in memory (strings and categories included)'''
+        # streamed employees only hold their date tail and preview
+        if self.dataframe is None:
+            frames = [self.summary.tail] + ([self.summary.preview] if self.summary.preview is not None else [])
+        else:
+            frames = [self.dataframe]
+        return int(sum(frame.memory_usage(deep=True).sum() for frame in frames))
+
+
+    def save_summary(self, summary_path):
+        '''saves this employee's running totals so the next run can pick up from them with from_summary'''
+        self.summary.save(summary_path)
 
 
 
     def __str__(self):
         '''this will return all the data of the employee and allows it to accept the print function'''
-        reply = 'Employee: ' + self.name + ' | Employee ID: ' + str(self.dataframe.loc[0:1, 'employee_id']) + '\n'
+        # streamed employees only have their preview rows to show
+        dataframe = readable_shifts(self.summary.preview if self.dataframe is None else self.dataframe)
+        reply = 'Employee: ' + self.name + ' | Employee ID: ' + str(dataframe.loc[0:1, 'employee_id']) + '\n'
         reply += '--------------------------------------\n'
-        reply += str(self.dataframe)
+        reply += str(dataframe)
         return reply
 
 
-    def date_analysis(self):
-        '''this function sorts by date and returns a dataframe that has dateworked, and efficiency of only the LAST 30 DAYS WORKED - can change this'''
+    @property
+    def date_index(self):
+        '''the DateIndex of this employee's shifts (built on first use and kept sorted as shifts are appended)'''
+        if self.dataframe is None:
+            raise ValueError(self.name + ' was streamed so only the last ' + str(self.summary.window) + ' shifts are kept')
+        if self._date_index is None:
+            self._date_index = DateIndex(self.dataframe['date_worked'])
+        return self._date_index
+
+
+    def date_analysis(self, window=30):
+        '''this function returns a dataframe that has dateworked, and efficiency of only the LAST `window` DAYS WORKED sorted by date'''
+        return self.cached('date_analysis', self._date_analysis, window)
+
+
+    def _date_analysis(self, window):
+        # streamed employees already kept their last days worked while reading (summary.window of them at most)
+        if self.dataframe is None:
+            return self.summary.date_analysis(window)
+
+        #the rows of the last days worked come straight out of the date index (in date order, same days keep excel order):
+        return self.date_rows(self.date_index.last(window))
+
+
+    def date_range(self, start=None, end=None):
+        '''this function returns the same columns as date_analysis for every shift from start to end (dates, both included - either can be None)'''
+        return self.date_rows(self.date_index.between(start, end))
+
+
+    def last_days(self, days):
+        '''this function returns the same columns as date_analysis for the shifts in the last `days` calendar days up to the latest day worked'''
+        return self.date_rows(self.date_index.last_days(days))
+
+
+    def calendar_window(self, year, month=None):
+        '''this function returns the same columns as date_analysis for the shifts in a calendar year (or one month of it)'''
+        return self.date_rows(self.date_index.calendar(year, month))
 
-        #make a copy of the dataframe sorted by date:
-        datesorted_df = self.dataframe.sort_values(by='date_worked')
 
-        #returning a new df with dates and efficiency for last 30 days worked:
-        return datesorted_df.loc[:, ('date_worked', 'hours_digitized', 'hours_worked', 'efficiency')].tail(n=30)
+    def rolling_efficiency(self, days=(7, 30, 90)):
+        '''this function returns one row per day worked with the efficiency over the trailing 7/30/90 (or any) calendar days up to that day'''
+        return self.cached('rolling_efficiency', self._rolling_efficiency, tuple(days))
 
-        #this is just in case you wanted to get the middle 25-50th column for instance
-        #return datesorted_df.loc[:, ('date_worked', 'efficiency')].iloc[25:50,:]
+
+    def _rolling_efficiency(self, days):
+        shifts = self.dataframe.iloc[self.date_index.order]
+        result = shifts.loc[:, ['date_worked']]
+        for window in days:
+            # a time based window over the date ordered shifts - hours digitized / hours worked of every shift in it
+            sums = shifts.rolling('{}D'.format(window), on='date_worked')[['hours_digitized', 'hours_worked']].sum()
+            result[str(window) + '_day_efficiency'] = (sums['hours_digitized'] / sums['hours_worked']).round(3)
+        # the last shift of a day has the whole day in its window
+        result = result.drop_duplicates(subset='date_worked', keep='last')
+        result['date_worked'] = result['date_worked'].dt.date
+        return result
+
+
+    def date_rows(self, positions):
+        '''returns the date_worked (as plain dates), hours_digitized, hours_worked and efficiency of the shifts at these row positions'''
+        rows = self.dataframe.iloc[positions].loc[:, ('date_worked', 'hours_digitized', 'hours_worked', 'efficiency')]
+        rows['date_worked'] = rows['date_worked'].dt.date
+        return rows
 
 
     def format_analysis(self):
         '''this function groups by format and then calculates average efficiency of each format and returns it as a dataframe'''
         ### the format efficiency is calculated by dividing the total number of hours digitized / hours worked for a specific format
 
-        #getting a list of unique formats
-        formats = set(self.dataframe.loc[:, 'format'])
+        #the sums of hours worked and hours digitized grouped by format are kept in the summary (whether the excel was streamed or not)
+        #and it returns them in descending order from most efficient format to least efficient format
+        return self.cached('format_analysis', self.summary.format_analysis)
+
+
+    def distribution(self):
+        '''this function returns the spread of this employee's shift efficiencies (Shifts, Mean, Std, P10, Median, P90, Outliers)
+        over all their shifts and per format, from the sketches kept in the summary while the shifts were read'''
+        return self.cached('distribution', self.summary.distribution)
+
+
+    def cached(self, analysis, compute, *parameters):
+        '''returns compute(*parameters) from Employee.results if this analysis was already done on the current shifts'''
+        return Employee.results.get((analysis, self.serial, self.version) + parameters, lambda: compute(*parameters))
+
+
+
+
+def read_shifts(source, employee=None):
+    '''reads an employee's shift excel (a path, bytes, file-like object or zip member) into a dataframe and adds the hours_worked and efficiency columns
+    each step is timed by the instruments (for employee too if given)'''
+
+    # this creates the dataframe from the excel and parses the date into a datetime object
+    with instruments.timer('read_excel', employee):
+        dataframe = pd.read_excel(shift_sources.open_source(source))
+    instruments.count('files_read', employee=employee)
+    instruments.count('rows_parsed', len(dataframe), employee)
+    # the rows that can't be analysed are taken out before anything is derived from them (see shift_validation.py)
+    validator = ShiftValidator()
+    dataframe = validator.check(dataframe, employee)
+    with instruments.timer('date_parse', employee):
+        dataframe['date_worked'] = parse_shift_dates(dataframe['date_worked'])
+
+    with instruments.timer('efficiency', employee):
+        dataframe = add_shift_columns(dataframe)
+    # the quarantined rows travel with the dataframe (through the process pool and the cache) until the Employee takes them off it
+    if validator.quarantined:
+        dataframe.attrs['quarantine'] = validator.quarantine()
+    return dataframe
+
+
+# one parser for the whole run (one per worker process) so a date is only parsed the first time any file has it
+date_parser = tools.DateParser('%Y/%m/%d')
+
+
+def parse_shift_dates(dates):
+    '''turns the date_worked column as it comes out of the excel (YYYY/MM/DD text or real excel dates) into datetime64'''
+    return date_parser.parse(dates)
+
+
+def stream_shifts(source, chunk_size=10000, validator=None):
+    '''reads an employee's shift excel (a path, bytes, file-like object or zip member) chunk_size rows at a time and yields each chunk as a dataframe with the hours_worked and efficiency columns added
+    the bad rows of every chunk are left in validator's quarantine (a shift_validation.ShiftValidator - a new one is used if not given)'''
+    validator = ShiftValidator() if validator is None else validator
+
+    # read only mode hands the rows over one at a time instead of loading the whole sheet
+    workbook = openpyxl.load_workbook(shift_sources.open_source(source), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        columns = list(next(rows))
+        position = 0
+        chunk = []
+        for row in rows:
+            # skipping rows that are completely blank
+            if all(cell is None for cell in row):
+                continue
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                # only the valid rows are numbered, like in a file that never had the bad ones
+                dataframe = shift_chunk(chunk, position, columns, validator)
+                yield dataframe
+                position += len(dataframe)
+                chunk = []
+        # an excel without any shifts still gives one (empty) chunk so the summary gets its columns
+        if chunk or not position:
+            yield shift_chunk(chunk, position, columns, validator)
+    finally:
+        workbook.close()
+
 
-        #getting a dataframe with sum of hours worked and hours digitized grouped by format
-        format_df = self.dataframe.groupby(['format']).sum()
+def shift_chunk(rows, position, columns=None, validator=None):
+    '''turns excel rows (lists with columns given, dicts or a dataframe) into a dataframe indexed by row position starting at position (like read_excel would) with the derived columns added
+    the rows that fail validation are left out and kept in validator's quarantine (a shift_validation.ShiftValidator - a new one is used if not given)'''
+    dataframe = pd.DataFrame(rows, columns=columns).reset_index(drop=True)
+    dataframe = (ShiftValidator() if validator is None else validator).check(dataframe)
+    dataframe.index = pd.RangeIndex(position, position + len(dataframe))
+    dataframe['date_worked'] = parse_shift_dates(dataframe['date_worked'])
+    return add_shift_columns(dataframe)
 
-        #creating an empty dataframe to return result
-        columns = ['Format', 'Format Efficiency', 'Sample Size']
-        data = np.nan
-        result_df = pd.DataFrame(data, index=formats, columns=columns)
 
-        #filling the result_df with data:
-        #this fills sample size column with the counts of all the different formats in our data
-        result_df.loc[:, 'Sample Size'] = self.dataframe['format'].value_counts()
+def add_shift_columns(dataframe):
+    '''takes a freshly read shift dataframe with date_worked parsed, stores it compactly and adds the hours_worked and efficiency columns
+    compact means: date_worked as datetime64 (time removed), clock_in/clock_out as int32 seconds since midnight,
+    format and employee_id as categoricals and shift_id in the smallest int that holds it (see readable_shifts to turn it back)'''
 
-        #this fills average efficiency column by using the groupedby df and dividing hours worked by digitized of the specific format
-        for format in formats:
-            result_df.loc[format, 'Format'] = format
-            result_df.loc[format, 'Format Efficiency'] = round(format_df.loc[format, 'hours_digitized'] / format_df.loc[format, 'hours_worked'], 3)
+    #removing the time section of the datetime
+    dataframe['date_worked'] = pd.to_datetime(dataframe['date_worked']).dt.normalize()
+    dataframe['clock_in'] = tools.time_to_seconds(dataframe['clock_in'])
+    dataframe['clock_out'] = tools.time_to_seconds(dataframe['clock_out'])
+    dataframe['format'] = dataframe['format'].astype('category')
+    dataframe['employee_id'] = dataframe['employee_id'].astype('category')
+    dataframe['shift_id'] = pd.to_numeric(dataframe['shift_id'], downcast='integer')
 
-        #return in descending order from most efficient format to least efficient format
-        return result_df.sort_values(by='Format Efficiency', ascending=[False])
+    # appending another column called hours_worked after the clock_in and clock_out column
+    # the time differences are done on the whole columns at once using a tools.py project that needs to be in same directory
+    # (the hours stay float64 - float32 can't hold 9.1 or 0.333 exactly so the sums and efficiencies would change)
+    dataframe.insert(loc=4, column='hours_worked', value = tools.time_dif_series(dataframe['clock_in'], dataframe['clock_out']))
+
+    # appending another column called efficiency after the hours_digitized column
+    # (efficiency of that day is defined as hours_digitized / hours_worked, rounded with numpy like the old per-row numpy floats were)
+    dataframe.insert(loc=6, column='efficiency', value = (dataframe['hours_digitized'] / dataframe['hours_worked']).round(3))
+
+    return dataframe
+
+
+def readable_shifts(dataframe):
+    '''returns a copy of a compact shift dataframe the way the excel showed it: plain dates, H:MM:SS clock times and the plain employee_id'''
+    dataframe = dataframe.copy()
+    dataframe['date_worked'] = pd.to_datetime(dataframe['date_worked']).dt.date
+    for column in ('clock_in', 'clock_out'):
+        if pd.api.types.is_numeric_dtype(dataframe[column]):
+            dataframe[column] = tools.seconds_to_time(dataframe[column])
+    for column in ('format', 'employee_id'):
+        if isinstance(dataframe[column].dtype, pd.CategoricalDtype):
+            dataframe[column] = dataframe[column].astype(dataframe[column].cat.categories.dtype)
+    return dataframe
+
+
+def read_stage(namepaths, workers, read_ahead, output, stop):
+    '''pipeline stage (runs in its own thread): reads every excel, from the cache or in a process pool, and puts (name, source, dataframe, error)
+    on output in the order given followed by None - at most read_ahead excels are being read ahead of what output has taken'''
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=instrumentation.start_worker, initargs=instrumentation.worker_settings()) as pool:
+            pending = collections.deque()
+            for name, source in namepaths:
+                if stop.is_set():
+                    break
+                pending.append((name, source, start_read(pool, source)))
+                if len(pending) > read_ahead:
+                    output.put(finish_read(*pending.popleft()))
+            while pending and not stop.is_set():
+                output.put(finish_read(*pending.popleft()))
+            # whatever is still pending was given up on
+            for name, source, reading in pending:
+                if not isinstance(reading, pd.DataFrame):
+                    reading.cancel()
+    finally:
+        output.put(None)
+
+
+def start_read(pool, source):
+    '''returns the cached dataframe for source (only files on disk are cached) or the future of reading it in the pool'''
+    if Employee.cache is not None and shift_sources.is_path(source):
+        start = time.perf_counter()
+        try:
+            dataframe = Employee.cache.get(source)
+        except OSError:
+            # the file itself can't be read - leaving it to the pool to report
+            dataframe = None
+        if dataframe is not None:
+            instruments.add_time('cache_read', time.perf_counter() - start)
+            return dataframe
+    return pool.submit(timed_read_shifts, source)
+
+
+def finish_read(name, source, reading):
+    '''waits for a read started with start_read and returns (name, source, dataframe, error) for the next pipeline stage'''
+    if isinstance(reading, pd.DataFrame):
+        return name, source, reading, None
+    try:
+        dataframe, seconds, measured = reading.result()
+    except Exception as error:
+        return name, source, None, error
+    instruments.merge(measured, name)
+    if Employee.cache is not None and shift_sources.is_path(source):
+        Employee.cache.put(source, dataframe)
+    return name, source, dataframe, None
+
+
+def write_stage(kind, file_name, window, sheets, failures, charts=True):
+    '''pipeline stage (runs in its own thread): writes every (sheet name, analysis) taken from sheets into one date or format analysis excel until None
+    a sheet that fails is recorded in failures as {sheet name : error} and the rest are still written'''
+    finished = False
+    try:
+        with tools.ReportWriter(file_name, charts=charts) as report:
+            while True:
+                item = sheets.get()
+                if item is None:
+                    finished = True
+                    break
+                sheet, dataframe = item
+                try:
+                    with instruments.timer('write_sheet', sheet):
+                        if kind == 'date':
+                            report.date_sheet(dataframe, sheet, window)
+                        else:
+                            report.format_sheet(dataframe, sheet)
+                except Exception as error:
+                    failures[sheet] = error
+                    print(sheet + ' could not be written: ' + str(error))
+    except Exception as error:
+        # the excel itself couldn't be written - still taking every sheet so the analysis stage isn't left waiting
+        failures[file_name] = error
+        print(file_name + ' could not be written: ' + str(error))
+        while not finished:
+            finished = sheets.get() is None
+
+
+def timed_read_shifts(source):
+    '''runs read_shifts and returns the dataframe, how many seconds it took and what the instruments measured - used by the process pool in Employee.from_files'''
+    start = time.perf_counter()
+    dataframe = read_shifts(source)
+    return dataframe, time.perf_counter() - start, instruments.collect()
 
 
 
 
 #main
 
-# creating dictionary which will hold names and fullpaths of xcel files from user referenced by a number index
-namepaths = {}
-counter = 1
-
-while True:
-    flag = 0 
-    print('Welcome to the Employee Analysis Gateway.')
-    name = input('Please enter name of employee. (or type STOP): ')
-    # if user wants to break out
-    if name.upper() == 'STOP':
-        break
-    # asking for directory path and filename
-    else:
+# exit codes so scheduled runs can tell what happened
+EXIT_OK = 0
+EXIT_FAILED = 1 #some employees could not be loaded or an analysis failed
+EXIT_USAGE = 2 #bad arguments (same code argparse uses)
+
+
+def parse_args(argv=None):
+    '''reads the command line - nothing heavy is imported here so --help and bad arguments come back instantly'''
+    parser = argparse.ArgumentParser(description='Analyzes employee shift excels and exports date and format analysis excels.')
+    parser.add_argument('paths', nargs='*', help='shift excels, zip archives of them or glob patterns (ex: data/*.xlsx) - employees are named after their file')
+    parser.add_argument('-m', '--manifest', help='file listing employees as "name,path" lines or a JSON {"name": "path"} object')
+    parser.add_argument('-o', '--output-dir', default='.', help='directory the analysis excels are written to (default: current directory)')
+    parser.add_argument('-w', '--workers', type=int, help='processes used to read excels and write shards (default: one per core)')
+    parser.add_argument('--cache-dir', default=os.path.join(os.path.expanduser('~'), '.excel_analyzer_cache'), help='where parsed excels are cached between runs')
+    parser.add_argument('--no-cache', action='store_true', help='always re-read every excel')
+    parser.add_argument('--shard-size', type=int, help='write the analyses as excels of this many employees each plus an index')
+    parser.add_argument('--pipeline', action='store_true', help='read, analyze and write the excels as overlapping stages (not with --shard-size)')
+    parser.add_argument('--merge', action='store_true', help='with --shard-size, also merge the shards into the single excel')
+    parser.add_argument('--no-print', action='store_true', help="don't print the data previews")
+    parser.add_argument('--no-rank', action='store_true', help="don't print the employee and format rankings")
+    parser.add_argument('--distribution', action='store_true', help='print the median, p10/p90, std and outliers of the shift efficiencies per employee and format')
+    parser.add_argument('--no-date', action='store_true', help="don't write the date analysis excel")
+    parser.add_argument('--window', type=int, default=30, help='how many of the last days worked go in the date analysis (default: 30)')
+    parser.add_argument('--rollups', action='append', default=[], choices=('day', 'week', 'month'),
+                        help='add team/employee/format trend sheets of this period to the date analysis - can be repeated')
+    parser.add_argument('--output-format', default='xlsx', choices=tools.OUTPUT_BACKENDS,
+                        help='xlsx (default, styled with charts), xlsx-summary (no charts) or parquet/csv/ndjson files per employee plus one long table')
+    parser.add_argument('--no-format', action='store_true', help="don't write the format analysis excel")
+    parser.add_argument('--serve', action='store_true', help='keep the employees loaded and answer ranking/analysis/export requests over local HTTP (see analysis_service.py)')
+    parser.add_argument('--host', default='127.0.0.1', help='address --serve listens on (default: 127.0.0.1, this machine only)')
+    parser.add_argument('--port', type=int, default=8050, help='port --serve listens on (default: 8050)')
+    parser.add_argument('--quarantine', metavar='CSV', help='write the shift rows left out because they failed validation (with the reasons) to this csv')
+    parser.add_argument('--interactive', action='store_true', help='ask for employee names and paths instead')
+    parser.add_argument('--memory', action='store_true', help="print the memory used by every employee's shifts")
+    parser.add_argument('--stats', action='store_true', help='print the time spent in every stage, the counters and a line per employee at the end')
+    parser.add_argument('--stats-json', help='write the stage timings and counters (overall and per employee) to this json file')
+    parser.add_argument('--profile', action='append', default=[], metavar='STAGE', help='run a stage (ex: read_excel, write_sheet) under cProfile - can be repeated')
+    parser.add_argument('--trace-memory', action='append', default=[], metavar='STAGE', help='record the peak memory of a stage with tracemalloc - can be repeated')
+    args = parser.parse_args(argv)
+
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers has to be at least 1')
+    if not tools.backend_available(args.output_format):
+        parser.error('--output-format ' + args.output_format + ' needs pyarrow installed')
+    if args.output_format not in ('xlsx', 'xlsx-summary') and (args.pipeline or args.shard_size):
+        parser.error('--pipeline and --shard-size only write xlsx')
+    if args.output_format == 'xlsx-summary' and args.shard_size:
+        parser.error('--shard-size only writes the full xlsx')
+    if args.rollups and (args.pipeline or args.shard_size or args.no_date):
+        parser.error('--rollups go in the single date analysis excel, not with --pipeline, --shard-size or --no-date')
+    if args.serve and (args.pipeline or args.shard_size):
+        parser.error('--serve answers requests from memory, it can not be used with --pipeline or --shard-size')
+    if args.pipeline and args.shard_size:
+        parser.error('--pipeline writes single excels, it can not be used with --shard-size')
+    if args.window < 1:
+        parser.error('--window has to be at least 1')
+    if args.shard_size is not None and args.shard_size < 1:
+        parser.error('--shard-size has to be at least 1')
+    if not (args.paths or args.manifest or args.interactive):
+        parser.error('give some excel paths/globs, a --manifest or --interactive')
+    if not os.path.isdir(args.output_dir):
+        parser.error('output directory ' + args.output_dir + ' does not exist')
+    return parser, args
+
+
+def read_manifest(manifest):
+    '''returns the [(name, path)] listed in a manifest file - paths are relative to the manifest's folder'''
+    directory = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest) as manifest_file:
+        if manifest.lower().endswith('.json'):
+            entries = list(json.load(manifest_file).items())
+        else:
+            entries = []
+            for line in manifest_file:
+                line = line.strip()
+                # skipping blank lines and comments
+                if line and not line.startswith('#'):
+                    name, path = line.split(',', 1)
+                    entries.append((name.strip(), path.strip()))
+    return [(name, os.path.join(directory, os.path.expanduser(path))) for name, path in entries]
+
+
+def expand_paths(paths):
+    '''returns the [(name, source)] of every excel given on the command line, expanding glob patterns in sorted order
+    a zip archive stands for every .xlsx inside it (read straight out of the archive, nothing is extracted)'''
+    namepaths = []
+    for path in paths:
+        matches = sorted(glob.glob(os.path.expanduser(path))) if glob.has_magic(path) else [path]
+        for match in matches:
+            if match.lower().endswith('.zip') and os.path.isfile(match):
+                namepaths += [(shift_sources.source_name(member), member) for member in shift_sources.zip_members(match)]
+            else:
+                namepaths.append((shift_sources.source_name(match), match))
+    return namepaths
+
+
+def interactive():
+    '''asks for employee names and excel paths until STOP and returns them as [(name, path)]'''
+    namepaths = []
+    while True:
+        print('Welcome to the Employee Analysis Gateway.')
+        name = input('Please enter name of employee. (or type STOP): ')
+        # if user wants to break out
+        if name.upper() == 'STOP':
+            return namepaths
+        # asking for directory path and filename
         while True:
             path = str(input('Please enter full path of employee excel data (directory path + filename) or STOP: '))
             if path.upper() == 'STOP':
-                flag = 1
+                return namepaths
+            # making sure directory is directory / file is a file / and it's an excel file
+            if os.path.isfile(path) and path[-4:] == 'xlsx':
                 break
-            # making sure it was a valid input:
-            try:
-                directory = os.path.dirname(path)
-                base = os.path.basename(path)
-                # making sure directory is directory / file is a file / and it's an excel file. if not, force an error
-                if not ((os.path.isdir(directory)) and (os.path.isfile(path)) and (base[-4:] == 'xlsx')):
-                    base = 1/0
-                else:
-                    break
-            except:
-                print('That was not a valid input.')
-    # appending to the dictionary, then increasing the counter for the next loop
-    if flag == 0:
-        namepaths[counter] = (name, path)
-        print(counter, 'Initialized\n')
-        counter += 1
-    else:
-        break
-
-
-if namepaths:
-    print('\nAnalyzing in...')
-    print('3')
-    time.sleep(1)
-    print('2')
-    time.sleep(1)
-    print('1\n')
-    time.sleep(1)
-    for namepath in namepaths:
-        # extracting the name and path from each dictionary key
-        name, path = namepaths[namepath]
-        # creating an instance of that employee to be analyzed and sending it the name and path
-        namepath = Employee(name, path)
+            print('That was not a valid input.')
+        namepaths.append((name, path))
+        print(len(namepaths), 'Initialized\n')
+
+
+def main(argv=None):
+    '''runs the whole application from the command line and returns the exit code'''
+    parser, args = parse_args(argv)
+
+    # collecting the employees and checking the files exist before anything gets loaded
+    namepaths = interactive() if args.interactive else []
+    try:
+        if args.manifest:
+            namepaths += read_manifest(args.manifest)
+    except (OSError, ValueError) as error:
+        parser.error('could not read manifest ' + args.manifest + ': ' + str(error))
+    try:
+        namepaths += expand_paths(args.paths)
+    except (OSError, zipfile.BadZipFile) as error:
+        parser.error('could not read zip archive: ' + str(error))
+    if not namepaths:
+        if args.interactive:
+            print('Goodbye.')
+            return EXIT_OK
+        parser.error('no excel files matched')
+    missing = [path for name, path in namepaths if shift_sources.is_path(path) and not os.path.isfile(path)]
+    if missing:
+        parser.error('these files do not exist: ' + ', '.join(missing))
+    # employees are told apart by name, so two different files can't both be named after the same file name
+    duplicates = shift_sources.duplicate_names(namepaths)
+    if duplicates:
+        parser.error('more than one file would be the employee ' + ', '.join(duplicates) + ' - rename the files or name them in a --manifest')
+    # (the same file given twice is only loaded once)
+    namepaths = list(dict(((name, shift_sources.source_key(source)), (name, source)) for name, source in namepaths).values())
+
+    if not args.no_cache:
+        # keeping the parsed excels around so unchanged files load instantly next run
+        Employee.cache = shift_cache.ShiftCache(args.cache_dir)
+
+    # the deep dives are only switched on when asked for
+    for stage in args.profile:
+        instruments.profile(stage)
+    for stage in args.trace_memory:
+        instruments.profile(stage, cpu=False, memory=True)
+
+    errors = {}
+    try:
+        if args.pipeline:
+            # the analysis excels get written while the excels are still being read
+            Employee.run_pipeline(namepaths, args.output_dir, args.window, args.workers, errors=errors,
+                                  date=not args.no_date, format=not args.no_format, charts=args.output_format == 'xlsx')
+        else:
+            Employee.from_files(namepaths, args.workers, errors)
+    finally:
+        if args.quarantine:
+            # written whatever happened loading - the rows left out can be why it failed or nobody loaded
+            quarantine = Employee.quarantine_report()
+            quarantine.to_csv(args.quarantine, index=False)
+            print(str(len(quarantine)) + ' quarantined rows written to ' + args.quarantine)
+    if not Employee.employee_list:
+        print('No employees could be loaded.')
+        return EXIT_FAILED
+
+    if args.serve:
+        # the service is only imported when it's wanted - it answers from the employees loaded above until stopped
+        import analysis_service
+        analysis_service.serve(Employee, args.host, args.port, args.window)
+        report_stats(args)
+        return EXIT_FAILED if errors else EXIT_OK
+
     # Running the application - printing sample data, printing the efficiency ranks of the employees entered, then creating the excel analyses
-    Employee.print_all()
-    Employee.employee_rank()
-    Employee.analyze_all_date()
-    Employee.analyze_all_format()
-else:
-    print('Goodbye.')
+    try:
+        if not args.no_print:
+            Employee.print_all()
+        if args.memory:
+            Employee.memory_report()
+        if not args.no_rank:
+            Employee.employee_rank()
+            Employee.format_rank()
+        if args.distribution:
+            Employee.distribution_report()
+        if not args.no_date and not args.pipeline:
+            Employee.analyze_all_date(args.shard_size, args.workers, args.merge, args.output_dir, args.window, args.output_format, args.rollups)
+        if not args.no_format and not args.pipeline:
+            Employee.analyze_all_format(args.shard_size, args.workers, args.merge, args.output_dir, args.output_format)
+    except Exception as error:
+        print('Analysis failed: ' + repr(error), file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        report_stats(args)
+
+    return EXIT_FAILED if errors else EXIT_OK
+
+
+def report_stats(args):
+    '''prints and/or writes out what the instruments measured, as asked for on the command line'''
+    if args.stats or args.profile or args.trace_memory:
+        print()
+        instruments.print_summary()
+    if args.stats_json:
+        instruments.to_json(args.stats_json)
+        print('Stats written to ' + args.stats_json)
+
 
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+#--------------------------------------------------------------
+#               Instrumentation Module
+#
+#--------------------------------------------------------------
+
+# Named timers and counters around the stages of a run (reading excels, parsing dates, the
+# analyses, writing workbooks...) so a slow run shows where the time went. Every measurement is
+# added up overall and, when an employee is given, for that employee too.
+# A timer is one perf_counter call on each side of the stage and a counter is one dictionary add,
+# so the instruments are left on all the time - the stages they wrap are whole files/sheets, never rows.
+# For a deep dive, a stage can also be run under cProfile and/or tracemalloc (off unless asked for).
+#
+# Work done in a process pool is measured in the worker: the worker hands its measurements back
+# with collect() and the parent adds them in with merge(). Threads (the pipelined run) can share
+# the instruments - the totals are only changed while holding a lock.
+
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Instruments(object):
+    '''named timers and counters, overall and per employee, with opt-in cProfile/tracemalloc of chosen stages'''
+
+    def __init__(self):
+        self.profiled = set() #stages run under cProfile
+        self.memory_traced = set() #stages run under tracemalloc
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        '''forgets every measurement (the stages chosen for profiling stay chosen)'''
+        self.timers = {} #{stage : [seconds, calls]}
+        self.counters = {} #{counter : amount}
+        self.employees = {} #{employee name : {'timers': {stage : [seconds, calls]}, 'counters': {counter : amount}}}
+        self.profiles = {} #{stage : pstats.Stats}
+        self.memory_peaks = {} #{stage : most bytes allocated at once while the stage ran}
+
+
+    def profile(self, stage, cpu=True, memory=False):
+        '''turns on the deep dive for a stage - cpu runs it under cProfile, memory under tracemalloc'''
+        if cpu:
+            self.profiled.add(stage)
+        if memory:
+            self.memory_traced.add(stage)
+
+
+    @contextmanager
+    def timer(self, stage, employee=None):
+        '''times the code in the with block as one call of stage (for employee too if given)'''
+        if stage in self.profiled or stage in self.memory_traced:
+            with self._deep_dive(stage):
+                start = time.perf_counter()
+                try:
+                    yield
+                finally:
+                    self.add_time(stage, time.perf_counter() - start, employee)
+        else:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.add_time(stage, time.perf_counter() - start, employee)
+
+
+    def add_time(self, stage, seconds, employee=None, calls=1):
+        '''adds seconds that were measured somewhere else to stage'''
+        with self.lock:
+            timers = [self.timers]
+            if employee is not None:
+                timers.append(self._employee(employee)['timers'])
+            for timer in timers:
+                total = timer.setdefault(stage, [0.0, 0])
+                total[0] += seconds
+                total[1] += calls
+
+
+    def count(self, counter, amount=1, employee=None):
+        '''adds amount to counter (for employee too if given)'''
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+            if employee is not None:
+                counters = self._employee(employee)['counters']
+                counters[counter] = counters.get(counter, 0) + amount
+
+
+    def collect(self):
+        '''returns everything measured so far as plain data (so it can be sent back from a worker process) and resets'''
+        measurements = {'timers': self.timers,
+                        'counters': self.counters,
+                        'employees': self.employees,
+                        'profiles': {stage: stats.stats for stage, stats in self.profiles.items()},
+                        'memory_peaks': self.memory_peaks}
+        self.reset()
+        return measurements
+
+
+    def merge(self, measurements, employee=None):
+        '''adds measurements returned by collect() - overall ones are also credited to employee if given'''
+        for stage, (seconds, calls) in measurements['timers'].items():
+            self.add_time(stage, seconds, employee, calls)
+        for counter, amount in measurements['counters'].items():
+            self.count(counter, amount, employee)
+        for name, employee_measurements in measurements['employees'].items():
+            # these were already counted overall by the worker, so only the employee's totals get them
+            with self.lock:
+                own = self._employee(name)
+                for stage, (seconds, calls) in employee_measurements['timers'].items():
+                    total = own['timers'].setdefault(stage, [0.0, 0])
+                    total[0] += seconds
+                    total[1] += calls
+                for counter, amount in employee_measurements['counters'].items():
+                    own['counters'][counter] = own['counters'].get(counter, 0) + amount
+        for stage, raw_stats in measurements['profiles'].items():
+            stats = pstats.Stats()
+            stats.stats = raw_stats
+            stats.get_top_level_stats()
+            self._add_profile(stage, stats)
+        for stage, peak in measurements['memory_peaks'].items():
+            self.memory_peaks[stage] = max(peak, self.memory_peaks.get(stage, 0))
+
+
+    def report(self):
+        '''returns every measurement as a dictionary that can go straight to json'''
+        return {'stages': {stage: {'seconds': round(seconds, 6), 'calls': calls} for stage, (seconds, calls) in self.timers.items()},
+                'counters': dict(self.counters),
+                'employees': {name: {'stages': {stage: {'seconds': round(seconds, 6), 'calls': calls} for stage, (seconds, calls) in measurements['timers'].items()},
+                                     'counters': dict(measurements['counters'])}
+                              for name, measurements in self.employees.items()},
+                'memory_peaks': dict(self.memory_peaks)}
+
+
+    def to_json(self, path):
+        '''writes report() to a json file'''
+        with open(path, 'w') as json_file:
+            json.dump(self.report(), json_file, indent=2)
+
+
+    def print_summary(self, employees=True):
+        '''prints the stage timings, the counters, and (with employees=True) one line per employee as tables'''
+        import tools
+
+        print('Time per stage:')
+        tools.table_print(('Stage', 'Seconds', 'Calls'), [(stage, round(seconds, 3), calls) for stage, (seconds, calls) in self.timers.items()], 18)
+        if self.counters:
+            print('Counters:')
+            tools.table_print(('Counter', 'Amount'), sorted(self.counters.items()), 18)
+        if self.memory_peaks:
+            print('Peak memory per stage (tracemalloc):')
+            tools.table_print(('Stage', 'MB'), [(stage, round(peak / 1024 / 1024, 1)) for stage, peak in self.memory_peaks.items()], 18)
+        if employees and self.employees:
+            # the employees' columns are every stage/counter any of them has
+            stages = sorted(set(stage for measurements in self.employees.values() for stage in measurements['timers']))
+            counters = sorted(set(counter for measurements in self.employees.values() for counter in measurements['counters']))
+            print('Per employee (seconds / counts):')
+            tools.table_print(['Employee'] + stages + counters,
+                              [[name] + [round(measurements['timers'].get(stage, (0.0, 0))[0], 3) for stage in stages]
+                                      + [measurements['counters'].get(counter, 0) for counter in counters]
+                               for name, measurements in self.employees.items()], 18)
+        for stage in self.profiles:
+            print('cProfile of ' + stage + ':')
+            print(self.profile_text(stage))
+
+
+    def profile_text(self, stage, lines=20):
+        '''returns the top lines of the cProfile of a stage sorted by cumulative time'''
+        output = io.StringIO()
+        stats = self.profiles[stage]
+        stats.stream = output
+        stats.sort_stats('cumulative').print_stats(lines)
+        return output.getvalue()
+
+
+    @contextmanager
+    def _deep_dive(self, stage):
+        profiler = None
+        tracing = False
+        if stage in self.profiled:
+            profiler = cProfile.Profile()
+        # a stage inside another traced stage just shares the outer one's measurement
+        if stage in self.memory_traced and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            tracing = True
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._add_profile(stage, pstats.Stats(profiler))
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.memory_peaks[stage] = max(peak, self.memory_peaks.get(stage, 0))
+
+
+    def _add_profile(self, stage, stats):
+        if stage in self.profiles:
+            self.profiles[stage].add(stats)
+        else:
+            self.profiles[stage] = stats
+
+
+    def _employee(self, employee):
+        measurements = self.employees.get(employee)
+        if measurements is None:
+            measurements = self.employees[employee] = {'timers': {}, 'counters': {}}
+        return measurements
+
+
+
+# the instruments every module records to
+instruments = Instruments()
+
+
+def start_worker(profiled=(), memory_traced=()):
+    '''process pool initializer - starts the worker's instruments empty (a forked worker would otherwise carry the parent's) with the same deep dives'''
+    instruments.reset()
+    instruments.profiled = set(profiled)
+    instruments.memory_traced = set(memory_traced)
+
+
+def worker_settings():
+    '''the initargs for start_worker that give workers this process's deep dives'''
+    return (sorted(instruments.profiled), sorted(instruments.memory_traced))
+
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    # measurements sent back from a worker with collect() add up the same as if they were made here
+    worker = Instruments()
+    with worker.timer('stage', 'Joe'):
+        worker.count('rows_parsed', 10, 'Joe')
+    parent = Instruments()
+    parent.count('rows_parsed', 5)
+    parent.merge(worker.collect())
+    print('Testing instruments merge:', parent.counters == {'rows_parsed': 15} and parent.employees['Joe']['counters'] == {'rows_parsed': 10}
+          and parent.timers['stage'][1] == 1 and not worker.timers)
+
+    # the report has every stage, counter and employee, and is what to_json writes
+    parent.add_time('write_sheet', 0.25, 'Ann', calls=2)
+    report = parent.report()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'instruments.json')
+        parent.to_json(path)
+        with open(path) as json_file:
+            written = json.load(json_file)
+    print('Testing instruments report:', written == report and sorted(report['stages']) == ['stage', 'write_sheet']
+          and report['stages']['write_sheet'] == {'seconds': 0.25, 'calls': 2} and report['counters'] == {'rows_parsed': 15}
+          and report['employees']['Ann'] == {'stages': {'write_sheet': {'seconds': 0.25, 'calls': 2}}, 'counters': {}}
+          and report['employees']['Joe']['counters'] == {'rows_parsed': 10})
@@ -0,0 +1,273 @@
+#--------------------------------------------------------------
+#               Shift Cache Module
+#
+#--------------------------------------------------------------
+
+# Keeps the fully derived employee dataframes (hours_worked and efficiency already added)
+# on disk so a workbook only has to be parsed again when the file itself changes.
+# The dataframes are stored with pandas' pickle format, which writes the column blocks
+# straight to disk as binary and reads back much faster than unzipping the xlsx xml.
+# Hits, puts and evictions only change the index in memory - it is written by flush() at the end
+# of a batch and when the program exits, so a run over N files writes it once instead of N times.
+# A put doesn't go through the whole index either: the key a miss hashed is kept for the put that
+# follows it, the entry a path had before is looked up in {path : key}, the total size is kept
+# as entries come and go, and the least recently used entries are only sorted out once it's over the cap.
+
+import os
+import json
+import time
+import atexit
+import hashlib
+import tools
+from instrumentation import instruments
+
+pd = tools.lazy_import('pandas')
+
+
+class ShiftCache(object):
+    '''on-disk cache of parsed shift dataframes keyed by the path, size, mtime and content hash of the excel they came from'''
+
+    # goes up whenever read_shifts gives different dataframes (columns, dtypes or which rows - ex: 3 is the first version
+    # with the rows checked by shift_validation) so older cached frames aren't used
+    version = 3
+
+    def __init__(self, directory, max_bytes=500 * 1024 * 1024):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False #the index in memory has changes that aren't on disk yet
+        self.missed = {} #{path : key} of the misses not put yet, so put doesn't hash the file again
+
+        # the index is {key: {'path':..., 'bytes':..., 'last_used':...}} and lives next to the cached frames
+        self.index_path = os.path.join(self.directory, 'index.json')
+        try:
+            with open(self.index_path) as index_file:
+                self.index = json.load(index_file)
+        except (OSError, ValueError):
+            self.index = {}
+        self.paths = {entry['path']: key for key, entry in self.index.items()} #{path : its key in the index}
+        self.bytes = sum(entry['bytes'] for entry in self.index.values())
+        # the cap might have been lowered since the last run
+        self.evict()
+        # whatever wasn't flushed (ex: an Employee made on its own) is written on the way out
+        atexit.register(self._flush_at_exit)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+    def __str__(self):
+        '''one line summary of the cache for printing'''
+        return 'Cache: {} hits | {} misses | {} files | {:.1f} MB'.format(self.hits, self.misses, len(self.index), self.total_bytes() / 1024 / 1024)
+
+
+    @staticmethod
+    def fingerprint(fullpath):
+        '''returns the cache key of an excel file - it changes whenever the path, size, mtime or content of the file does (or the cache version)'''
+        fullpath = os.path.abspath(fullpath)
+        stat = os.stat(fullpath)
+        content_hash = hashlib.sha1()
+        with open(fullpath, 'rb') as excel_file:
+            for block in iter(lambda: excel_file.read(1024 * 1024), b''):
+                content_hash.update(block)
+        key = '|'.join((str(ShiftCache.version), fullpath, str(stat.st_size), str(stat.st_mtime_ns), content_hash.hexdigest()))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+    def get(self, fullpath, key=None):
+        '''returns the cached dataframe for this excel file or None if it isn't cached (or the file changed since)
+        key is the file's fingerprint if it was already worked out'''
+        fullpath = os.path.abspath(fullpath)
+        key = ShiftCache.fingerprint(fullpath) if key is None else key
+        entry = self.index.get(key)
+        if entry is not None:
+            try:
+                dataframe = pd.read_pickle(self._entry_path(key))
+            except Exception:
+                # a missing or unreadable entry is just a miss - drop it so it gets rewritten
+                self._remove(key)
+            else:
+                self.hits += 1
+                instruments.count('cache_hits')
+                entry['last_used'] = time.time()
+                self.dirty = True
+                return dataframe
+        self.misses += 1
+        instruments.count('cache_misses')
+        self.missed[fullpath] = key
+        return None
+
+
+    def put(self, fullpath, dataframe, key=None):
+        '''stores the dataframe for this excel file, replacing anything cached for an older version of the file
+        key is the file's fingerprint - by default the one the last get of this file missed on (the file is only hashed again without one)'''
+        fullpath = os.path.abspath(fullpath)
+        missed = self.missed.pop(fullpath, None)
+        if key is None:
+            key = ShiftCache.fingerprint(fullpath) if missed is None else missed
+
+        # the file changed if the same path is cached under a different key, so that entry is invalid now
+        old_key = self.paths.get(fullpath)
+        if old_key is not None and old_key != key:
+            self._remove(old_key)
+
+        dataframe.to_pickle(self._entry_path(key))
+        self._remove(key, keep_file=True)
+        self.index[key] = {'path': fullpath, 'bytes': os.path.getsize(self._entry_path(key)), 'last_used': time.time()}
+        self.paths[fullpath] = key
+        self.bytes += self.index[key]['bytes']
+        self.dirty = True
+        if self.bytes > self.max_bytes:
+            self.evict()
+
+
+    def load(self, fullpath, reader):
+        '''returns the cached dataframe for this excel file, calling reader(fullpath) and caching the result on a miss'''
+        key = ShiftCache.fingerprint(fullpath)
+        dataframe = self.get(fullpath, key)
+        if dataframe is None:
+            dataframe = reader(fullpath)
+            self.put(fullpath, dataframe, key)
+        return dataframe
+
+
+    def flush(self):
+        '''writes the index if hits, puts or evictions changed it since it was last written'''
+        if self.dirty:
+            self._save_index()
+
+
+    def close(self):
+        '''writes whatever the index still has in memory - the cache can still be used after'''
+        self.flush()
+
+
+    def evict(self):
+        '''removes the least recently used entries until the cache fits in max_bytes'''
+        if self.bytes <= self.max_bytes:
+            return
+        for key in sorted(self.index, key=lambda key: self.index[key]['last_used']):
+            if self.bytes <= self.max_bytes:
+                break
+            self._remove(key)
+
+
+    def clear(self):
+        '''removes every cached dataframe and resets the hit/miss counters'''
+        for key in list(self.index):
+            self._remove(key)
+        self._save_index()
+        self.hits = 0
+        self.misses = 0
+
+
+    def total_bytes(self):
+        '''returns how much disk space the cached dataframes are using'''
+        return self.bytes
+
+
+    def stats(self):
+        '''returns the hit/miss counters and size of the cache as a dictionary'''
+        return {'hits': self.hits, 'misses': self.misses, 'files': len(self.index), 'bytes': self.total_bytes()}
+
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+
+    def _remove(self, key, keep_file=False):
+        entry = self.index.pop(key, None)
+        if entry is not None:
+            self.dirty = True
+            self.bytes -= entry['bytes']
+            if self.paths.get(entry['path']) == key:
+                del self.paths[entry['path']]
+        if keep_file:
+            return
+        try:
+            os.remove(self._entry_path(key))
+        except OSError:
+            pass
+
+
+    def _flush_at_exit(self):
+        # nothing can be reported any more at exit - the last_used times are just lost if the directory is gone
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+
+    def _save_index(self):
+        self.dirty = False
+        # writing to a temp file first so a crash mid-write can't leave a broken index behind
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as index_file:
+            json.dump(self.index, index_file)
+        os.replace(temp_path, self.index_path)
+
+
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    try:
+        excel = os.path.join(directory, 'shifts.xlsx')
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'Humanity_Shift_Employee001.xlsx'), excel)
+        frame = pd.DataFrame({'hours_worked': [1.5, 2.0]})
+        cache = ShiftCache(os.path.join(directory, 'cache'))
+        # a miss hashes the file once - the put after it uses the same key
+        fingerprint, hashed = ShiftCache.fingerprint, []
+        ShiftCache.fingerprint = staticmethod(lambda path: hashed.append(path) or fingerprint(path))
+        first = cache.get(excel)
+        cache.put(excel, frame)
+        ShiftCache.fingerprint = staticmethod(fingerprint)
+        hit = cache.get(excel)
+        print('Testing cache miss then hit:', first is None and hit.equals(frame) and (cache.hits, cache.misses) == (1, 1) and len(hashed) == 1)
+
+        # puts and hits only change the index in memory until flush
+        unwritten = not os.path.exists(cache.index_path)
+        cache.flush()
+        index_on_disk = open(cache.index_path).read()
+        cache.get(excel)
+        unchanged = open(cache.index_path).read() == index_on_disk
+        cache.flush()
+        print('Testing cache index flushed once:', unwritten and unchanged and open(cache.index_path).read() != index_on_disk and not cache.dirty
+              and json.load(open(cache.index_path)) == cache.index)
+
+        # touching the file (same content, new mtime) makes it a miss, and putting it again drops the old entry
+        os.utime(excel, ns=(0, os.stat(excel).st_mtime_ns + 10 ** 9))
+        miss = cache.get(excel)
+        cache.put(excel, frame)
+        hit = cache.get(excel)
+        cache.close()
+        print('Testing cache miss on mtime change:', miss is None and len(cache.index) == 1 and hit.equals(frame)
+              and json.load(open(cache.index_path)) == cache.index)
+
+        # a frame cached by an older version (ex: before the rows were validated) is a miss, not served as it was
+        ShiftCache.version -= 1
+        cache.put(excel, frame)
+        ShiftCache.version += 1
+        print('Testing cache miss on an older version:', cache.get(excel) is None)
+
+        # past max_bytes the least recently used entries go, and the running size stays the sum of what's left
+        small = ShiftCache(os.path.join(directory, 'small'), max_bytes=2 * cache.index[cache.paths[os.path.abspath(excel)]]['bytes'])
+        for number in range(4):
+            copy = os.path.join(directory, 'shifts{}.xlsx'.format(number))
+            shutil.copy(excel, copy)
+            small.put(copy, frame)
+        small.flush()
+        print('Testing cache eviction:', sorted(entry['path'][-12:] for entry in small.index.values()) == ['shifts2.xlsx', 'shifts3.xlsx']
+              and small.total_bytes() == sum(entry['bytes'] for entry in small.index.values()) <= small.max_bytes
+              and sorted(os.listdir(small.directory)) == sorted([key + '.pkl' for key in small.index] + ['index.json']))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,244 @@
+#--------------------------------------------------------------
+#               Shift Query Module
+#
+#--------------------------------------------------------------
+
+# Answers questions like "efficiency of employee 5 on vhs in March" over every loaded shift without
+# scanning the whole table. The registry's table gets one sorted index per key (employee,
+# employee_id, format, date_worked): the row positions in key order and the keys themselves sorted,
+# so a point or a range is two binary searches and a slice. A query looks up its most selective
+# condition in that condition's index and only checks the other conditions on the rows it found,
+# so the work grows with the rows matched rather than with the table.
+# The indexes are built once per table - the registry keeps the query until the shifts change.
+
+import tools
+from instrumentation import instruments
+from employee_registry import fsum_groups
+
+pd = tools.lazy_import('pandas')
+np = tools.lazy_import('numpy')
+
+# the columns that get an index (and can be filtered and grouped on)
+KEYS = ('employee', 'employee_id', 'format', 'date_worked')
+
+
+class SortedIndex(object):
+    '''row positions of a column sorted by its values (stable, so equal values stay in table order) and the sorted values'''
+
+    def __init__(self, values):
+        values = np.asarray(values)
+        self.order = np.argsort(values, kind='mergesort')
+        self.values = values[self.order]
+
+
+    def __len__(self):
+        return len(self.order)
+
+
+    def span(self, low=None, high=None):
+        '''returns (first, stop) of the sorted values from low to high (both included, either can be left open)'''
+        first = 0 if low is None else int(np.searchsorted(self.values, low, side='left'))
+        stop = len(self.values) if high is None else int(np.searchsorted(self.values, high, side='right'))
+        return first, max(first, stop)
+
+
+    def between(self, low=None, high=None):
+        '''returns the row positions with values from low to high (both included, either can be left open)'''
+        first, stop = self.span(low, high)
+        return self.order[first:stop]
+
+
+
+class ShiftQuery(object):
+    '''indexed filter / group / aggregate over a shift table with employee, employee_id, format and date_worked columns (like EmployeeRegistry.table)
+
+    filters are given as keywords: employee, employee_id, format and date_worked take one value or a list of them,
+    start and end keep the shifts worked from start to end (both included). Every filter given has to match.'''
+
+    def __init__(self, table):
+        self.table = table
+        self.keys = {} #{key : the key of every row - category codes for categorical columns, datetime64 for dates}
+        self.categories = {} #{key : its categories} for the categorical keys
+        self.codes = {} #{key : {category : code}} for the categorical keys
+        self.indexes = {} #{key : SortedIndex of the key}
+        with instruments.timer('query_index'):
+            for key in KEYS:
+                if key not in table.columns:
+                    continue
+                column = table[key]
+                if isinstance(column.dtype, pd.CategoricalDtype):
+                    self.categories[key] = column.cat.categories
+                    self.codes[key] = {category: code for code, category in enumerate(column.cat.categories)}
+                    self.keys[key] = column.cat.codes.to_numpy()
+                else:
+                    self.keys[key] = column.to_numpy()
+                self.indexes[key] = SortedIndex(self.keys[key])
+
+
+    def __len__(self):
+        return len(self.table)
+
+
+    def rows(self, **filters):
+        '''returns the table positions of the shifts matching every filter, in table order'''
+        conditions = self._conditions(filters)
+        if not conditions:
+            return np.arange(len(self.table))
+        with instruments.timer('query'):
+            # every condition is a few spans of its index - the one with the fewest rows is the only one read out of its index
+            spans = [[self.indexes[key].span(low, high) for low, high in intervals] for key, intervals in conditions]
+            sizes = [sum(stop - first for first, stop in condition_spans) for condition_spans in spans]
+            chosen = int(np.argmin(sizes))
+            key = conditions[chosen][0]
+            order = self.indexes[key].order
+            positions = np.concatenate([order[first:stop] for first, stop in spans[chosen]] or [np.array([], dtype=np.int64)])
+            # the other conditions are only checked on the rows found
+            for position, (key, intervals) in enumerate(conditions):
+                if position != chosen and len(positions):
+                    positions = positions[self._matches(key, intervals, positions)]
+            instruments.count('query_rows', len(positions))
+            # one value of a stable index is already in table order, anything else has to be put back in it
+            low, high = conditions[chosen][1][0] if len(conditions[chosen][1]) == 1 else (None, None)
+            return positions if low is not None and low == high else np.sort(positions)
+
+
+    def select(self, columns=None, **filters):
+        '''returns the shifts matching every filter (only columns if given) in table order'''
+        selected = self.table.iloc[self.rows(**filters)]
+        return selected if columns is None else selected.loc[:, list(columns)]
+
+
+    def aggregate(self, by=(), how='sum', **filters):
+        '''returns hours_digitized, hours_worked, Sample Size and Efficiency (hours digitized / hours worked) of the matching shifts
+        grouped by any combination of the keys in by (one row for all of them if by is empty), in key order
+        how='sum' adds up the hours (with math.fsum, like the registry) and how='mean' averages them per shift'''
+        by = [by] if isinstance(by, str) else list(by)
+        for key in by:
+            if key not in self.keys:
+                raise ValueError('can only group by ' + ', '.join(self.keys) + ' - not ' + str(key))
+        if how not in ('sum', 'mean'):
+            raise ValueError("how has to be 'sum' or 'mean' - not " + str(how))
+
+        positions = self.rows(**filters)
+        with instruments.timer('aggregate'):
+            # each key is factorized in sorted order and folded into one group code, so groups come out sorted by the keys
+            groups = np.zeros(len(positions), dtype=np.int64)
+            for key in by:
+                codes, uniques = pd.factorize(self.keys[key][positions], sort=True)
+                groups, _ = pd.factorize(groups * len(uniques) + codes, sort=True)
+            digitized, worked, counts, firsts = fsum_groups(groups, self.table['hours_digitized'].to_numpy()[positions],
+                                                            self.table['hours_worked'].to_numpy()[positions])
+
+            result = pd.DataFrame({key: self._decode(key, self.keys[key][positions[firsts]]) for key in by})
+            result['hours_digitized'] = np.asarray(digitized, dtype=float)
+            result['hours_worked'] = np.asarray(worked, dtype=float)
+            result['Sample Size'] = counts
+            result['Efficiency'] = (result['hours_digitized'] / result['hours_worked']).round(3)
+            if how == 'mean':
+                result['hours_digitized'] = result['hours_digitized'] / counts
+                result['hours_worked'] = result['hours_worked'] / counts
+            return result
+
+
+    def _conditions(self, filters):
+        '''turns the filter keywords into [(key, [(low, high) intervals of index values])]'''
+        conditions = []
+        start, end = filters.pop('start', None), filters.pop('end', None)
+        for key, values in filters.items():
+            if key not in self.indexes:
+                raise ValueError('can only filter on ' + ', '.join(self.indexes) + ', start and end - not ' + key)
+            values = [values] if np.ndim(values) == 0 else list(values)
+            keys = self._encode(key, values)
+            conditions.append((key, [(value, value) for value in keys]))
+        if start is not None or end is not None:
+            conditions.append(('date_worked', [(None if start is None else self._encode('date_worked', [start])[0],
+                                                None if end is None else self._encode('date_worked', [end])[0])]))
+        return conditions
+
+
+    def _encode(self, key, values):
+        '''returns values as they are kept in the key's index (values that aren't in a categorical key are left out)'''
+        if key in self.categories:
+            codes = self.codes[key]
+            return [self.keys[key].dtype.type(codes[value]) for value in values if value in codes]
+        if key == 'date_worked':
+            return [pd.Timestamp(value).to_datetime64() for value in values]
+        return values
+
+
+    def _decode(self, key, values):
+        '''turns index values back into what the table shows'''
+        if key in self.categories:
+            return np.asarray(self.categories[key])[values]
+        return values
+
+
+    def _matches(self, key, intervals, positions):
+        '''returns which of positions have a key inside one of the intervals'''
+        keys = self.keys[key][positions]
+        if all(low is not None and high is not None and low == high for low, high in intervals):
+            # np.isin has a lot of overhead for the usual case of one value
+            return keys == intervals[0][0] if len(intervals) == 1 else np.isin(keys, [low for low, high in intervals])
+        matches = np.zeros(len(keys), dtype=bool)
+        for low, high in intervals:
+            inside = np.ones(len(keys), dtype=bool)
+            if low is not None:
+                inside &= keys >= low
+            if high is not None:
+                inside &= keys <= high
+            matches |= inside
+        return matches
+
+
+
+if __name__ == "__main__":
+    import os
+    import io
+    import math
+    import contextlib
+    import excel_data_analysis
+
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    with contextlib.redirect_stdout(io.StringIO()):
+        for number in (1, 2, 3):
+            excel_data_analysis.Employee('Employee' + str(number), os.path.join(data, 'Humanity_Shift_Employee00' + str(number) + '.xlsx'))
+    table = excel_data_analysis.Employee.registry.table
+    query = excel_data_analysis.Employee.query()
+
+    def naive(employee=None, format=None, start=None, end=None):
+        # the same filters as a mask over the whole table
+        mask = np.ones(len(table), dtype=bool)
+        if employee is not None:
+            mask &= table['employee'].isin([employee] if isinstance(employee, str) else employee).to_numpy()
+        if format is not None:
+            mask &= table['format'].isin([format] if isinstance(format, str) else format).to_numpy()
+        if start is not None:
+            mask &= (table['date_worked'] >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (table['date_worked'] <= pd.Timestamp(end)).to_numpy()
+        return table[mask]
+
+    filters = [{}, {'format': 'vhs'}, {'employee': ['Employee3', 'Employee1'], 'format': ['vhs', 'betacam']},
+               {'start': '2010-01-01', 'end': '2012-12-31'}, {'employee': 'Employee2', 'start': '2015-06-01'},
+               {'end': '2005-01-01', 'format': 'minidv'}, {'format': 'not_a_format'}, {'start': '2030-01-01'}]
+    print('Testing select vs a mask:', all(query.select(**dict(condition)).equals(naive(**condition)) for condition in filters))
+
+    def naive_aggregate(by, **condition):
+        # a plain groupby, with the hours added up exactly like the query does
+        # (on the keys as plain values - pandas 1.5 doesn't sort the groups of categoricals with observed=True)
+        shifts = naive(**condition).astype({key: object for key in by if key != 'date_worked'})
+        groups = shifts.groupby(by, sort=True)
+        result = groups[['hours_digitized', 'hours_worked']].agg(lambda hours: math.fsum(hours)).reset_index()
+        result['Sample Size'] = groups.size().to_numpy()
+        result['Efficiency'] = (result['hours_digitized'] / result['hours_worked']).round(3)
+        return result
+
+    matches = True
+    for by in (['employee'], ['format'], ['employee', 'format'], ['format', 'date_worked']):
+        for condition in filters[1:6]:
+            aggregated = query.aggregate(by=by, **dict(condition))
+            matches = matches and aggregated.equals(naive_aggregate(by, **condition))
+    # and how='mean' is the same sums over the sample sizes
+    means, sums = query.aggregate(by='format', how='mean'), naive_aggregate(['format'])
+    print('Testing aggregate vs groupby:', matches and means['hours_worked'].equals(sums['hours_worked'] / sums['Sample Size'])
+          and means['Efficiency'].equals(sums['Efficiency']))
@@ -0,0 +1,179 @@
+#--------------------------------------------------------------
+#               Shift Rollups Module
+#
+#--------------------------------------------------------------
+
+# Precomputed hours_digitized / hours_worked sums and shift counts per employee x format at day,
+# week (starting monday) and month granularity, so trends over time don't go back to the raw shifts.
+# New shifts are first summed per day and only those day sums are rolled up into their weeks and
+# months and added to the tables - the coarser periods are always derived from the finer one and
+# nothing already in the tables is recomputed. Per employee, per format and team wide views are
+# summed out of the employee x format tables when asked for (and kept until the next update).
+# Sums use math.fsum (see employee_registry.fsum_groups) - when new shifts land on a period that
+# already has a total, the two are added once, so totals can differ from a fresh build in the last bit.
+
+import tools
+from instrumentation import instruments
+from employee_registry import fsum_groups
+
+pd = tools.lazy_import('pandas')
+np = tools.lazy_import('numpy')
+
+PERIODS = ('day', 'week', 'month')
+KEYS = ['employee', 'format', 'period']
+VALUES = ['hours_digitized', 'hours_worked', 'shifts']
+
+
+class ShiftRollups(object):
+    '''day/week/month sums of hours_digitized, hours_worked and shifts per employee x format that can be updated with new shifts'''
+
+    def __init__(self):
+        # {period : dataframe indexed by (employee, format, first day of the period) with the VALUES columns}
+        self.tables = {period: pd.DataFrame({column: np.array([], dtype=float if column != 'shifts' else np.int64) for column in VALUES},
+                                            index=pd.MultiIndex.from_arrays([[], [], np.array([], dtype='datetime64[ns]')], names=KEYS))
+                       for period in PERIODS}
+        self._views = {} #{(period, by) : table already summed and sorted}
+
+
+    def update(self, shifts, employee=None):
+        '''adds shifts (a dataframe with date_worked, format, hours_digitized and hours_worked, plus an employee column unless employee is given)'''
+        if not len(shifts):
+            return
+        with instruments.timer('rollup'):
+            days = pd.DataFrame({'employee': np.full(len(shifts), employee, dtype=object) if employee is not None else shifts['employee'].astype(str).to_numpy(),
+                                 'format': shifts['format'].astype(str).to_numpy(),
+                                 'period': period_starts(shifts['date_worked'].to_numpy(), 'day'),
+                                 'hours_digitized': shifts['hours_digitized'].to_numpy(),
+                                 'hours_worked': shifts['hours_worked'].to_numpy(),
+                                 'shifts': np.ones(len(shifts), dtype=np.int64)})
+            days = rollup(days, KEYS)
+            for period in PERIODS:
+                # each week/month is summed from the new days, never from the shifts themselves
+                additions = days if period == 'day' else rollup(days.assign(period=period_starts(days['period'].to_numpy(), period)), KEYS)
+                self.tables[period] = add_rows(self.tables[period], additions.set_index(KEYS))
+            instruments.count('rollup_shifts', len(shifts))
+        self._views.clear()
+
+
+    def remove(self, employee):
+        '''takes every row of an employee out of the tables (ex: before adding their reloaded shifts)'''
+        for period in PERIODS:
+            table = self.tables[period]
+            self.tables[period] = table[table.index.get_level_values('employee') != employee]
+        self._views.clear()
+
+
+    def table(self, period='week', by=('employee', 'format')):
+        '''returns the sums, shift counts and Efficiency of every period for each combination of by - any of employee and format,
+        or () for the whole team - sorted by the by columns then the period (the first day of the day/week/month)'''
+        if period not in PERIODS:
+            raise ValueError('period has to be one of ' + ', '.join(PERIODS) + ' - not ' + str(period))
+        by = [by] if isinstance(by, str) else list(by)
+        for key in by:
+            if key not in ('employee', 'format'):
+                raise ValueError("can only roll up by employee and format - not " + str(key))
+        key = (period, tuple(by))
+        if key not in self._views:
+            view = rollup(self.tables[period].reset_index(), by + ['period'])
+            view['Efficiency'] = (view['hours_digitized'] / view['hours_worked']).round(3)
+            self._views[key] = view
+        return self._views[key].copy()
+
+
+
+def period_starts(days, period):
+    '''returns the first day of the day, week (monday) or month each datetime64 day falls in'''
+    days = days.astype('datetime64[D]')
+    if period == 'week':
+        # 1970-01-01 was a thursday, so 3 days on from it every week starts on a monday
+        days = days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    elif period == 'month':
+        days = days.astype('datetime64[M]').astype('datetime64[D]')
+    return days.astype('datetime64[ns]')
+
+
+def rollup(rows, keys):
+    '''sums the VALUES columns of rows over every combination of keys (math.fsum, see fsum_groups) - one row per combination, sorted by keys'''
+    if not len(rows):
+        return pd.DataFrame({column: rows[column].to_numpy()[:0] for column in keys + VALUES})
+    # every key is factorized in sorted order and folded into one group code, so the groups come out sorted by the keys
+    groups = np.zeros(len(rows), dtype=np.int64)
+    for key in keys:
+        codes, uniques = pd.factorize(rows[key], sort=True)
+        groups, _ = pd.factorize(groups * len(uniques) + codes, sort=True)
+    digitized, worked, shifts, counts, firsts = fsum_groups(groups, rows['hours_digitized'], rows['hours_worked'], rows['shifts'])
+    result = pd.DataFrame({key: rows[key].to_numpy()[firsts] for key in keys})
+    result['hours_digitized'] = digitized
+    result['hours_worked'] = worked
+    result['shifts'] = shifts.astype(np.int64)
+    return result
+
+
+def add_rows(table, additions):
+    '''returns table with additions (both indexed by KEYS) added in - rows already in table get the new sums added, the others are appended'''
+    if not len(table):
+        return additions
+    positions = table.index.get_indexer(additions.index)
+    found = positions >= 0
+    if found.any():
+        table = table.copy()
+        for column in VALUES:
+            values = table[column].to_numpy(copy=True)
+            values[positions[found]] += additions[column].to_numpy()[found]
+            table[column] = values
+    return pd.concat([table, additions[~found]]) if not found.all() else table
+
+
+
+if __name__ == "__main__":
+    import os
+    import io
+    import math
+    import contextlib
+    import excel_data_analysis
+
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    with contextlib.redirect_stdout(io.StringIO()):
+        for number in (1, 2, 3):
+            excel_data_analysis.Employee('Employee' + str(number), os.path.join(data, 'Humanity_Shift_Employee00' + str(number) + '.xlsx'))
+    table = excel_data_analysis.Employee.registry.table
+
+    def naive(period, by):
+        # the periods worked out with pandas and the sums with a plain groupby (on plain values, pandas 1.5 doesn't sort categorical groups)
+        starts = {'day': table['date_worked'].dt.normalize(),
+                  'week': table['date_worked'].dt.to_period('W-SUN').dt.start_time,
+                  'month': table['date_worked'].dt.to_period('M').dt.start_time}[period]
+        shifts = table.astype({'employee': object, 'format': object}).assign(period=starts)
+        groups = shifts.groupby(list(by) + ['period'], sort=True)
+        result = groups[['hours_digitized', 'hours_worked']].agg(lambda hours: math.fsum(hours)).reset_index()
+        result['shifts'] = groups.size().to_numpy()
+        result['Efficiency'] = (result['hours_digitized'] / result['hours_worked']).round(3)
+        return result
+
+    # built in one go, every period and view is the groupby of the raw shifts
+    rollups = ShiftRollups()
+    rollups.update(table)
+    views = [(period, by) for period in PERIODS for by in ((), ('employee',), ('format',), ('employee', 'format'))]
+    print('Testing rollups vs groupby:', all(rollups.table(period, by).equals(naive(period, by)) for period, by in views))
+
+    # built shift by shift in uneven batches (periods split across them), it only differs in the last bit of the hours
+    batched = ShiftRollups()
+    for start in range(0, len(table), 17):
+        batched.update(table.iloc[start:start + 17])
+    matches = True
+    for period, by in views:
+        built, expected = batched.table(period, by), naive(period, by)
+        exact = list(by) + ['period', 'shifts']
+        matches = matches and built[exact].equals(expected[exact]) and all(np.allclose(built[column], expected[column], rtol=0, atol=1e-9)
+                                                                           for column in ('hours_digitized', 'hours_worked'))
+    # and an employee taken out and added again is back to the same tables
+    batched.remove('Employee2')
+    batched.update(table[table['employee'] == 'Employee2'])
+    print('Testing batched rollup updates:', matches and batched.table('month', ('employee',))['shifts'].equals(naive('month', ('employee',))['shifts']))
+
+    # the rollup sheets are written (and counted overall) without turning up as employees in the stats
+    days = table[table['employee'] == 'Employee1'].head(2).loc[:, ('date_worked', 'hours_digitized', 'hours_worked', 'efficiency')]
+    instruments.reset()
+    tools.dfs_tabs_date([days], ['Employee1'], io.BytesIO(), rollups={'Team Weekly': rollups.table('week')})
+    print('Testing rollup sheet stats:', list(instruments.employees) == ['Employee1'] and instruments.counters['sheets_written'] == 2
+          and instruments.timers['write_sheet'][1] == 2)
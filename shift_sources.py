@@ -0,0 +1,160 @@
+#--------------------------------------------------------------
+#               Shift Sources Module
+#
+#--------------------------------------------------------------
+
+# Where an employee's shift excel can come from: a path on disk, the bytes of the excel (or a
+# file-like object holding them), or a member of a zip archive. Everything is read straight from
+# memory - zip members are read out of the archive into a buffer, never extracted to a temp file -
+# and nothing here changes the working directory, so sources can be read from any thread or process.
+
+import io
+import os
+import fnmatch
+import zipfile
+
+
+class ZipMember(object):
+    '''one excel inside a zip archive - small and picklable so a process pool worker can read it out of the archive itself'''
+
+    def __init__(self, archive, member):
+        self.archive = os.path.abspath(archive)
+        self.member = member
+
+
+    def __repr__(self):
+        return 'ZipMember({!r}, {!r})'.format(self.archive, self.member)
+
+
+    def __str__(self):
+        return self.archive + '::' + self.member
+
+
+    def __eq__(self, other):
+        return isinstance(other, ZipMember) and (self.archive, self.member) == (other.archive, other.member)
+
+
+    def __hash__(self):
+        return hash((self.archive, self.member))
+
+
+    def read(self):
+        '''returns the bytes of the member'''
+        with zipfile.ZipFile(self.archive) as archive:
+            return archive.read(self.member)
+
+
+
+def open_source(source):
+    '''returns something pd.read_excel and openpyxl can read for a source: paths are used as they are, bytes and zip members become in memory buffers'''
+    if isinstance(source, ZipMember):
+        return io.BytesIO(source.read())
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    if hasattr(source, 'read'):
+        # a file-like object might have been read before
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return source
+    return os.fspath(source)
+
+
+def portable_source(source):
+    '''returns the source in a form that can be sent to a process pool worker - file-like objects are read into bytes'''
+    if hasattr(source, 'read') and not isinstance(source, ZipMember):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return source.read()
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.abspath(source)
+    return source
+
+
+def source_key(source):
+    '''returns a hashable key telling sources apart - the same file (or zip member) always gets the same key'''
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.abspath(source)
+    if isinstance(source, ZipMember):
+        return source
+    # buffers are only the same source if they are the same object
+    return ('buffer', id(source))
+
+
+def is_path(source):
+    '''returns whether the source is a path on disk (only those can go in the shift cache)'''
+    return isinstance(source, (str, os.PathLike))
+
+
+def source_stamp(source):
+    '''returns (size, modified time) of the file behind a path or zip member so a later call can tell whether it changed - None for buffers (or a missing file)'''
+    if isinstance(source, ZipMember):
+        path = source.archive
+    elif is_path(source):
+        path = source
+    else:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def source_name(source):
+    '''returns the employee name a path or zip member gets by default: the file name without its extension'''
+    if isinstance(source, ZipMember):
+        return os.path.splitext(os.path.basename(source.member))[0]
+    return os.path.splitext(os.path.basename(os.fspath(source)))[0]
+
+
+def zip_members(archive, pattern='*.xlsx'):
+    '''returns a ZipMember for every file in the archive matching pattern, sorted by member name (folders inside the zip included)'''
+    with zipfile.ZipFile(archive) as opened:
+        members = sorted(info.filename for info in opened.infolist()
+                         if not info.is_dir() and fnmatch.fnmatch(os.path.basename(info.filename), pattern))
+    return [ZipMember(archive, member) for member in members]
+
+
+def duplicate_names(namepaths):
+    '''returns the names given to more than one different source in [(name, source)], in the order they first come up
+    (ex: a/Humanity_Shift_Employee001.xlsx and b/Humanity_Shift_Employee001.xlsx would both be Humanity_Shift_Employee001)'''
+    sources = {}
+    duplicates = []
+    for name, source in namepaths:
+        key = source_key(source)
+        if sources.setdefault(name, key) != key and name not in duplicates:
+            duplicates.append(name)
+    return duplicates
+
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        # the same file name in two folders is the same employee name, the same file given twice isn't a clash
+        first, second = os.path.join(directory, 'a', 'Joe.xlsx'), os.path.join(directory, 'b', 'Joe.xlsx')
+        archive = os.path.join(directory, 'shifts.zip')
+        with zipfile.ZipFile(archive, 'w') as zipped:
+            zipped.writestr('Ann.xlsx', b'')
+            zipped.writestr('old/Ann.xlsx', b'')
+        namepaths = [(source_name(first), first), (source_name(first), first), ('Bob', second)]
+        members = [(source_name(member), member) for member in zip_members(archive)]
+        print('Testing duplicate_names:', duplicate_names(namepaths) == [] and duplicate_names(namepaths + [(source_name(second), second)]) == ['Joe']
+              and duplicate_names(members) == ['Ann'] and duplicate_names(members[:1] + members[:1]) == [])
+
+        # and the command line refuses them (exit code 2) before loading anything
+        import shutil
+        import contextlib
+        import excel_data_analysis
+        data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+        for path, excel in ((first, 'Humanity_Shift_Employee001.xlsx'), (second, 'Humanity_Shift_Employee002.xlsx')):
+            os.makedirs(os.path.dirname(path))
+            shutil.copy(os.path.join(data, excel), path)
+        with contextlib.redirect_stderr(io.StringIO()):
+            try:
+                excel_data_analysis.main([first, second, '--no-cache', '-o', directory])
+                code = None
+            except SystemExit as error:
+                code = error.code
+        print('Testing duplicate names on the command line:', code == excel_data_analysis.EXIT_USAGE and not excel_data_analysis.Employee.employee_list)
@@ -0,0 +1,203 @@
+#--------------------------------------------------------------
+#               Shift Summary Module
+#
+#--------------------------------------------------------------
+
+# Running aggregates of an employee's shifts. The summary is fed dataframes (a whole
+# excel or chunks of one) that already have the hours_worked and efficiency columns,
+# and keeps only what the analyses need, so its memory doesn't grow with the number of shifts:
+#   - overall hours_digitized / hours_worked sums (overall efficiency)
+#   - hours_digitized / hours_worked sums and shift counts per format (format analysis)
+#   - the last `window` shifts by date (date analysis)
+#   - sketches of the efficiency distribution, overall and per format (efficiency_sketch.py)
+#   - every shift_id seen, as a shift_validation.ShiftIds (8 bytes a shift), so shifts sent again can be refused
+# Feeding it one big dataframe or the same rows in chunks gives exactly the same results,
+# which is also what lets new days be appended to a saved summary without the old rows.
+
+import math
+import tools
+from efficiency_sketch import EfficiencySketch
+from shift_validation import ShiftIds
+
+pd = tools.lazy_import('pandas')
+np = tools.lazy_import('numpy')
+
+
+class ShiftSummary(object):
+    '''running totals of an employee's shifts that can be updated one dataframe (or chunk) at a time'''
+
+    date_columns = ['date_worked', 'hours_digitized', 'hours_worked', 'efficiency']
+
+    def __init__(self, window=30):
+        self.window = window
+        self.shifts = 0
+        # summed in row order with python floats, exactly like sum() over the whole column
+        self.hours_digitized = 0.0
+        self.hours_worked = 0.0
+        # {format: [hours_digitized, hours_worked, count]} - the hours are kept as (sum, remainder) pairs
+        # from math.fsum so the totals don't depend on how the rows were chunked
+        self.formats = {}
+        # the last `window` shifts by date, indexed by the row's position in the excel
+        self.tail = pd.DataFrame(columns=ShiftSummary.date_columns)
+        self.preview = None
+        # the spread of the shift efficiencies, overall and {format : sketch}
+        self.sketch = EfficiencySketch()
+        self.format_sketches = {}
+        # ids of every shift so far (see shift_validation - appended rows are checked against them)
+        self.shift_ids = ShiftIds()
+
+
+    def update(self, dataframe):
+        '''adds the shifts in dataframe to the totals - the dataframe is indexed by row position in the excel'''
+        if self.preview is None:
+            # an empty chunk (ex: every row in it was quarantined) still gives the preview its columns
+            self.preview = dataframe.head(n=7)
+        elif len(self.preview) < 7 and len(dataframe):
+            # topped up from the next chunks when the first ones were short, like reading the excel whole
+            self.preview = dataframe.head(n=7) if self.preview.empty else pd.concat([self.preview, dataframe]).head(n=7)
+        if dataframe.empty:
+            return
+
+        self.shifts += len(dataframe)
+        if self.shift_ids is not None:
+            self.shift_ids.add(dataframe['shift_id'].to_numpy(dtype=np.int64))
+        self.hours_digitized = sum(dataframe['hours_digitized'].tolist(), self.hours_digitized)
+        self.hours_worked = sum(dataframe['hours_worked'].tolist(), self.hours_worked)
+
+        # summaries saved before the sketches were kept don't have any (see load)
+        sketched = self.sketch is not None
+        if sketched:
+            self.sketch.update(dataframe['efficiency'].to_numpy())
+
+        for format, group in dataframe.groupby('format', sort=False, observed=True):
+            totals = self.formats.setdefault(format, [(0.0, 0.0), (0.0, 0.0), 0])
+            totals[0] = ShiftSummary._add_exact(totals[0], group['hours_digitized'].tolist())
+            totals[1] = ShiftSummary._add_exact(totals[1], group['hours_worked'].tolist())
+            totals[2] += len(group)
+            if sketched:
+                self.format_sketches.setdefault(format, EfficiencySketch()).update(group['efficiency'].to_numpy())
+
+        # only the latest `window` rows of this chunk can make it into the tail, so the buffer never grows past 2 windows
+        latest = dataframe.loc[:, ShiftSummary.date_columns].sort_values(by='date_worked', kind='mergesort').tail(n=self.window)
+        if self.tail.empty:
+            self.tail = latest
+        else:
+            # the tail came from earlier rows, so a stable sort keeps equal dates in excel order
+            self.tail = pd.concat([self.tail, latest]).sort_values(by='date_worked', kind='mergesort').tail(n=self.window)
+
+
+    def overall_efficiency(self):
+        '''hours digitized / hours worked over every shift, rounded to 3 places - NaN without any hours worked (ex: every row was quarantined)'''
+        if not self.hours_worked:
+            return math.nan
+        return round(self.hours_digitized / self.hours_worked, 3)
+
+
+    def date_analysis(self, window=None):
+        '''returns the last `window` days worked sorted by date (all the summary's window by default) - same as Employee.date_analysis
+        raises ValueError for a bigger window than the summary's once it has seen more shifts than that (the older ones weren't kept)'''
+        if window is not None and window > self.window and self.shifts > self.window:
+            raise ValueError('only the last ' + str(self.window) + ' shifts were kept, so the last ' + str(window)
+                             + " can't be analysed (make the summary with window=" + str(window) + ' or more)')
+        tail = self.tail.tail(n=self.window if window is None else window).copy()
+        tail['date_worked'] = pd.to_datetime(tail['date_worked']).dt.date
+        return tail
+
+
+    def format_analysis(self):
+        '''returns the efficiency and sample size of every format, most efficient first - same as Employee.format_analysis'''
+        formats = sorted(self.formats)
+        digitized = pd.Series([self.formats[format][0][0] for format in formats], index=formats)
+        worked = pd.Series([self.formats[format][1][0] for format in formats], index=formats)
+        result_df = pd.DataFrame({'Format': formats,
+                                  'Format Efficiency': (digitized / worked).round(3),
+                                  'Sample Size': [self.formats[format][2] for format in formats]}, index=formats)
+        return result_df.sort_values(by='Format Efficiency', ascending=[False], kind='mergesort')
+
+
+    def distribution(self):
+        '''returns the Shifts, Mean, Std, P10, Median, P90 and Outliers (efficiency above 2) of the shift efficiencies - one row for every
+        shift ('all') then one per format'''
+        if self.sketch is None:
+            raise ValueError('this summary was saved before the efficiency distribution was kept - read the excel again to get it')
+        formats = sorted(self.format_sketches)
+        rows = [self.sketch.statistics()] + [self.format_sketches[format].statistics() for format in formats]
+        result_df = pd.DataFrame(rows, index=['all'] + formats)
+        result_df.insert(0, 'Format', result_df.index)
+        return result_df
+
+
+    def save(self, path):
+        '''saves the running totals (and the date tail/preview) to path so they can be picked up again with load'''
+        pd.to_pickle(self, path)
+
+
+    @staticmethod
+    def load(path):
+        '''loads running totals saved with save'''
+        summary = pd.read_pickle(path)
+        # summaries saved before the dates were kept as datetime64 have date objects in their tail
+        if len(summary.tail):
+            summary.tail['date_worked'] = pd.to_datetime(summary.tail['date_worked'])
+        # and ones saved before the efficiency sketches can't get them back without the shifts
+        if not hasattr(summary, 'sketch'):
+            summary.sketch = None
+            summary.format_sketches = None
+        # or the shift_ids (appended shifts then can't be checked against the ones before), which were a plain sorted array for a while
+        if not hasattr(summary, 'shift_ids'):
+            summary.shift_ids = None
+        elif isinstance(summary.shift_ids, np.ndarray):
+            summary.shift_ids = ShiftIds(summary.shift_ids)
+        return summary
+
+
+    @staticmethod
+    def _add_exact(total, values):
+        # fsum rounds the exact sum correctly, and the remainder carries what got rounded off into the next chunk
+        hours, remainder = total
+        new_hours = math.fsum([hours, remainder] + values)
+        new_remainder = math.fsum([hours, remainder, -new_hours] + values)
+        return (new_hours, new_remainder)
+
+
+
+if __name__ == "__main__":
+    import os
+    import io
+    import contextlib
+    import excel_data_analysis
+
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    path = os.path.join(data, 'Humanity_Shift_Employee003.xlsx')
+
+    # the same rows fed whole or in uneven chunks end up as the same totals
+    shifts = excel_data_analysis.read_shifts(path)
+    whole, chunked = ShiftSummary(), ShiftSummary()
+    whole.update(shifts)
+    for start in range(0, len(shifts), 13):
+        chunked.update(shifts.iloc[start:start + 13])
+    print('Testing chunked update:', whole.shifts == chunked.shifts and whole.overall_efficiency() == chunked.overall_efficiency()
+          and whole.formats == chunked.formats and whole.tail.equals(chunked.tail) and whole.preview.equals(chunked.preview)
+          and (whole.shift_ids.to_numpy() == chunked.shift_ids.to_numpy()).all() and whole.distribution().equals(chunked.distribution()))
+
+    # and a streamed employee gives every summary analysis the in-memory one does
+    with contextlib.redirect_stdout(io.StringIO()):
+        in_memory = excel_data_analysis.Employee('in_memory', path)
+        streamed = excel_data_analysis.Employee('streamed', path, stream=True, chunk_size=7)
+    print('Testing streamed vs in memory:', streamed.dataframe is None and streamed.overall_efficiency == in_memory.overall_efficiency
+          and streamed.format_analysis().equals(in_memory.format_analysis())
+          and all(streamed.date_analysis(window).equals(in_memory.date_analysis(window)) for window in (1, 7, 30))
+          and streamed.distribution().equals(in_memory.distribution())
+          # (a streamed preview's categoricals only know the values of the first chunks)
+          and streamed.summary.preview.astype(str).equals(in_memory.dataframe.head(n=7).astype(str)))
+
+    # a window bigger than the one kept while streaming is refused instead of being cut short - a streamed employee keeps the window it asks for
+    with contextlib.redirect_stdout(io.StringIO()):
+        wide = excel_data_analysis.Employee('wide', path, stream=True, chunk_size=7, window=60)
+    try:
+        streamed.date_analysis(60)
+        refused = False
+    except ValueError:
+        refused = True
+    print('Testing streamed window:', refused and len(wide.date_analysis(60)) == 60 and wide.date_analysis(60).equals(in_memory.date_analysis(60))
+          and streamed.date_analysis(30).equals(in_memory.date_analysis(30)))
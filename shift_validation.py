@@ -0,0 +1,381 @@
+#--------------------------------------------------------------
+#               Shift Validation Module
+#
+#--------------------------------------------------------------
+
+# Checks freshly read shift rows a whole column at a time before anything is derived from them,
+# so one bad row no longer stops a whole run (ex: a clock_in that isn't HH:MM:SS used to make
+# the time parsing raise, and a zero length shift gave an infinite efficiency). The rows that fail
+# are taken out and kept as the quarantine, with every reason they failed, and the rest carry on.
+#   - schema: every column in COLUMNS has to be there (otherwise the whole file is refused)
+#   - missing values in any of those columns
+#   - date_worked that isn't YYYY/MM/DD text, an excel date or an excel day number
+#   - clock_in / clock_out that aren't HH:MM:SS (or whole seconds since midnight)
+#   - shift_id that isn't a whole number, hours_digitized that isn't a number or is negative
+#   - zero length shifts (hours worked rounds to 0 - clocking out before clocking in is still an overnight shift)
+#   - a shift_id already used by an earlier row that was kept (a quarantined row doesn't use up its id), an employee_id that isn't the one the file is about
+# A validator remembers the shift_ids and employee_id it has seen so a file can be checked chunk by chunk.
+# The shift_ids are kept in a ShiftIds: a few sorted int64 arrays (8 bytes a shift), so a streamed file
+# still needs memory for its ids - far less than for its rows, but it does grow with them. New ids go in
+# a small array of their own and arrays are only merged once the newer one is half the size of the one
+# before it (like a binary counter), so adding and looking up ids costs about the number of new ids
+# however many came before - appending a few shifts to a long history doesn't go through all of it.
+# The valid rows are numbered again from 0 so they look exactly like a file that never had the bad rows.
+
+import datetime
+import numbers
+import tools
+from instrumentation import instruments
+
+pd = tools.lazy_import('pandas')
+np = tools.lazy_import('numpy')
+
+# the columns every shift excel has to have
+COLUMNS = ('shift_id', 'date_worked', 'clock_in', 'clock_out', 'hours_digitized', 'format', 'employee_id')
+
+# hours_worked is rounded to 0.1 (tools.time_dif_series), so a shift shorter than this many seconds (3 minutes) is 0 hours
+SHORTEST = 180
+
+
+class ShiftValidator(object):
+    '''splits shift rows into the valid ones and the quarantined ones (kept with their reasons) - one validator per file, fed whole or in chunks
+    duplicates are found across every chunk, so the validator holds every shift_id it has seen (8 bytes each, see ShiftIds) -
+    the one thing that grows with the rows when a file is streamed'''
+
+    def __init__(self, date_format='%Y/%m/%d', first_row=1, shift_ids=None):
+        '''shift_ids are the ids already taken (ex: the shifts an employee already has when more are appended) - rows using them are duplicates'''
+        self.date_format = date_format
+        self.rows = first_row - 1 #rows checked so far, so the quarantine can say where a row was
+        self.employee_id = None #the employee_id the file is about (the most common one in the first rows checked)
+        # a ShiftIds given is shared (ex: with the ShiftSummary the rows go to), not copied
+        self.shift_ids = shift_ids if isinstance(shift_ids, ShiftIds) else ShiftIds(() if shift_ids is None else shift_ids)
+        self.quarantined = [] #a dataframe of the rows taken out of every chunk
+
+
+    def check(self, dataframe, employee=None):
+        '''returns the valid rows of dataframe (numbered from 0, the numeric columns as numbers) and keeps the others for quarantine()
+        raises ValueError if columns are missing - nothing in the file can be used then'''
+        missing_columns = [column for column in COLUMNS if column not in dataframe.columns]
+        if missing_columns:
+            raise ValueError('the excel is missing the ' + ', '.join(missing_columns) + ' column' + ('s' if len(missing_columns) > 1 else ''))
+
+        with instruments.timer('validate', employee):
+            first_row = self.rows + 1
+            self.rows += len(dataframe)
+            checks = [] #(reason, mask of the rows failing it)
+            missing = {column: missing_values(dataframe[column]) for column in COLUMNS}
+            for column in COLUMNS:
+                checks.append(('missing ' + column, missing[column]))
+
+            shift_ids = pd.to_numeric(dataframe['shift_id'], errors='coerce').to_numpy(dtype=float)
+            bad_ids = ~missing['shift_id'] & ~(np.isfinite(shift_ids) & (np.floor(shift_ids) == shift_ids))
+            checks.append(('shift_id is not a whole number', bad_ids))
+            checks.append(('date_worked is not a date', ~missing['date_worked'] & ~self._dates(dataframe['date_worked'])))
+
+            seconds = {}
+            times = np.ones(len(dataframe), dtype=bool) #rows with both clock times usable
+            for column in ('clock_in', 'clock_out'):
+                seconds[column], valid_times = clock_seconds(dataframe[column])
+                checks.append((column + ' is not HH:MM:SS', ~missing[column] & ~valid_times))
+                times &= valid_times & ~missing[column]
+            # only shifts whose hours_worked rounds to 0 are refused (their efficiency would divide by 0) - overnight shifts wrap past midnight
+            checks.append(('zero length shift', times & ((seconds['clock_out'] - seconds['clock_in']) % 86400 < SHORTEST)))
+
+            hours_digitized = pd.to_numeric(dataframe['hours_digitized'], errors='coerce').to_numpy(dtype=float)
+            numbers_given = np.isfinite(hours_digitized)
+            checks.append(('hours_digitized is not a number', ~missing['hours_digitized'] & ~numbers_given))
+            checks.append(('negative hours_digitized', numbers_given & (hours_digitized < 0)))
+
+            ids = ~missing['shift_id'] & ~bad_ids
+            other_employee = ~missing['employee_id'] & self._other_employee(dataframe['employee_id'], missing['employee_id'])
+            # only rows that pass everything else take their shift_id, so a corrected copy of a quarantined shift isn't a duplicate
+            passing = ~np.logical_or.reduce([mask for reason, mask in checks]) & ~other_employee
+            checks.append(('duplicate shift_id', ids & self._repeated(shift_ids, ids, passing)))
+            checks.append(('employee_id is not the one of the rest of the file', other_employee))
+
+            # completely blank rows are just skipped (like streaming the excel does), not quarantined
+            blank = np.logical_and.reduce([missing[column] for column in COLUMNS])
+            failed = np.logical_or.reduce([mask for reason, mask in checks]) & ~blank
+            self.shift_ids.add(shift_ids[ids & ~failed].astype(np.int64))
+            if not failed.any() and not blank.any():
+                valid = dataframe.copy(deep=False)
+                # a sheet without rows comes with an empty object index
+                if not len(valid):
+                    valid.index = pd.RangeIndex(0)
+            else:
+                if failed.any():
+                    self._quarantine(dataframe, failed, checks, first_row)
+                    instruments.count('rows_quarantined', int(failed.sum()), employee)
+                keep = ~(failed | blank)
+                valid = dataframe[keep].reset_index(drop=True)
+                shift_ids, hours_digitized = shift_ids[keep], hours_digitized[keep]
+                seconds = {column: times[keep] for column, times in seconds.items()}
+            # the clock times are handed on as the int32 seconds they are stored as, so they aren't parsed a second time
+            valid = valid.assign(clock_in=seconds['clock_in'].astype(np.int32), clock_out=seconds['clock_out'].astype(np.int32))
+            # numbers typed in as text are turned into numbers (the downcast to the smallest int is left to add_shift_columns)
+            if not pd.api.types.is_numeric_dtype(valid['shift_id']):
+                valid = valid.assign(shift_id=shift_ids.astype(np.int64))
+            if not pd.api.types.is_numeric_dtype(valid['hours_digitized']):
+                valid = valid.assign(hours_digitized=hours_digitized)
+            return valid
+
+
+    def quarantine(self):
+        '''returns every row taken out so far as read, after a 'row' column (1 is the first row under the header) and a 'reason' column'''
+        if not self.quarantined:
+            return empty_quarantine()
+        return pd.concat(self.quarantined, ignore_index=True)
+
+
+    def _dates(self, dates):
+        # every distinct value is only looked at once, like tools.DateParser
+        codes, uniques = factorize(dates)
+        if not len(uniques):
+            return np.ones(len(dates), dtype=bool)
+        if pd.api.types.is_datetime64_any_dtype(uniques.dtype):
+            return codes >= 0
+        uniques = pd.Series(np.asarray(uniques, dtype=object))
+        text = uniques.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+        valid = uniques.map(lambda value: isinstance(value, (datetime.date, np.datetime64))
+                            or (isinstance(value, numbers.Real) and not isinstance(value, bool) and np.isfinite(value))).to_numpy(dtype=bool)
+        if text.any():
+            valid[text] = pd.to_datetime(uniques[text], format=self.date_format, errors='coerce').notna().to_numpy()
+        # missing dates (code -1) are reported as missing instead
+        return np.append(valid, True)[codes]
+
+
+    def _repeated(self, shift_ids, ids, passing):
+        # later rows with the shift_id of an earlier row that was kept (in this chunk or the chunks before)
+        repeated = np.zeros(len(shift_ids), dtype=bool)
+        positions = np.flatnonzero(ids)
+        chunk_ids = shift_ids[positions].astype(np.int64)
+        repeated[positions] = self.shift_ids.contains(chunk_ids)
+        # the first row of the chunk passing with each id keeps it - rows after it with the same id are repeats
+        kept = passing[positions]
+        firsts, first_rows = np.unique(chunk_ids[kept], return_index=True)
+        if len(firsts):
+            found = np.minimum(np.searchsorted(firsts, chunk_ids), len(firsts) - 1)
+            repeated[positions] |= (firsts[found] == chunk_ids) & (positions[kept][first_rows][found] < positions)
+        return repeated
+
+
+    def _other_employee(self, employee_ids, missing):
+        codes, uniques = factorize(employee_ids)
+        if self.employee_id is None:
+            if not len(uniques):
+                return np.zeros(len(employee_ids), dtype=bool)
+            # the file is about the employee_id most of its rows have (the first one to appear on a tie)
+            self.employee_id = uniques[int(np.argmax(np.bincount(codes[codes >= 0])))]
+        matching = np.flatnonzero(np.asarray(uniques == self.employee_id, dtype=bool))
+        return ~missing & ~np.isin(codes, matching)
+
+
+    def _quarantine(self, dataframe, failed, checks, first_row):
+        rows = np.flatnonzero(failed)
+        # the reasons are only put together for the few rows that failed
+        reasons = [[] for row in rows]
+        for reason, mask in checks:
+            for position in np.flatnonzero(mask[rows]).tolist():
+                reasons[position].append(reason)
+        quarantined = dataframe.iloc[rows].reset_index(drop=True)
+        quarantined.insert(0, 'reason', ['; '.join(row_reasons) for row_reasons in reasons])
+        quarantined.insert(0, 'row', rows + first_row)
+        self.quarantined.append(quarantined)
+
+
+
+class ShiftIds(object):
+    '''a set of shift_ids kept as sorted int64 arrays - adding ids and looking them up costs about the number of ids in the call'''
+
+    def __init__(self, ids=()):
+        self.runs = [] #sorted arrays without any id in common, each at least twice the size of the next one
+        self.pending = [] #ids added since the last lookup (a file checked in one go never has to sort its ids)
+        self.add(ids)
+
+
+    def __len__(self):
+        self._settle()
+        return sum(len(run) for run in self.runs)
+
+
+    def add(self, ids):
+        '''adds ids (ones already in the set are fine)'''
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids):
+            self.pending.append(ids)
+
+
+    def contains(self, ids):
+        '''returns a mask of which ids are in the set'''
+        self._settle()
+        return self._found(np.asarray(ids, dtype=np.int64))
+
+
+    def to_numpy(self):
+        '''returns every id, sorted'''
+        self._settle()
+        return np.sort(np.concatenate(self.runs)) if self.runs else np.array([], dtype=np.int64)
+
+
+    def _found(self, ids):
+        found = np.zeros(len(ids), dtype=bool)
+        for run in self.runs:
+            # binary searches in each sorted run instead of a python set per id
+            positions = np.minimum(np.searchsorted(run, ids), len(run) - 1)
+            found |= run[positions] == ids
+        return found
+
+
+    def _settle(self):
+        if not self.pending:
+            return
+        new = np.unique(np.concatenate(self.pending))
+        self.pending = []
+        new = new[~self._found(new)]
+        if not len(new):
+            return
+        self.runs.append(new)
+        # merging only runs of about the same size copies every id a few times at most (log of the ids) over all the adds
+        while len(self.runs) > 1 and len(self.runs[-2]) < 2 * len(self.runs[-1]):
+            newest = self.runs.pop()
+            self.runs[-1] = np.union1d(self.runs[-1], newest)
+
+
+
+def validate_shifts(dataframe, employee=None, date_format='%Y/%m/%d'):
+    '''returns (valid rows, quarantined rows) of a whole shift dataframe as it came out of the excel - see ShiftValidator.check'''
+    validator = ShiftValidator(date_format)
+    valid = validator.check(dataframe, employee)
+    return valid, validator.quarantine()
+
+
+def factorize(column):
+    '''returns (codes, distinct values) of a column like pd.factorize - object columns go in as an object array so their
+    distinct values stay the objects they were (pandas warns that it will stop turning a column of numbers held as objects into numbers)'''
+    if column.dtype == object:
+        return pd.factorize(column.to_numpy(dtype=object))
+    return pd.factorize(column)
+
+
+def missing_values(column):
+    '''returns a mask of the blank values (NaN/None or text that is only spaces)'''
+    missing = column.isna().to_numpy()
+    if column.dtype == object:
+        # only the distinct values are looked at (a column holds far fewer of those than rows)
+        codes, uniques = factorize(column)
+        blank = np.array([isinstance(value, str) and not value.strip() for value in uniques], dtype=bool)
+        if blank.any():
+            missing |= np.append(blank, False)[codes]
+    return missing
+
+
+def clock_seconds(times):
+    '''returns (seconds since midnight, mask of the valid ones) of a clock column - HH:MM:SS text or whole seconds from 0 to 86399'''
+    if pd.api.types.is_numeric_dtype(times) and not pd.api.types.is_bool_dtype(times):
+        values = times.to_numpy(dtype=float)
+        valid = np.isfinite(values) & (values >= 0) & (values < 86400) & (np.floor(values) == values)
+        return np.where(valid, values, 0).astype(np.int64), valid
+    # the same parse as tools.time_to_seconds, but whatever doesn't fit comes back as NaT instead of raising -
+    # and only of the distinct values (a day has 86400 seconds, so a long file repeats its clock times a lot)
+    codes, uniques = factorize(times)
+    uniques = pd.Series(np.asarray(uniques, dtype=object))
+    if pd.api.types.infer_dtype(uniques, skipna=True) != 'string':
+        uniques = uniques.where(uniques.map(lambda value: isinstance(value, str)))
+    parsed = pd.to_datetime(uniques, format='%H:%M:%S', errors='coerce').to_numpy()
+    # missing times (code -1) are not valid either
+    valid = np.append(~np.isnat(parsed), False)
+    # the times land on 1900-01-01, so the seconds since midnight are what's left of whole days
+    seconds = np.append(np.where(valid[:-1], parsed.astype('datetime64[s]').astype(np.int64) % 86400, 0), 0)
+    return seconds[codes], valid[codes]
+
+
+def empty_quarantine():
+    return pd.DataFrame(columns=['row', 'reason'] + list(COLUMNS))
+
+
+
+if __name__ == "__main__":
+    import os
+    import math
+    import tempfile
+    import contextlib
+    import io
+    import warnings
+    import excel_data_analysis
+
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    shifts = pd.read_excel(os.path.join(data, 'Humanity_Shift_Employee001.xlsx'))
+
+    # one row for every reason (and a few that look odd but are fine), checked whole and in chunks of 3
+    bad = shifts.head(20).astype(object)
+    bad.loc[1, 'clock_in'] = '9h43'
+    bad.loc[2, ['clock_in', 'clock_out']] = ['10:00:00', '10:02:59'] #rounds to 0 hours
+    bad.loc[3, ['clock_in', 'clock_out']] = ['10:00:00', '10:03:00'] #rounds to 0.1 hours
+    bad.loc[4, ['clock_in', 'clock_out']] = ['23:30:00', '01:00:00'] #overnight
+    bad.loc[5, 'hours_digitized'] = None
+    bad.loc[6, 'hours_digitized'] = -1.0
+    bad.loc[7, 'shift_id'] = bad.loc[0, 'shift_id']
+    bad.loc[8, 'employee_id'] = 99
+    bad.loc[9, 'date_worked'] = '2015/13/45'
+    bad.loc[10, 'date_worked'] = 38000 #an excel day number
+    bad.loc[11, 'shift_id'] = 'abc'
+    bad.loc[12, ['clock_in', 'hours_digitized']] = ['25:00:00', 'x']
+    bad.loc[13, 'format'] = '  '
+    bad.loc[14, 'hours_digitized'] = '4.5' #a number typed in as text
+    bad.loc[15, list(COLUMNS)] = None #a blank row
+    bad.loc[16, 'shift_id'] = 1000.5
+    # {row (1 is the first row under the header) : reason}
+    expected = {2: 'clock_in is not HH:MM:SS', 3: 'zero length shift', 6: 'missing hours_digitized', 7: 'negative hours_digitized',
+                8: 'duplicate shift_id', 9: 'employee_id is not the one of the rest of the file', 10: 'date_worked is not a date',
+                12: 'shift_id is not a whole number', 13: 'clock_in is not HH:MM:SS; hours_digitized is not a number',
+                14: 'missing format', 17: 'shift_id is not a whole number'}
+    # (and the mixed object columns are checked without pandas warning about them)
+    with warnings.catch_warnings(record=True) as warned:
+        warnings.simplefilter('always')
+        valid, quarantine = validate_shifts(bad)
+        validator = ShiftValidator()
+        chunks = [validator.check(bad.iloc[start:start + 3]) for start in range(0, len(bad), 3)]
+    print('Testing validator reasons:', dict(zip(quarantine['row'], quarantine['reason'])) == expected and not warned
+          and validator.quarantine().equals(quarantine) and pd.concat(chunks, ignore_index=True).equals(valid)
+          and list(valid.index) == list(range(len(bad) - len(expected) - 1)) and valid['clock_in'].dtype == np.int32
+          and valid['hours_digitized'].tolist()[4] == 4.5 and valid['clock_out'].tolist()[2] == 3600)
+    # ids that are already taken (ex: appending to an employee) are duplicates from the first row
+    seeded = ShiftValidator(first_row=101, shift_ids=shifts['shift_id'])
+    seeded.check(shifts.head(3))
+    print('Testing validator seeded ids:', list(seeded.quarantine()['row']) == [101, 102, 103]
+          and set(seeded.quarantine()['reason']) == {'duplicate shift_id'})
+    # a quarantined row doesn't take its shift_id: a corrected copy is kept, later in the chunk or in a later one (ex: appended)
+    rejected = shifts.head(2).assign(clock_out=shifts['clock_in'].head(2))
+    corrected = ShiftValidator()
+    kept = [corrected.check(pd.concat([rejected.head(1), shifts.head(1), shifts.head(1)], ignore_index=True)),
+            corrected.check(rejected.tail(1)), corrected.check(shifts.iloc[1:2])]
+    print('Testing corrected copies of quarantined rows:', [len(chunk) for chunk in kept] == [1, 0, 1]
+          and list(corrected.quarantine()['reason']) == ['zero length shift', 'duplicate shift_id', 'zero length shift']
+          and np.array_equal(corrected.shift_ids.to_numpy(), np.sort(shifts['shift_id'].head(2).to_numpy())))
+
+    # the sorted runs answer like a plain set however the ids came in (one big add, then many small ones with repeats)
+    generator = np.random.default_rng(0)
+    added = [generator.integers(0, 5000, 2000)] + [generator.integers(0, 5000, 20) for add in range(100)]
+    known = ShiftIds(added[0])
+    for ids in added[1:]:
+        known.contains(ids)
+        known.add(ids)
+    everything = np.unique(np.concatenate(added))
+    probes = np.arange(-1, 5001)
+    print('Testing shift id runs:', np.array_equal(known.contains(probes), np.isin(probes, everything)) and len(known) == len(everything)
+          and all(len(bigger) >= 2 * len(smaller) for bigger, smaller in zip(known.runs, known.runs[1:])))
+
+    # a file where every row fails (zero length shifts) and one without rows run end to end with a good one:
+    # both still load, the run finishes and the quarantine csv has every bad row
+    with tempfile.TemporaryDirectory() as directory:
+        every_row_bad = os.path.join(directory, 'every_row_bad.xlsx')
+        shifts.assign(clock_out=shifts['clock_in']).to_excel(every_row_bad, index=False)
+        no_rows = os.path.join(directory, 'no_rows.xlsx')
+        shifts.iloc[:0].to_excel(no_rows, index=False)
+        quarantine_csv = os.path.join(directory, 'quarantine.csv')
+        with contextlib.redirect_stdout(io.StringIO()):
+            code = excel_data_analysis.main([every_row_bad, no_rows, os.path.join(data, 'Humanity_Shift_Employee002.xlsx'), '--no-cache',
+                                             '-o', directory, '--quarantine', quarantine_csv, '--distribution', '--rollups', 'week'])
+        quarantine = pd.read_csv(quarantine_csv)
+        print('Testing an all invalid file end to end:', code == excel_data_analysis.EXIT_OK and len(quarantine) == len(shifts)
+              and set(quarantine['reason']) == {'zero length shift'} and math.isnan(excel_data_analysis.Employee.employee_efficiency['every_row_bad']))
@@ -17,66 +17,161 @@
 # DataFrame to Excel functions:
 #------------------------------
 
-import pandas as pd
-from xlsxwriter.utility import xl_rowcol_to_cell
+import os
+import sys
+import importlib.util
 import datetime
-
-def dfs_tabs_format(df_list, sheet_list, file_name):
-    '''accepts a list of dfs, list of sheet names, and a file name - Puts multiple dataframes across MULTIPLE tabs/sheets in 1 excel'''
-    ### Formatted specifically for the FORMAT ANALYSIS
-
-    #this only works if all the dfs being sent are the same length/formatting
-    number_rows = len(df_list[0].index)
-
-    writer = pd.ExcelWriter(file_name, engine='xlsxwriter')
-    for dataframe, sheet in zip(df_list, sheet_list):
-        dataframe.to_excel(writer, index=False, sheet_name=sheet, startrow=2 , startcol=0)
-
-        # Get access to the workbook and sheet
-        workbook = writer.book 
-        worksheet = writer.sheets[sheet]
-
-        # Creating some Formats in our workbook to assign later:
-        right_fmt = workbook.add_format({'align': 'right'})
-        title_fmt = workbook.add_format({'align': 'left', 'font_size':21,
-                                        'bold': True})
-        title_fmt.set_align('left_across')
-        percent_fmt = workbook.add_format({'num_format': '0.0%', 'bold': True})
-
-        # Setting the Column Width and Formatting
-        worksheet.set_column('A:D', 20, right_fmt)
-        worksheet.set_column('B:B', 20, percent_fmt)
-        
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+import instrumentation
+from instrumentation import instruments
+
+
+def lazy_import(name):
+    '''returns the module called name but only really imports it the first time something in it is used - keeps start up instant for things like --help'''
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+xlsxwriter = lazy_import('xlsxwriter')
+
+
+
+class ReportWriter(object):
+    '''writes analysis dataframes into 1 excel with each one on its own tab/sheet - formats are created once and shared by every sheet
+    and rows go straight to disk in xlsxwriter's constant memory mode so big teams don't have to be held in memory
+    charts=False leaves the charts out (the summary only excel)'''
+
+    def __init__(self, file_name, constant_memory=True, charts=True):
+        # nan_inf_to_errors so a 0 hour shift (infinite efficiency) can't stop the whole export
+        self.workbook = xlsxwriter.Workbook(file_name, {'constant_memory': constant_memory, 'nan_inf_to_errors': True})
+        self.file_name = file_name
+        self.charts = charts
+        self.sheets_written = 0
+
+        # Creating every Format in our workbook once, all the sheets use these:
+        add_format = self.workbook.add_format
+        self.right_fmt = add_format({'align': 'right'})
+        self.header_fmt = add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        self.date_fmt = add_format({'num_format': 'YYYY-MM-DD'})
+        self.title_fmt = add_format({'align': 'left', 'font_size':21,
+                                     'bold': True})
+        self.title_fmt.set_align('left_across')
+        self.percent_fmt = add_format({'num_format': '0.0%', 'bold': True})
+        self.total_fmt = add_format({'align': 'right',
+                                     'bold': True, 'bottom':6,
+                                     'bg_color': '#85144B',
+                                     'font_color': '#FFDC00'})
+        self.total_percent_fmt = add_format({'align': 'right', 'num_format': '0.0%',
+                                             'bold': True, 'bottom':6,
+                                             'bg_color': '#85144B',
+                                             'font_color': '#FFDC00'})
+        # Light red fill with dark red text.
+        self.red_fmt = add_format({'bg_color': '#FFC7CE',
+                                   'font_color': '#9C0006'})
+        # Green fill with dark green text.
+        self.green_fmt = add_format({'bg_color': '#C6EFCE',
+                                     'font_color': '#006100'})
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        '''finishes writing the excel file'''
+        # the sheets are zipped up into the xlsx here, which is a big part of the writing time
+        with instruments.timer('write_close'):
+            self.workbook.close()
+        instruments.count('workbooks_written')
+        # file_name can also be a BytesIO (ex: an excel served straight from memory)
+        instruments.count('bytes_written', self.file_name.getbuffer().nbytes if hasattr(self.file_name, 'getbuffer') else os.path.getsize(self.file_name))
+
+
+    def write_table(self, worksheet, dataframe, startrow):
+        '''writes the header and rows of a dataframe starting at startrow - rows are written top to bottom so constant memory mode can flush them'''
+        worksheet.write_row(startrow, 0, [str(column) for column in dataframe.columns], self.header_fmt)
+
+        # pulling each column out as a plain python list once (much faster than going row by row through pandas)
+        columns = [dataframe[column].tolist() for column in dataframe.columns]
+
+        # dates need a date format to show as dates, everything else picks up the column's format
+        formats = []
+        for values in columns:
+            first = next((value for value in values if value is not None), None)
+            formats.append(self.date_fmt if isinstance(first, date) else None)
+
+        for row, values in enumerate(zip(*columns), start=startrow + 1):
+            for column, value in enumerate(values):
+                # missing values are left as empty cells like to_excel does
+                if value is None or value != value:
+                    continue
+                worksheet.write(row, column, value, formats[column])
+
+
+    def format_sheet(self, dataframe, sheet):
+        '''adds a sheet Formatted specifically for the FORMAT ANALYSIS'''
+        number_rows = len(dataframe.index)
+        worksheet = self.workbook.add_worksheet(sheet)
+        self.sheets_written += 1
+        instruments.count('sheets_written', employee=sheet)
+
+        # Setting the Column Width and Formatting (before any rows are written)
+        worksheet.set_column('A:D', 20, self.right_fmt)
+        worksheet.set_column('B:B', 20, self.percent_fmt)
 
         # Adding a Label at the top:
-        worksheet.write_string(0, 0, sheet + " Analysis of Digitizing Format Efficiency", title_fmt)
+        worksheet.write_string(0, 0, sheet + " Analysis of Digitizing Format Efficiency", self.title_fmt)
 
         # Setting the Default Zoom
         worksheet.set_zoom(120)
 
+        self.write_table(worksheet, dataframe, 2)
+        if not number_rows:
+            return
+
         # Define our range for the color formatting
         color_range = "B4:B{}".format(number_rows+3)
-       
+
         # 3 color scale from green = most efficient to red = least efficient
         worksheet.conditional_format(color_range, {'type': '3_color_scale'})
+        if not self.charts:
+            return
+
+        # the data sits in rows 4 to number_rows+3 (zero indexed 3 to number_rows+2) of this sheet
+        last_row = number_rows + 2
+        categories = [sheet, 3, 0, last_row, 0]
 
         # Create the COLUMN CHART:
-        # --------------------------------------       
-        column_chart = workbook.add_chart({'type': 'column'})
+        # --------------------------------------
+        column_chart = self.workbook.add_chart({'type': 'column'})
 
         # Configure the series of the chart from the dataframe data.
         column_chart.add_series({
-            'categories': '='+sheet+'!$A$4:$A$15',
-            'values': '='+sheet+'!$B$4:$B$15'
+            'categories': categories,
+            'values': [sheet, 3, 1, last_row, 1]
             })
 
         # Create a new line chart. This will be the secondary chart.
-        line_chart = workbook.add_chart({'type': 'line'})
+        line_chart = self.workbook.add_chart({'type': 'line'})
 
         # Add a series, on the secondary axis.
         line_chart.add_series({
-            'categories': '='+sheet+'!$A$4:$A$15',
-            'values': '='+sheet+'!$C$4:$C$15',
+            'categories': categories,
+            'values': [sheet, 3, 2, last_row, 2],
             'marker': {'type': 'automatic'},
             'y2_axis': True,
             'name': '# Digitized'
@@ -93,23 +188,23 @@ def dfs_tabs_format(df_list, sheet_list, file_name):
 
         # Set the title of the Y axes
         column_chart.set_y_axis({'name': 'Efficiency %'})
-            
+
         # Set the title of the Y2 axes - doesn't seem to work
         column_chart.set_y2_axis({'name': '# Digitized'})
-        
+
         # Insert the chart into the worksheet.
         worksheet.insert_chart('E3', column_chart)
 
 
         #### Create the PIE Chart
-        # --------------------------------------  
-        chart_pie = workbook.add_chart({'type': 'pie'})
+        # --------------------------------------
+        chart_pie = self.workbook.add_chart({'type': 'pie'})
 
         # Configure the series. Note the use of the list syntax to define ranges:
         chart_pie.add_series({
             'name':       'Formats Digitized',
-            'categories': '='+sheet+'!$A$4:$A$15',
-            'values': '='+sheet+'!$C$4:$C$15',
+            'categories': categories,
+            'values': [sheet, 3, 2, last_row, 2],
         })
 
         # Add a title.
@@ -121,98 +216,71 @@ def dfs_tabs_format(df_list, sheet_list, file_name):
         # Insert the chart into the worksheet (with an offset).
         worksheet.insert_chart('B20', chart_pie)
 
-    writer.save()
 
+    def date_sheet(self, dataframe, sheet, window=30):
+        '''adds a sheet Formatted specifically for the DATE ANALYSIS of the last `window` days worked'''
+        number_rows = len(dataframe.index)
+        worksheet = self.workbook.add_worksheet(sheet)
+        self.sheets_written += 1
+        instruments.count('sheets_written', employee=sheet)
 
-def dfs_tabs_date(df_list, sheet_list, file_name):
-    '''accepts a list of dfs, list of sheet names, and a file name - Puts multiple dataframes across MULTIPLE tabs/sheets in 1 excel'''
-    ### Formatted specifically for the DATE ANALYSIS
-
-    #this only works if all the dfs being sent are the same length/formatting
-    number_rows = len(df_list[0].index)
-
-    writer = pd.ExcelWriter(file_name, engine='xlsxwriter')
-    for dataframe, sheet in zip(df_list, sheet_list):
-        dataframe.to_excel(writer, index=False, sheet_name=sheet, startrow=2 , startcol=0)
-
-        # Get access to the workbook and sheet
-        workbook = writer.book 
-        worksheet = writer.sheets[sheet]
-
-        # Creating some Formats in our workbook to assign later:
-        right_fmt = workbook.add_format({'align': 'right'})
-        total_fmt = workbook.add_format({'align': 'right',
-                                        'bold': True, 'bottom':6,
-                                        'bg_color': '#85144B',
-                                         'font_color': '#FFDC00'})
-        percent_fmt = workbook.add_format({'num_format': '0.0%', 'bold': True})
-        total_percent_fmt = workbook.add_format({'align': 'right', 'num_format': '0.0%',
-                                         'bold': True, 'bottom':6,
-                                         'bg_color': '#85144B',
-                                         'font_color': '#FFDC00'})
-        title_fmt = workbook.add_format({'align': 'left', 'font_size':21,
-                                        'bold': True})
-        title_fmt.set_align('left_across')
-
-        # Add a format. Light red fill with dark red text.
-        format1 = workbook.add_format({'bg_color': '#FFC7CE',
-                                    'font_color': '#9C0006'})
-
-        # Add a format. Green fill with dark green text.
-        format2 = workbook.add_format({'bg_color': '#C6EFCE',
-                                    'font_color': '#006100'})
-
-        # Setting the Column Width and Formatting
-        worksheet.set_column('A:D', 20, right_fmt)
-        worksheet.set_column('D:D', 20, percent_fmt)
+        # Setting the Column Width and Formatting (before any rows are written)
+        worksheet.set_column('A:D', 20, self.right_fmt)
+        worksheet.set_column('D:D', 20, self.percent_fmt)
 
         # Adding a Label at the top:
-        worksheet.write_string(0, 0, sheet + " Analysis of Last 30 Days Worked", title_fmt)
+        worksheet.write_string(0, 0, sheet + " Analysis of Last {} Days Worked".format(window), self.title_fmt)
 
         # Setting the Default Zoom
         worksheet.set_zoom(115)
 
+        self.write_table(worksheet, dataframe, 2)
+
+        # Add a total label
+        worksheet.write_string(number_rows+3, 0, "Total:", self.total_fmt)
+
         # Add total's formula at the end similar to VBA (visual basic application) - this is doing a for loop and creating a SUM for columns 1 and 2
-        for column in range(1, 3): 
+        for column in range(1, 3):
             # Determine which cell where we will place the 'excel formula' for each column
-            cell_location = xl_rowcol_to_cell(number_rows+3, column)
+            cell_location = xlsxwriter.utility.xl_rowcol_to_cell(number_rows+3, column)
             # Get the range to use for the sum formula
-            start_range = xl_rowcol_to_cell(3, column) #start at 3rd row for that column (row 2 is title)
-            end_range = xl_rowcol_to_cell(number_rows+2, column) #end at last row for that column
+            start_range = xlsxwriter.utility.xl_rowcol_to_cell(3, column) #start at 3rd row for that column (row 2 is title)
+            end_range = xlsxwriter.utility.xl_rowcol_to_cell(number_rows+2, column) #end at last row for that column
             # Construct and write the formula for each column
             formula = "=SUM({:s}:{:s})".format(start_range, end_range)
-            worksheet.write_formula(cell_location, formula, total_fmt)
-        
-        # Add a total label
-        worksheet.write_string(number_rows+3, 0, "Total:",total_fmt)
+            worksheet.write_formula(cell_location, formula, self.total_fmt)
 
         # Add an average efficiency
         mean_formula = "=B{0}/C{0}".format(number_rows+4)
-        worksheet.write_formula(number_rows+3, 3, mean_formula, total_percent_fmt)
+        worksheet.write_formula(number_rows+3, 3, mean_formula, self.total_percent_fmt)
+        if not number_rows:
+            return
 
         # Define our range for the color formatting
         color_range = "D4:D{}".format(number_rows+3)
-        
+
         # Highlight the top values in Green
         worksheet.conditional_format(color_range, {'type': 'top',
                                                 'value': '5',
-                                                'format': format2})
+                                                'format': self.green_fmt})
 
         # Highlight the bottom values in Red
         worksheet.conditional_format(color_range, {'type': 'bottom',
                                                 'value': '5',
-                                                'format': format1})
+                                                'format': self.red_fmt})
+        if not self.charts:
+            return
 
         # Create the LINE CHART:
         # --------------------------------------
         # Create a new chart object.
-        chart = workbook.add_chart({'type': 'line'})
+        chart = self.workbook.add_chart({'type': 'line'})
 
-        # Add a series to the chart along with a trendline.
+        # Add a series to the chart along with a trendline (the data sits in rows 4 to number_rows+3 of this sheet).
         chart.add_series({
             'name':       'Efficiency Trends through Time',
-            'categories': '='+sheet+'!$A$4:$A$33',
-            'values': '='+sheet+'!$D$4:$D$33',
+            'categories': [sheet, 3, 0, number_rows + 2, 0],
+            'values': [sheet, 3, 3, number_rows + 2, 3],
             'marker': {'type': 'diamond'},
             'trendline': {
                         'type': 'polynomial',
@@ -249,28 +317,229 @@ def dfs_tabs_date(df_list, sheet_list, file_name):
         # Insert the chart into the worksheet.
         worksheet.insert_chart('F7', chart)
 
-        
-    writer.save()
 
+    def rollup_sheet(self, dataframe, sheet):
+        '''adds a sheet for a ROLLUP table (shift_rollups.ShiftRollups.table) - the periods and their efficiency, with a trend chart for team wide tables'''
+        number_rows = len(dataframe.index)
+        worksheet = self.workbook.add_worksheet(sheet)
+        self.sheets_written += 1
+        # rollup sheets aren't an employee's, so they only add to the overall count
+        instruments.count('sheets_written')
+
+        # the period is shown as its first day, the efficiency (last column) as a percent
+        last_column = len(dataframe.columns) - 1
+        worksheet.set_column(0, last_column, 20, self.right_fmt)
+        worksheet.set_column(last_column, last_column, 20, self.percent_fmt)
+        worksheet.write_string(0, 0, sheet + " Efficiency Rollup", self.title_fmt)
+        worksheet.set_zoom(115)
+
+        self.write_table(worksheet, dataframe, 2)
+        if not number_rows:
+            return
+        worksheet.conditional_format(3, last_column, number_rows + 2, last_column, {'type': '3_color_scale'})
+        # a trend line only makes sense when every row is a different period (the team wide table)
+        if not self.charts or list(dataframe.columns[:1]) != ['period']:
+            return
+
+        chart = self.workbook.add_chart({'type': 'line'})
+        chart.add_series({
+            'name':       'Efficiency',
+            'categories': [sheet, 3, 0, number_rows + 2, 0],
+            'values': [sheet, 3, last_column, number_rows + 2, last_column],
+            'marker': {'type': 'diamond'},
+        })
+        chart.set_x_axis({'date_axis': True})
+        chart.set_y_axis({'name': 'Efficiency', 'min': 0})
+        chart.set_legend({'none': True})
+        worksheet.insert_chart(3, last_column + 2, chart)
+
+
+def dfs_tabs_format(df_list, sheet_list, file_name, charts=True):
+    '''accepts a list of dfs, list of sheet names, and a file name - Puts multiple dataframes across MULTIPLE tabs/sheets in 1 excel (charts=False leaves out the charts)'''
+    ### Formatted specifically for the FORMAT ANALYSIS
+    with ReportWriter(file_name, charts=charts) as report:
+        for dataframe, sheet in zip(df_list, sheet_list):
+            with instruments.timer('write_sheet', sheet):
+                report.format_sheet(dataframe, sheet)
 
 
+def dfs_tabs_date(df_list, sheet_list, file_name, window=30, charts=True, rollups=None):
+    '''accepts a list of dfs, list of sheet names, a file name and how many days worked the dfs cover - Puts multiple dataframes across MULTIPLE tabs/sheets in 1 excel (charts=False leaves out the charts)
+    rollups can be a {sheet name : rollup table} to add after the employees' sheets (see ReportWriter.rollup_sheet)'''
+    ### Formatted specifically for the DATE ANALYSIS
+    with ReportWriter(file_name, charts=charts) as report:
+        for dataframe, sheet in zip(df_list, sheet_list):
+            with instruments.timer('write_sheet', sheet):
+                report.date_sheet(dataframe, sheet, window)
+        # (the rollup sheets are only timed overall - their names aren't employees)
+        for sheet, dataframe in (rollups or {}).items():
+            with instruments.timer('write_sheet'):
+                report.rollup_sheet(dataframe, sheet)
+
+
+def dfs_tabs_sharded(df_list, sheet_list, file_name, kind, shard_size=1, workers=None, merge=False, window=30):
+    '''accepts a list of dfs, list of sheet names, a file name and kind ('date' or 'format') - Puts every shard_size dataframes in their OWN excel
+    (written in parallel) inside a folder named after file_name along with an index.xlsx linking to every sheet. merge=True also builds file_name from the shards
+    window is the number of days worked in date analyses (see dfs_tabs_date)'''
+    directory = os.path.splitext(file_name)[0]
+    os.makedirs(directory, exist_ok=True)
+
+    # splitting the sheets into groups of shard_size - each group is one shard excel
+    shards = []
+    for number, start in enumerate(range(0, len(df_list), shard_size), start=1):
+        shard_name = os.path.join(directory, 'shard_{:04d}.xlsx'.format(number))
+        shards.append((kind, df_list[start:start + shard_size], sheet_list[start:start + shard_size], shard_name, window))
+
+    # every shard is its own workbook so they can all be written at the same time
+    with ProcessPoolExecutor(max_workers=workers, initializer=instrumentation.start_worker, initargs=instrumentation.worker_settings()) as pool:
+        for measurements in pool.map(write_shard, *zip(*shards)):
+            # the time and sheets/bytes written in the workers go in with this process's measurements
+            instruments.merge(measurements)
+
+    shard_files = [shard[3] for shard in shards]
+    with instruments.timer('write_index'):
+        write_shard_index(shard_files, [shard[2] for shard in shards], os.path.join(directory, 'index.xlsx'))
+    if merge:
+        with instruments.timer('merge_shards'):
+            merge_shards(shard_files, file_name, kind, window)
+    return shard_files
+
+
+def write_shard(kind, df_list, sheet_list, file_name, window=30):
+    '''writes one shard excel for dfs_tabs_sharded (runs in the process pool) and returns what the worker's instruments measured'''
+    if kind == 'date':
+        dfs_tabs_date(df_list, sheet_list, file_name, window)
+    else:
+        dfs_tabs_format(df_list, sheet_list, file_name)
+    return instruments.collect()
+
+
+def write_shard_index(shard_files, shard_sheets, file_name):
+    '''writes an excel listing every sheet with a link to it in the shard excel it was written to'''
+    with ReportWriter(file_name) as report:
+        worksheet = report.workbook.add_worksheet('Index')
+        worksheet.set_column('A:B', 30)
+        worksheet.write_string(0, 0, 'Analysis Index', report.title_fmt)
+        worksheet.write_row(2, 0, ['Sheet', 'Shard'], report.header_fmt)
+        row = 3
+        for shard_file, sheets in zip(shard_files, shard_sheets):
+            shard = os.path.basename(shard_file)
+            for sheet in sheets:
+                # links are relative so the folder can be moved around as a whole
+                worksheet.write_url(row, 0, "external:{}#'{}'!A1".format(shard, sheet), string=sheet)
+                worksheet.write_string(row, 1, shard)
+                row += 1
+
+
+def merge_shards(shard_files, file_name, kind, window=30):
+    '''reads the sheets back out of shard excels written by dfs_tabs_sharded and puts them all in 1 excel (same as dfs_tabs_date/dfs_tabs_format would)'''
+    df_list = []
+    sheet_list = []
+    for shard_file in shard_files:
+        # the tables start under the title on row 3
+        for sheet, dataframe in pd.read_excel(shard_file, sheet_name=None, header=2).items():
+            if kind == 'date':
+                # dropping the Total: row and turning the dates back into dates
+                dataframe = dataframe.iloc[:-1].copy()
+                dataframe['date_worked'] = pd.to_datetime(dataframe['date_worked']).dt.date
+            else:
+                dataframe.index = dataframe['Format'].to_numpy()
+            df_list.append(dataframe)
+            sheet_list.append(sheet)
+
+    if kind == 'date':
+        dfs_tabs_date(df_list, sheet_list, file_name, window)
+    else:
+        dfs_tabs_format(df_list, sheet_list, file_name)
+
+
+
+
+# every way the analyses can be written out - xlsx is the styled excel for people, the rest are for other programs
+OUTPUT_BACKENDS = ('xlsx', 'xlsx-summary', 'parquet', 'csv', 'ndjson')
+
+
+def backend_available(backend):
+    '''returns whether the libraries an output backend needs are installed (parquet needs pyarrow or fastparquet)'''
+    if backend == 'parquet':
+        return any(importlib.util.find_spec(name) is not None for name in ('pyarrow', 'fastparquet'))
+    return backend in OUTPUT_BACKENDS
+
+
+def write_analyses(df_list, sheet_list, file_name, kind, backend='xlsx', window=30, rollups=None):
+    '''accepts a list of dfs, list of sheet names, a file name, kind ('date' or 'format') and an output backend - writes the analyses and returns the paths written
+      xlsx          the styled excel with charts (dfs_tabs_date/dfs_tabs_format)
+      xlsx-summary  the same excel without any charts
+      parquet, csv, ndjson  a folder named after file_name with one file per sheet name, plus one long table of every df
+                            with an 'employee' column in file_name (with the backend's extension)
+    date analyses can also get rollups {sheet name : rollup table} - extra sheets in the excel, or extra files in the folder'''
+    if backend not in OUTPUT_BACKENDS:
+        raise ValueError('unknown output backend ' + str(backend) + ' - use one of ' + ', '.join(OUTPUT_BACKENDS))
+    if not backend_available(backend):
+        raise ImportError('the ' + backend + ' backend needs pyarrow (pip install pyarrow)')
+
+    if backend in ('xlsx', 'xlsx-summary'):
+        charts = backend == 'xlsx'
+        if kind == 'date':
+            dfs_tabs_date(df_list, sheet_list, file_name, window, charts, rollups)
+        else:
+            dfs_tabs_format(df_list, sheet_list, file_name, charts)
+        return [file_name]
+
+    extension = '.json' if backend == 'ndjson' else '.' + backend
+    directory = os.path.splitext(file_name)[0]
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for dataframe, sheet in zip(df_list, sheet_list):
+        with instruments.timer('write_sheet', sheet):
+            paths.append(write_table_file(dataframe, os.path.join(directory, sheet + extension), backend))
+        instruments.count('sheets_written', employee=sheet)
+    # (the rollups are only timed and counted overall - their names aren't employees)
+    for sheet, dataframe in (rollups or {}).items():
+        with instruments.timer('write_sheet'):
+            paths.append(write_table_file(dataframe, os.path.join(directory, sheet + extension), backend))
+        instruments.count('sheets_written')
+    # the long table has every row of every df under the name of its sheet
+    long_table = pd.concat([dataframe.reset_index(drop=True) for dataframe in df_list], ignore_index=True) if df_list else pd.DataFrame()
+    long_table.insert(0, 'employee', np.repeat(list(sheet_list[:len(df_list)]), [len(dataframe) for dataframe in df_list]))
+    with instruments.timer('write_long_table'):
+        paths.append(write_table_file(long_table, directory + extension, backend))
+    return paths
+
+
+def write_table_file(dataframe, path, backend):
+    '''writes one dataframe (without its index) to path as parquet, csv or newline delimited json and returns the path'''
+    if backend == 'parquet':
+        # parquet keeps the dates as real dates
+        dataframe.to_parquet(path, index=False)
+    else:
+        # text formats get the dates as YYYY-MM-DD
+        dataframe = dataframe.copy()
+        for column in dataframe.columns:
+            if dataframe[column].dtype == object and len(dataframe) and isinstance(dataframe[column].iloc[0], date):
+                dataframe[column] = dataframe[column].astype(str)
+        if backend == 'csv':
+            dataframe.to_csv(path, index=False)
+        else:
+            dataframe.to_json(path, orient='records', lines=True)
+    instruments.count('bytes_written', os.path.getsize(path))
+    return path
+
 
 def dfs_tabs(df_list, sheet_list, file_name):
     '''accepts a list of dfs, list of sheet names, and a file name - Puts multiple dataframes across MULTIPLE tabs/sheets in 1 excel'''
-    writer = pd.ExcelWriter(file_name, engine='xlsxwriter')
-    for dataframe, sheet in zip(df_list, sheet_list):
-        dataframe.to_excel(writer, index=False, sheet_name=sheet, startrow=0 , startcol=0)
-    writer.save()
+    with pd.ExcelWriter(file_name, engine='xlsxwriter') as writer:
+        for dataframe, sheet in zip(df_list, sheet_list):
+            dataframe.to_excel(writer, index=False, sheet_name=sheet, startrow=0 , startcol=0)
 
 
 def multiple_dfs(df_list, sheet, file_name, spaces):
     '''accepts a list of dfs, list of sheet names, and a file name - Puts multiple dataframes into ONE SINGLE sheet in 1 excel'''
-    writer = pd.ExcelWriter(file_name, engine='xlsxwriter')
-    row = 0
-    for dataframe in df_list:
-        dataframe.to_excel(writer, index=False, sheet_name=sheet, startrow=row, startcol=0)
-        row = row + len(dataframe.index) + spaces + 1
-    writer.save()
+    with pd.ExcelWriter(file_name, engine='xlsxwriter') as writer:
+        row = 0
+        for dataframe in df_list:
+            dataframe.to_excel(writer, index=False, sheet_name=sheet, startrow=row, startcol=0)
+            row = row + len(dataframe.index) + spaces + 1
 
 
 
@@ -297,6 +566,105 @@ def time_dif(time1, time2):
     return round(hours, 1)
 
 
+def time_dif_series(times1, times2):
+    '''accepts two Series of HH:MM:SS strings (or integer seconds since midnight) with times2 being after times1 and returns a Series of differences in hours - batch version of time_dif'''
+    seconds1 = time_to_seconds(times1).astype('int64')
+    seconds2 = time_to_seconds(times2).astype('int64')
+    # the modulo assumes times2 is always after times1 and just crosses midnight (same as time_dif)
+    delta = (seconds2 - seconds1) % 86400
+    # splitting into h, m, s and adding them up in the same order as time_dif so the floats come out identical
+    h = delta // 3600
+    m = (delta % 3600) // 60
+    s = delta % 60
+    hours = h + (m / 60) + (s / 3600)
+
+    return round_series(hours, 1)
+
+
+def time_to_seconds(times):
+    '''accepts a Series of HH:MM:SS strings and returns them as int32 seconds since midnight (Series that are already numbers come back as int32)'''
+    if pd.api.types.is_numeric_dtype(times):
+        return times.astype('int32')
+    # parsing the whole column at once instead of one strptime per row
+    parsed = pd.to_datetime(times, format='%H:%M:%S')
+    return (parsed.dt.hour * 3600 + parsed.dt.minute * 60 + parsed.dt.second).astype('int32')
+
+
+def seconds_to_time(seconds):
+    '''accepts a Series of seconds since midnight and returns them as H:MM:SS strings (the way the clock columns look in the excels)'''
+    return pd.Series(['{}:{:02d}:{:02d}'.format(second // 3600, second // 60 % 60, second % 60) for second in seconds.tolist()],
+                     index=seconds.index, dtype=object)
+
+
+def round_series(values, digits):
+    '''accepts a Series of floats and rounds it exactly like the built in round() would for every value'''
+    # np.round multiplies out first so it can disagree with round() on values sitting right on a half (ex: 0.05)
+    rounded = values.round(digits)
+    scaled = values * 10**digits
+    halves = (scaled - np.floor(scaled) - 0.5).abs() < 1e-6
+    # only those few values get sent through the built in round
+    if halves.any():
+        rounded[halves] = [round(value, digits) for value in values[halves]]
+    return rounded
+
+
+
+
+class DateParser(object):
+    '''turns a column of dates into datetime64 - text dates are parsed with one vectorized call using format and every distinct text
+    is remembered, so dates repeated across rows and files of a batch are only ever parsed once. native excel dates (datetimes) and
+    excel serial day numbers are converted as they are'''
+
+    def __init__(self, format='%Y/%m/%d'):
+        self.format = format
+        self.memo = {} #{date text : datetime64}
+        self.hits = 0
+        self.misses = 0
+
+
+    def parse(self, dates):
+        '''returns dates (a Series of text, datetimes and/or excel day numbers) as a datetime64 Series with the same index - blanks come back as NaT'''
+        dates = pd.Series(dates)
+        # every distinct value is only looked at once, the rows just point at them
+        codes, uniques = pd.factorize(dates)
+        parsed = np.empty(len(uniques), dtype='datetime64[ns]')
+
+        text = np.array([isinstance(value, str) for value in uniques], dtype=bool)
+        if text.any():
+            texts = uniques[text]
+            new_texts = [value for value in texts if value not in self.memo]
+            if new_texts:
+                self.memo.update(zip(new_texts, pd.to_datetime(pd.Series(new_texts), format=self.format).to_numpy()))
+            self.misses += len(new_texts)
+            self.hits += len(texts) - len(new_texts)
+            instruments.count('dates_parsed', len(new_texts))
+            parsed[text] = [self.memo[value] for value in texts]
+
+        if not text.all():
+            others = pd.Series(uniques[~text], dtype=object)
+            numbers = others.map(lambda value: isinstance(value, (int, float)) and not isinstance(value, bool)).to_numpy(dtype=bool)
+            converted = pd.Series(pd.NaT, index=others.index, dtype='datetime64[ns]')
+            # excel counts days from 1899-12-30 when a date cell comes through as a plain number
+            if numbers.any():
+                converted[numbers] = pd.to_datetime(others[numbers].astype(float), unit='D', origin='1899-12-30')
+            if not numbers.all():
+                converted[~numbers] = pd.to_datetime(others[~numbers].tolist())
+            parsed[~text] = converted.to_numpy()
+
+        # factorize marks blanks with -1, which stay NaT
+        result = np.full(len(codes), np.datetime64('NaT'), dtype='datetime64[ns]')
+        found = codes >= 0
+        result[found] = parsed[codes[found]]
+        return pd.Series(result, index=dates.index, name=dates.name)
+
+
+    def clear(self):
+        '''forgets every remembered date (ex: at the end of a batch)'''
+        self.memo.clear()
+        self.hits = 0
+        self.misses = 0
+
+
 
 
 #------------------------------
@@ -461,3 +829,32 @@ if __name__ == "__main__":
     time1 = '9:48:28'
     time2 = '19:40:17'
     print('Testing time_dif:', str(time_dif(time1, time2)) == '9:51:49')
+
+    # batch version has to match time_dif row for row (crossing midnight and landing on a half included)
+    times1 = pd.Series(['9:48:28', '22:15:00', '9:00:00', '23:59:59', '9:43:17'])
+    times2 = pd.Series(['19:40:17', '1:30:30', '9:03:00', '0:00:00', '9:43:17'])
+    print('Testing time_dif_series:', list(time_dif_series(times1, times2)) == [time_dif(t1, t2) for t1, t2 in zip(times1, times2)])
+
+    ratios = pd.Series([9.1, 0.05, 2.675, 1.0005, 5.2]) / pd.Series([1.0, 1.0, 1.0, 1.0, 6.4])
+    print('Testing time_to_seconds:', list(seconds_to_time(time_to_seconds(times1))) == list(times1)
+          and list(time_dif_series(time_to_seconds(times1), time_to_seconds(times2))) == list(time_dif_series(times1, times2)))
+
+    parser = DateParser()
+    mixed = pd.Series(['2004/03/05', datetime(2013, 9, 25), '2004/03/05', None, 38000, date(2006, 1, 9)])
+    expected = pd.to_datetime(['2004-03-05', '2013-09-25', '2004-03-05', None, '2004-01-14', '2006-01-09'])
+    print('Testing DateParser:', parser.parse(mixed).equals(pd.Series(expected)) and parser.parse(mixed[:1]).dtype == 'datetime64[ns]'
+          and (parser.hits, parser.misses) == (1, 1))
+
+    print('Testing round_series:', list(round_series(ratios, 3)) == [round(ratio, 3) for ratio in ratios])
+
+    # and match the old per-row loop on every sample shift file in the data folder
+    import glob, os
+    matches = True
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', '*.xlsx'))):
+        shifts = pd.read_excel(path)
+        hours = time_dif_series(shifts['clock_in'], shifts['clock_out'])
+        efficiency = (shifts['hours_digitized'] / hours).round(3)
+        for i in range(len(shifts)):
+            row_hours = time_dif(shifts.loc[i, 'clock_in'], shifts.loc[i, 'clock_out'])
+            matches = matches and hours[i] == row_hours and efficiency[i] == round(shifts.loc[i, 'hours_digitized'] / row_hours, 3)
+    print('Testing time_dif_series on data folder:', matches)